@@ -1,8 +1,22 @@
+import json
+import math
 import os
-import uuid
-from flask import Flask, request, render_template, redirect, url_for, send_from_directory, flash
-from gif_generator import download_video_segment, convert_to_gif, add_text_overlay
-from yt_dlp import DownloadError # Import DownloadError to catch it specifically if needed
+import time
+import zipfile
+from dataclasses import asdict
+from flask import Flask, abort, request, render_template, redirect, url_for, flash, jsonify, make_response
+from PIL import Image
+from gif_generator import (check_time_range, convert_cached, create_gif, create_gifs, normalize_video_id,
+                           render_cache_key, Clip, PreviewSettings, TextOverlay, TimeRangeError)
+from budget import RenderBudget
+from formats import INTERMEDIATE, OUTPUT_FORMATS, get_format
+from cache import MetadataCache, ResultCache, SegmentCache, cache_key
+from jobs import JobQueue, SQLiteJobStore, Job, DONE, FAILED
+from singleflight import SingleFlight
+from renderpool import RenderPool
+from janitor import Janitor
+from delivery import URL_DIGEST_LENGTH, ContentDigests, send_rendered
+from metrics import REGISTRY, Counter, Gauge, Histogram, current_trace, tracing
 
 app = Flask(__name__)
 app.secret_key = os.urandom(24) # For flashing messages
@@ -12,119 +26,835 @@ TEMP_VIDEO_FOLDER = 'temp_videos'
 GENERATED_GIF_FOLDER = 'static/generated_gifs' # static is conventional for Flask
 app.config['TEMP_VIDEO_FOLDER'] = TEMP_VIDEO_FOLDER
 app.config['GENERATED_GIF_FOLDER'] = GENERATED_GIF_FOLDER
+# GIF encoder backend (see encoders.ENCODERS) and options passed through to it
+app.config['GIF_ENCODER'] = os.environ.get('GIF_ENCODER', 'stream')
+app.config['GIF_ENCODER_OPTIONS'] = {}
+# The stream encoder only stores pixels that changed by more than this since
+# the previous frames (0-254; empty stores every frame whole)
+if app.config['GIF_ENCODER'] == 'stream' and os.environ.get('GIF_DELTA_THRESHOLD', '8'):
+    app.config['GIF_ENCODER_OPTIONS']['delta_threshold'] = int(os.environ.get('GIF_DELTA_THRESHOLD', '8'))
+# How downloaded ranges are cut out of the source (see gif_generator.CUT_MODES):
+# 'copy' keeps the source's video as it is, 'encode' re-encodes it
+app.config['CUT_MODE'] = os.environ.get('CUT_MODE', 'copy')
+# Rendering runs in child processes, one per core by default (0 renders on the
+# job threads); a render running longer than RENDER_TIMEOUT seconds is killed
+app.config['RENDER_WORKERS'] = int(os.environ.get('RENDER_WORKERS', os.cpu_count() or 1))
+app.config['RENDER_TIMEOUT'] = float(os.environ.get('RENDER_TIMEOUT', 300))
+# Background generation jobs: worker threads per process, and an optional SQLite
+# database so several app processes share one queue (in-process when unset).
+# Requests finding JOB_BACKLOG jobs already queued are turned away with a 503.
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', max(2, 2 * app.config['RENDER_WORKERS'])))
+app.config['JOB_DATABASE'] = os.environ.get('JOB_DATABASE', '')
+app.config['JOB_BACKLOG'] = int(os.environ.get('JOB_BACKLOG', 20))
+# A running job whose process stopped renewing its lease for JOB_LEASE seconds
+# (it crashed or was restarted) is queued again, or failed after
+# JOB_MAX_ATTEMPTS tries; finished jobs are forgotten after JOB_RESULT_TTL seconds
+app.config['JOB_LEASE'] = float(os.environ.get('JOB_LEASE', 60))
+app.config['JOB_MAX_ATTEMPTS'] = int(os.environ.get('JOB_MAX_ATTEMPTS', 2))
+app.config['JOB_RESULT_TTL'] = float(os.environ.get('JOB_RESULT_TTL', 24 * 3600))
+# Previews are at most this wide and this many frames, with a coarse palette
+app.config['PREVIEW'] = PreviewSettings(width=int(os.environ.get('PREVIEW_WIDTH', 240)),
+                                        max_frames=int(os.environ.get('PREVIEW_MAX_FRAMES', 36)))
+# GIFs run at OUTPUT_FPS unless a request asks for another rate, and are scaled
+# down to fit OUTPUT_MAX_WIDTH x OUTPUT_MAX_HEIGHT; requests for more than
+# OUTPUT_MAX_FPS or a larger size are held to these caps
+app.config['OUTPUT_FPS'] = float(os.environ.get('OUTPUT_FPS', 10))
+app.config['OUTPUT_MAX_FPS'] = float(os.environ.get('OUTPUT_MAX_FPS', 30))
+app.config['OUTPUT_MAX_WIDTH'] = int(os.environ.get('OUTPUT_MAX_WIDTH', 1280))
+app.config['OUTPUT_MAX_HEIGHT'] = int(os.environ.get('OUTPUT_MAX_HEIGHT', 1280))
+# Most clips a single /batch request may ask for
+app.config['BATCH_MAX_CLIPS'] = int(os.environ.get('BATCH_MAX_CLIPS', 20))
+# Finished GIFs are cached by render parameters; least recently used ones are
+# evicted once the folder outgrows this many bytes
+app.config['RESULT_CACHE_MAX_BYTES'] = int(os.environ.get('RESULT_CACHE_MAX_BYTES', 1024 ** 3))
+# ...and once nobody has viewed or downloaded them for this many seconds
+app.config['RESULT_CACHE_MAX_AGE'] = float(os.environ.get('RESULT_CACHE_MAX_AGE', 7 * 24 * 3600))
+# Downloaded source segments are kept so caption-only changes skip the download
+app.config['SEGMENT_CACHE_FOLDER'] = os.path.join(TEMP_VIDEO_FOLDER, 'segments')
+app.config['SEGMENT_CACHE_MAX_BYTES'] = int(os.environ.get('SEGMENT_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+app.config['SEGMENT_CACHE_MAX_AGE'] = int(os.environ.get('SEGMENT_CACHE_MAX_AGE', 6 * 3600))
+# Every render keeps a lossless copy of its captioned frames, so other output
+# formats (WebP, MP4, ...) of it can be made later without the source
+app.config['INTERMEDIATE_CACHE_FOLDER'] = os.path.join(TEMP_VIDEO_FOLDER, 'intermediates')
+app.config['INTERMEDIATE_CACHE_MAX_BYTES'] = int(os.environ.get('INTERMEDIATE_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+app.config['INTERMEDIATE_CACHE_MAX_AGE'] = float(os.environ.get('INTERMEDIATE_CACHE_MAX_AGE', 24 * 3600))
+# What yt-dlp resolved for a video (duration, stream URLs) is kept for this many
+# seconds, or until the stream URLs expire if that is sooner
+app.config['METADATA_CACHE_FOLDER'] = os.path.join(TEMP_VIDEO_FOLDER, 'metadata')
+app.config['METADATA_CACHE_TTL'] = int(os.environ.get('METADATA_CACHE_TTL', 1800))
+# A background janitor enforces the quotas and ages above every JANITOR_INTERVAL
+# seconds, and removes scratch files older than the longest a job can take,
+# which crashed jobs leave behind
+app.config['JANITOR_INTERVAL'] = float(os.environ.get('JANITOR_INTERVAL', 600))
+app.config['MAX_JOB_SECONDS'] = float(os.environ.get('MAX_JOB_SECONDS', max(3600, 2 * app.config['RENDER_TIMEOUT'])))
+# Rendered files are sent by the app unless FILE_OFFLOAD hands the transfer to a
+# fronting proxy: 'x-accel-redirect' (nginx; the file is named as
+# FILE_OFFLOAD_PREFIX plus its file name, an internal location aliased to the
+# generated GIF folder) or 'x-sendfile' (Apache mod_xsendfile, lighttpd)
+app.config['FILE_OFFLOAD'] = os.environ.get('FILE_OFFLOAD', '')
+app.config['FILE_OFFLOAD_PREFIX'] = os.environ.get('FILE_OFFLOAD_PREFIX', '/internal/generated_gifs/')
+# Rendezvous for identical in-flight requests across the app processes on this host
+app.config['SINGLE_FLIGHT_FOLDER'] = os.path.join(TEMP_VIDEO_FOLDER, 'inflight')
+# With several app processes, a folder where each writes its counters and
+# histograms so /metrics sums them across all (per process when unset)
+app.config['METRICS_FOLDER'] = os.environ.get('METRICS_FOLDER', '')
 
 # Ensure directories exist
 os.makedirs(TEMP_VIDEO_FOLDER, exist_ok=True)
 os.makedirs(GENERATED_GIF_FOLDER, exist_ok=True)
 
+result_cache = ResultCache(GENERATED_GIF_FOLDER, max_bytes=app.config['RESULT_CACHE_MAX_BYTES'],
+                           extensions=tuple(fmt.extension for fmt in OUTPUT_FORMATS.values()) + ('.zip',),
+                           max_age=app.config['RESULT_CACHE_MAX_AGE'], name='results')
+intermediate_cache = ResultCache(app.config['INTERMEDIATE_CACHE_FOLDER'], max_bytes=app.config['INTERMEDIATE_CACHE_MAX_BYTES'],
+                                 extension=INTERMEDIATE.extension, max_age=app.config['INTERMEDIATE_CACHE_MAX_AGE'],
+                                 name='intermediates')
+segment_cache = SegmentCache(app.config['SEGMENT_CACHE_FOLDER'], max_bytes=app.config['SEGMENT_CACHE_MAX_BYTES'],
+                             max_age=app.config['SEGMENT_CACHE_MAX_AGE'], name='segments')
+metadata_cache = MetadataCache(app.config['METADATA_CACHE_FOLDER'], ttl=app.config['METADATA_CACHE_TTL'], name='metadata')
+single_flight = SingleFlight(lock_dir=app.config['SINGLE_FLIGHT_FOLDER'])
+content_digests = ContentDigests()
+render_pool = RenderPool(app.config['RENDER_WORKERS'], timeout=app.config['RENDER_TIMEOUT']) if app.config['RENDER_WORKERS'] > 0 else None
+
+# Prometheus metrics, served at /metrics; every app process has its own,
+# summed across the processes sharing METRICS_FOLDER
+if app.config['METRICS_FOLDER']:
+    REGISTRY.share(app.config['METRICS_FOLDER'])
+STAGE_SECONDS = Histogram('gif_stage_seconds', 'Seconds spent in each stage of a generation job', ['stage'])
+JOB_SECONDS = Histogram('gif_job_seconds', 'Seconds from picking up a generation job to its outcome', ['outcome'])
+JOB_ERRORS = Counter('gif_job_errors_total', 'Failed generation jobs by exception type', ['type'])
+DOWNLOADED_BYTES = Counter('gif_downloaded_bytes_total', 'Bytes of source segments fetched')
+OUTPUT_BYTES = Counter('gif_output_bytes_total', 'Bytes of GIFs and other formats rendered')
+JOBS_IN_FLIGHT = Gauge('gif_jobs_in_flight', 'Generation jobs queued or running', ['state'])
+RECLAIMED_BYTES = Counter('gif_janitor_reclaimed_bytes_total', 'Bytes of disk space the janitor freed', ['area'])
+RECLAIMED_FILES = Counter('gif_janitor_reclaimed_files_total', 'Files and job directories the janitor removed', ['area'])
+CACHE_ENTRIES = Gauge('gif_cache_entries', 'Entries in each cache', ['cache'])
+CACHE_BYTES = Gauge('gif_cache_bytes', 'Bytes taken by the entries of each cache', ['cache'])
+FILE_RESPONSES = Counter('gif_file_responses_total', 'Responses serving rendered files by route and status code',
+                         ['route', 'status'])
+
+def report_sweep(report):
+    """Counts what a janitor sweep reclaimed and logs it if anything."""
+    for area, entry in report.areas.items():
+        RECLAIMED_BYTES.inc(entry['bytes'], area=area)
+        RECLAIMED_FILES.inc(entry['files'], area=area)
+    if report.files:
+        print(json.dumps({'event': 'janitor', 'files': report.files, 'bytes': report.bytes, 'areas': report.areas,
+                          'seconds': report.seconds}), flush=True)
+
+janitor = Janitor({'results': result_cache, 'intermediates': intermediate_cache, 'segments': segment_cache,
+                   'metadata': metadata_cache}, TEMP_VIDEO_FOLDER, max_job_seconds=app.config['MAX_JOB_SECONDS'],
+                  interval=app.config['JANITOR_INTERVAL'], on_sweep=report_sweep)
+
+@app.before_request
+def start_janitor():
+    # Started on first use rather than on import, like the job workers
+    janitor.start()
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
-@app.route('/generate', methods=['POST'])
-def generate_gif():
-    video_path = None 
-    temp_gif_path = None
+def run_generate_job(params: dict, report_progress) -> dict:
+    """
+    Downloads and renders one GIF; runs on a JobQueue worker thread.
+
+    Identical requests that are already being rendered, in this process or
+    another one, wait for that render instead of starting their own.
+
+    A ``preview`` job renders a quick, rough GIF of the clip instead; the
+    format and limits are left for the full render.
+    """
+    overlays = [TextOverlay(params['meme_text'], start_time=params['text_start_time'])]
+    preview = app.config['PREVIEW'] if params.get('preview') else None
+    output_format = 'gif' if preview else params.get('output_format', 'gif')
+    budget = None
+    if not preview and (params.get('max_bytes') or params.get('max_seconds')):
+        budget = RenderBudget(max_bytes=params.get('max_bytes'), max_seconds=params.get('max_seconds'))
+    # Jobs queued before output limits existed ran at 10 fps at the source size
+    fps, max_width, max_height = params.get('fps', 10), params.get('max_width'), params.get('max_height')
+    key = render_cache_key(params['youtube_url'], params['video_start_time'], params['video_end_time'], overlays, fps,
+                           app.config['GIF_ENCODER'], app.config['GIF_ENCODER_OPTIONS'], budget, preview,
+                           max_width, max_height)
+
+    def generate():
+        led.append(True)
+        result = create_gif(params['youtube_url'], params['video_start_time'], params['video_end_time'],
+                            output_dir=app.config['GENERATED_GIF_FOLDER'], overlays=overlays, fps=fps,
+                            encoder=app.config['GIF_ENCODER'], encoder_options=app.config['GIF_ENCODER_OPTIONS'],
+                            temp_dir=app.config['TEMP_VIDEO_FOLDER'], cache=result_cache, segment_cache=segment_cache,
+                            report_progress=report_progress, render_pool=render_pool, budget=budget,
+                            output_format=output_format, intermediate_cache=intermediate_cache,
+                            metadata_cache=metadata_cache, preview=preview, cut_mode=app.config['CUT_MODE'],
+                            max_width=max_width, max_height=max_height)
+        if not result.cached:
+            OUTPUT_BYTES.inc(result.output_bytes)
+        return {'filename': os.path.basename(result.path), 'cached': result.cached,
+                'plan': asdict(result.plan) if result.plan else None, 'bytes': result.output_bytes,
+                'stages': current_trace().to_dict()}
+
+    # Set when this call ran generate() rather than waiting for another one
+    led = []
+    started = time.perf_counter()
+    with tracing() as trace:
+        try:
+            result = single_flight.do(key + get_format(output_format).extension, generate)
+        except Exception as e:
+            record_job(params, time.perf_counter() - started, trace, error=e)
+            raise
+    record_job(params, time.perf_counter() - started, trace, result=result, shared=not led)
+    return result
+
+def record_job(params: dict, seconds: float, trace, result: dict = None, error: Exception = None,
+               shared: bool = False):
+    """
+    Adds a finished generation job to the metrics and logs it as one JSON
+    line with its per-stage breakdown. Stage metrics only count work done
+    by this job, not a render it shared with an identical one.
+    """
+    observe_stages(trace)
+    line = {
+        'event': 'generate',
+        'video_id': normalize_video_id(params['youtube_url']),
+        'start': params['video_start_time'],
+        'end': params['video_end_time'],
+        'format': params.get('output_format', 'gif'),
+        'seconds': round(seconds, 4),
+    }
+    if error is not None:
+        outcome = 'failed'
+        line.update(error_type=count_error(error), error=str(error), stages=trace.to_dict())
+    else:
+        outcome = 'cached' if result['cached'] else 'done'
+        line.update(shared=shared, bytes=result.get('bytes'),
+                    stages=result.get('stages') if shared else trace.to_dict())
+    JOB_SECONDS.observe(seconds, outcome=outcome)
+    line['outcome'] = outcome
+    print(json.dumps(line), flush=True)
+
+def observe_stages(trace):
+    """Adds the stages of a finished job to the stage and download metrics."""
+    for name, entry in trace.stages.items():
+        STAGE_SECONDS.observe(entry['seconds'], stage=name)
+    if 'download' in trace.stages:
+        DOWNLOADED_BYTES.inc(trace.stages['download']['bytes'])
+
+def count_error(error: Exception) -> str:
+    """Counts a failure in JOB_ERRORS and returns the name of its type."""
+    # Errors relayed from another process carry the original type name
+    error_type = getattr(error, 'error_type', type(error).__name__)
+    JOB_ERRORS.inc(type=error_type if error_type in ('DownloadError', 'FileNotFoundError') else 'other')
+    return error_type
+
+def run_batch_job(params: dict, report_progress) -> dict:
+    """
+    Renders every clip of a /batch request from one download per range of
+    the video (see gif_generator.create_gifs); runs on a JobQueue worker.
+
+    The result is a manifest with an entry per clip, either the file it
+    produced or why it failed, and the name of a zip of every file that was
+    produced if the request asked for one. Failed clips never fail the
+    job, so clients always get the manifest.
+    """
+    clips = [Clip(spec['video_start_time'], spec['video_end_time'],
+                  [TextOverlay(spec['meme_text'], start_time=spec['text_start_time'])]) for spec in params['clips']]
+    output_format = params.get('output_format', 'gif')
+    started = time.perf_counter()
+    with tracing() as trace:
+        results = create_gifs(params['youtube_url'], clips, output_dir=app.config['GENERATED_GIF_FOLDER'],
+                              fps=params.get('fps', 10), max_width=params.get('max_width'),
+                              max_height=params.get('max_height'),
+                              encoder=app.config['GIF_ENCODER'], encoder_options=app.config['GIF_ENCODER_OPTIONS'],
+                              temp_dir=app.config['TEMP_VIDEO_FOLDER'], cache=result_cache,
+                              segment_cache=segment_cache, report_progress=report_progress, render_pool=render_pool,
+                              output_format=output_format, intermediate_cache=intermediate_cache,
+                              metadata_cache=metadata_cache, cut_mode=app.config['CUT_MODE'])
+    observe_stages(trace)
+
+    manifest = []
+    for index, (spec, result) in enumerate(zip(params['clips'], results)):
+        entry = {'index': index, 'start': spec['video_start_time'], 'end': spec['video_end_time'],
+                 'text': spec['meme_text']}
+        if isinstance(result, Exception):
+            error_type = count_error(result)
+            entry.update(status=FAILED, error_type=error_type, error=error_message(error_type, str(result)))
+        else:
+            if not result.cached:
+                OUTPUT_BYTES.inc(result.output_bytes)
+            entry.update(status=DONE, filename=os.path.basename(result.path), cached=result.cached,
+                         bytes=result.output_bytes)
+        manifest.append(entry)
+
+    done = [entry for entry in manifest if entry['status'] == DONE]
+    failed = len(manifest) - len(done)
+    outcome = 'failed' if not done else 'partial' if failed else 'done'
+    seconds = time.perf_counter() - started
+    JOB_SECONDS.observe(seconds, outcome=outcome)
+    print(json.dumps({'event': 'batch', 'video_id': normalize_video_id(params['youtube_url']), 'clips': len(manifest),
+                      'failed': failed, 'format': output_format, 'seconds': round(seconds, 4),
+                      'stages': trace.to_dict(), 'outcome': outcome}), flush=True)
+    return {'clips': manifest, 'zip': bundle_zip(done) if params.get('zip') and done else None,
+            'stages': trace.to_dict()}
+
+def bundle_zip(entries: list) -> str:
+    """
+    Zips the files of finished manifest entries, numbered in clip order,
+    into the result cache; returns the zip's file name. The same files
+    always make the same zip, so it is only written once.
+    """
+    members = [[f"clip-{entry['index'] + 1:02d}{os.path.splitext(entry['filename'])[1]}", entry['filename']]
+               for entry in entries]
+    key = cache_key({'zip': members})
+    if result_cache.get(key, '.zip') is None:
+        path = result_cache.temp_path_for(key, '.zip')
+        try:
+            # GIFs and videos are compressed already
+            with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED) as archive:
+                for name, filename in members:
+                    archive.write(os.path.join(result_cache.directory, filename), name)
+            result_cache.put(key, path, '.zip')
+        except Exception:
+            if os.path.exists(path): os.remove(path)
+            raise
+    return key + '.zip'
+
+def run_job(params: dict, report_progress) -> dict:
+    """The JobQueue handler: a batch if the job lists clips, a format conversion, or a single GIF."""
+    if 'clips' in params:
+        return run_batch_job(params, report_progress)
+    if 'convert' in params:
+        return run_convert_job(params, report_progress)
+    return run_generate_job(params, report_progress)
+
+job_queue = JobQueue(run_job, store=SQLiteJobStore(app.config['JOB_DATABASE']) if app.config['JOB_DATABASE'] else None,
+                     max_workers=app.config['JOB_WORKERS'], lease=app.config['JOB_LEASE'],
+                     max_attempts=app.config['JOB_MAX_ATTEMPTS'], result_ttl=app.config['JOB_RESULT_TTL'])
+
+def job_error_message(job: Job) -> str:
+    """
+    The user-facing message for a failed job, by exception type.
+    """
+    return error_message(job.error_type, job.error)
 
+def error_message(error_type: str, error: str) -> str:
+    """
+    The user-facing message for a failed job or batch clip.
+    """
+    if error_type == 'DownloadError':
+        return f'Error downloading video: {error}. Please check the URL and ensure the video is public and accessible.'
+    if error_type == 'FileNotFoundError':
+        return f'A required file was not found: {error}'
+    if error_type == 'TimeRangeError':
+        return f'{error}. Please pick start and end times within the video.'
+    if error_type == 'RenderTimeout':
+        return f'{error}. Please try a shorter clip.'
+    return f'An unexpected error occurred: {error}'
+
+def gif_details(path: str) -> dict:
+    """
+    Size, frame rate, palette size (palette formats only) and file size of a
+    rendered GIF, WebP or APNG, read from its first frame; None if it cannot
+    be read.
+    """
     try:
-        youtube_url = request.form['youtube_url']
-        meme_text = request.form['meme_text']
+        with Image.open(path) as image:
+            delay = image.info.get('duration') or 0
+            palette = image.getpalette() if image.mode == 'P' else None
+            return {'width': image.width, 'height': image.height, 'fps': round(1000 / delay, 1) if delay else None,
+                    'colors': len(palette) // 3 if palette else None, 'bytes': os.path.getsize(path)}
+    except OSError:
+        return None
+
+def file_format(filename: str):
+    """
+    The OutputFormat a rendered file is in, by extension, or None.
+    """
+    extension = os.path.splitext(filename)[1]
+    return next((fmt for fmt in OUTPUT_FORMATS.values() if fmt.extension == extension), None)
+
+def requested_format(filename: str) -> str:
+    """
+    The output format the client asked for with ``?format=``. Without it,
+    the file's own format whenever the Accept header allows it at all
+    (browsers list WebP first but accept anything), and otherwise the
+    format the Accept header prefers.
+    """
+    if 'format' in request.args:
+        return get_format(request.args['format']).name
+    current = file_format(filename)
+    if current is None or request.accept_mimetypes.quality(current.mimetype) > 0:
+        return current.name if current else None
+    others = [fmt.mimetype for fmt in OUTPUT_FORMATS.values() if fmt is not current]
+    best = request.accept_mimetypes.best_match(others, default=current.mimetype)
+    return next(fmt.name for fmt in OUTPUT_FORMATS.values() if fmt.mimetype == best)
+
+def converted_filename(filename: str, output_format: str) -> str:
+    """
+    The name of the ``output_format`` version of a rendered file if there
+    is one already, else None.
+    """
+    key, extension = os.path.splitext(filename)
+    target = get_format(output_format).extension
+    if extension == target or result_cache.get(key, target):
+        return key + target
+    return None
+
+def run_convert_job(params: dict, report_progress) -> dict:
+    """
+    Makes another format of a finished render from its intermediate; runs on
+    a JobQueue worker. Identical conversions, in any process, run once.
+    """
+    key = os.path.splitext(params['convert'])[0]
+    output_format = params['output_format']
+
+    def convert():
+        result = convert_cached(key, output_format, result_cache, intermediate_cache, app.config['GIF_ENCODER'],
+                                app.config['GIF_ENCODER_OPTIONS'], render_pool)
+        return os.path.basename(result.path) if result else None
 
-        # Validate and convert time inputs
+    with tracing() as trace:
         try:
-            video_start_time = int(request.form['video_start_time'])
-            video_end_time = int(request.form['video_end_time'])
-            text_start_time = float(request.form['text_start_time'])
-        except ValueError:
-            flash('Invalid input for time fields. Please use numbers only (e.g., 10, 20.5).', 'error')
-            return redirect(url_for('index'))
+            filename = converted_filename(params['convert'], output_format)
+            if filename is None:
+                filename = single_flight.do(key + get_format(output_format).extension, convert)
+        finally:
+            observe_stages(trace)
+    if filename is None:
+        raise FileNotFoundError('the intermediate of this clip has expired. Please generate it again')
+    return {'filename': filename}
 
-        if not youtube_url:
-            flash('YouTube URL is required.', 'error')
-            return redirect(url_for('index'))
-        if video_start_time >= video_end_time:
-            flash('Video start time must be less than end time.', 'error')
-            return redirect(url_for('index'))
-        if video_start_time < 0:
-            flash('Video start time cannot be negative.', 'error')
-            return redirect(url_for('index'))
-        if text_start_time < 0:
-            flash('Text overlay start time cannot be negative.', 'error')
-            return redirect(url_for('index'))
+def positive_number(value, name: str, integer: bool = False):
+    """
+    Parses an optional number from a form field or JSON; None when missing
+    or empty, ValueError unless positive (and whole, with ``integer``).
+    """
+    if value is None or value == '':
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{name} must be a number') from None
+    if not (number > 0 and math.isfinite(number)):
+        raise ValueError(f'{name} must be positive')
+    if integer:
+        if not number.is_integer():
+            raise ValueError(f'{name} must be a whole number')
+        return int(number)
+    return number
 
+def optional_positive_float(name: str) -> float:
+    """
+    Parses an optional form field; None when empty, ValueError unless positive.
+    """
+    return positive_number(request.form.get(name, '').strip(), name)
 
-        unique_id = uuid.uuid4().hex
-        
-        # Call to download_video_segment
-        video_path = download_video_segment(youtube_url, video_start_time, video_end_time, output_dir=app.config['TEMP_VIDEO_FOLDER'])
-        
-        if not video_path or not os.path.exists(video_path):
-             flash(f'Failed to download video segment. Check URL and times. The video might be too long, private, or unavailable.', 'error')
-             return redirect(url_for('index'))
-
-        # Define GIF paths
-        base_gif_filename = f"{unique_id}_temp.gif"
-        final_gif_filename = f"{unique_id}.gif"
-        temp_gif_path = os.path.join(app.config['GENERATED_GIF_FOLDER'], base_gif_filename)
-        final_gif_path = os.path.join(app.config['GENERATED_GIF_FOLDER'], final_gif_filename)
-        
-        # Call to convert_to_gif
-        convert_to_gif(video_path, temp_gif_path) 
-
-        if not os.path.exists(temp_gif_path):
-            flash('Failed to convert video to GIF. The video segment might be too short or corrupted.', 'error')
-            if os.path.exists(video_path): 
-                 os.remove(video_path)
-            return redirect(url_for('index'))
-            
-        # Call to add_text_overlay
-        add_text_overlay(temp_gif_path, final_gif_path, meme_text, text_start_time)
-        
-        if not os.path.exists(final_gif_path):
-            flash('Failed to add text overlay to GIF.', 'error')
-            if os.path.exists(video_path): os.remove(video_path)
-            if os.path.exists(temp_gif_path): os.remove(temp_gif_path)
-            return redirect(url_for('index'))
+def output_limits(values) -> dict:
+    """
+    The ``fps``, ``max_width`` and ``max_height`` job parameters for the
+    optional fields of the same names in ``values`` (form fields or JSON),
+    held to the server's caps, which also apply when nothing is asked for.
+    ValueError says which value is invalid.
+    """
+    fps = positive_number(values.get('fps'), 'fps') or app.config['OUTPUT_FPS']
+    fps = min(fps, app.config['OUTPUT_MAX_FPS'])
+    max_width = positive_number(values.get('max_width'), 'max_width', integer=True)
+    max_height = positive_number(values.get('max_height'), 'max_height', integer=True)
+    return {
+        # Whole rates as ints, so they key the cache like the 10 fps default always has
+        'fps': int(fps) if float(fps).is_integer() else fps,
+        'max_width': min(max_width or app.config['OUTPUT_MAX_WIDTH'], app.config['OUTPUT_MAX_WIDTH']),
+        'max_height': min(max_height or app.config['OUTPUT_MAX_HEIGHT'], app.config['OUTPUT_MAX_HEIGHT']),
+    }
+
+def wants_json() -> bool:
+    return request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json'
 
-        # Successful generation, clean up intermediate files
-        if os.path.exists(video_path):
-            os.remove(video_path)
-        if os.path.exists(temp_gif_path) and temp_gif_path != final_gif_path : 
-             os.remove(temp_gif_path)
+def retry_after_seconds(queued: int) -> int:
+    """
+    Roughly how long until the backlog has drained enough to take a new job.
+    """
+    if render_pool is not None:
+        workers, average = render_pool.max_workers, render_pool.average_seconds()
+    else:
+        workers, average = app.config['JOB_WORKERS'], 10.0
+    return min(300, max(1, math.ceil(queued * average / workers)))
+
+def server_busy(queued: int, json_only: bool = False):
+    message = 'The server is busy generating other GIFs. Please try again in a moment.'
+    headers = {'Retry-After': str(retry_after_seconds(queued))}
+    if json_only or wants_json():
+        return jsonify(error=message), 503, headers
+    flash(message, 'error')
+    return render_template('index.html'), 503, headers
+
+@app.route('/generate', methods=['POST'])
+def generate_gif():
+    youtube_url = request.form.get('youtube_url', '')
+    meme_text = request.form.get('meme_text', '')
 
-        return redirect(url_for('show_result', filename=final_gif_filename))
+    # Validate and convert time inputs
+    try:
+        video_start_time = int(request.form['video_start_time'])
+        video_end_time = int(request.form['video_end_time'])
+        text_start_time = float(request.form['text_start_time'])
+    except (KeyError, ValueError):
+        flash('Invalid input for time fields. Please use numbers only (e.g., 10, 20.5).', 'error')
+        return redirect(url_for('index'))
 
-    except DownloadError as e: # Specific handling for yt-dlp download errors
-        flash(f'Error downloading video: {str(e)}. Please check the URL and ensure the video is public and accessible.', 'error')
-        # Cleanup based on which files might exist
-        if video_path and os.path.exists(video_path): os.remove(video_path)
-        if temp_gif_path and os.path.exists(temp_gif_path): os.remove(temp_gif_path)
+    # Optional budget: frame rate, width and palette are then picked to fit it
+    try:
+        max_size_mb = optional_positive_float('max_size_mb')
+        max_render_seconds = optional_positive_float('max_render_seconds')
+    except ValueError:
+        flash('Size and render time limits must be positive numbers.', 'error')
+        return redirect(url_for('index'))
+    try:
+        limits = output_limits({name: request.form.get(name, '').strip() for name in ('fps', 'max_width', 'max_height')})
+    except ValueError:
+        flash('Frame rate must be a positive number, and maximum width and height positive whole numbers.', 'error')
         return redirect(url_for('index'))
-    except FileNotFoundError as e: # Specific handling for file not found errors from gif_generator
-        flash(f'A required file was not found: {str(e)}', 'error')
-        if video_path and os.path.exists(video_path): os.remove(video_path)
-        if temp_gif_path and os.path.exists(temp_gif_path): os.remove(temp_gif_path)
+    output_format = request.form.get('output_format', 'gif')
+    if output_format not in OUTPUT_FORMATS:
+        flash(f'Unknown output format. Please choose one of: {", ".join(OUTPUT_FORMATS)}.', 'error')
         return redirect(url_for('index'))
-    except Exception as e: # General error handler
-        flash(f'An unexpected error occurred: {str(e)}', 'error')
-        if video_path and os.path.exists(video_path): os.remove(video_path)
-        if temp_gif_path and os.path.exists(temp_gif_path): os.remove(temp_gif_path)
+    if output_format != 'gif' and (max_size_mb or max_render_seconds):
+        flash('Size and render time limits are only available for GIF output.', 'error')
         return redirect(url_for('index'))
 
+    if not youtube_url:
+        flash('YouTube URL is required.', 'error')
+        return redirect(url_for('index'))
+    if video_start_time >= video_end_time:
+        flash('Video start time must be less than end time.', 'error')
+        return redirect(url_for('index'))
+    if video_start_time < 0:
+        flash('Video start time cannot be negative.', 'error')
+        return redirect(url_for('index'))
+    if text_start_time < 0:
+        flash('Text overlay start time cannot be negative.', 'error')
+        return redirect(url_for('index'))
+    # Videos resolved before have a known duration, so a range past the end
+    # is caught here instead of by a job
+    try:
+        check_time_range(youtube_url, video_start_time, video_end_time, metadata_cache)
+    except TimeRangeError as e:
+        flash(f'{e}. Please pick start and end times within the video.', 'error')
+        return redirect(url_for('index'))
+
+    # Turn requests away early rather than let the queue grow without bound
+    queued = job_queue.depth()['queued']
+    if queued >= app.config['JOB_BACKLOG']:
+        return server_busy(queued)
+
+    # Download and rendering happen on a worker; the client polls for the result
+    job_id = job_queue.submit({
+        'youtube_url': youtube_url,
+        'video_start_time': video_start_time,
+        'video_end_time': video_end_time,
+        'meme_text': meme_text,
+        'text_start_time': text_start_time,
+        'max_bytes': round(max_size_mb * 1024 ** 2) if max_size_mb else None,
+        'max_seconds': max_render_seconds,
+        'output_format': output_format,
+        'preview': bool(request.form.get('preview')),
+        **limits,
+    })
+
+    if wants_json():
+        return jsonify(job_id=job_id, status_url=url_for('job_status', job_id=job_id)), 202
+    # Confirming a preview: it stays on screen until the full render is done
+    return redirect(url_for('show_result', filename=job_id, preview=request.form.get('preview_of') or None))
+
+def parse_batch_clip(spec) -> dict:
+    """
+    Validates one clip of a /batch request into job parameters; ValueError
+    says what is wrong with it.
+    """
+    if not isinstance(spec, dict):
+        raise ValueError('must be an object')
+    try:
+        start, end = float(spec['video_start_time']), float(spec['video_end_time'])
+        text_start = float(spec.get('text_start_time', 0))
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('needs numeric video_start_time and video_end_time (and text_start_time, if given)') from None
+    if not all(math.isfinite(value) for value in (start, end, text_start)):
+        raise ValueError('times must be finite numbers')
+    if start < 0 or text_start < 0:
+        raise ValueError('times cannot be negative')
+    if start >= end:
+        raise ValueError('video_start_time must be less than video_end_time')
+    return {'video_start_time': start, 'video_end_time': end, 'meme_text': str(spec.get('meme_text', '')),
+            'text_start_time': text_start}
+
+@app.route('/batch', methods=['POST'])
+def generate_batch():
+    """
+    Queues one job rendering several clips of a video, given as JSON:
+    ``{"youtube_url": ..., "clips": [{"video_start_time": ..., "video_end_time": ...,
+    "meme_text": ..., "text_start_time": ...}, ...], "output_format": "gif", "zip": false}``,
+    optionally with ``fps``, ``max_width`` and ``max_height`` for every clip.
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify(error='Expected a JSON object.'), 400
+    youtube_url = body.get('youtube_url')
+    if not youtube_url or not isinstance(youtube_url, str):
+        return jsonify(error='youtube_url is required.'), 400
+    specs = body.get('clips')
+    if not isinstance(specs, list) or not specs:
+        return jsonify(error='clips must be a non-empty list.'), 400
+    if len(specs) > app.config['BATCH_MAX_CLIPS']:
+        return jsonify(error=f"A batch can have at most {app.config['BATCH_MAX_CLIPS']} clips."), 400
+    output_format = body.get('output_format', 'gif')
+    if output_format not in OUTPUT_FORMATS:
+        return jsonify(error=f'Unknown output format. Please choose one of: {", ".join(OUTPUT_FORMATS)}.'), 400
+    try:
+        limits = output_limits(body)
+    except ValueError as e:
+        return jsonify(error=f'{e}.'), 400
+
+    clips = []
+    for index, spec in enumerate(specs):
+        try:
+            clip = parse_batch_clip(spec)
+            check_time_range(youtube_url, clip['video_start_time'], clip['video_end_time'], metadata_cache)
+        except ValueError as e:
+            return jsonify(error=f'Clip {index}: {e}.', clip=index), 400
+        clips.append(clip)
+
+    queued = job_queue.depth()['queued']
+    if queued >= app.config['JOB_BACKLOG']:
+        return server_busy(queued, json_only=True)
+
+    job_id = job_queue.submit({'youtube_url': youtube_url, 'clips': clips, 'output_format': output_format,
+                               'zip': bool(body.get('zip')), **limits})
+    return jsonify(job_id=job_id, status_url=url_for('job_status', job_id=job_id)), 202
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify(error='Unknown job.'), 404
+
+    status = {'job_id': job.id, 'status': job.status, 'progress': job.progress}
+    if job.status == DONE and 'clips' in job.result:
+        status['clips'] = [dict(entry, url=url_for('download_gif', filename=entry['filename']))
+                           if entry['status'] == DONE else entry for entry in job.result['clips']]
+        if job.result.get('zip'):
+            status['zip_url'] = url_for('download_gif', filename=job.result['zip'])
+    elif job.status == DONE and job.params.get('preview'):
+        status['result_url'] = url_for('show_result', filename=job.id)
+        status['preview'] = True
+    elif job.status == DONE:
+        status['result_url'] = url_for('show_result', filename=job.result['filename'])
+        if job.result.get('plan'):
+            status['plan'] = job.result['plan']
+    elif job.status == FAILED:
+        status['error'] = job_error_message(job)
+    return jsonify(status)
+
+def cache_stats() -> dict:
+    """Hits, misses, evictions and size of every cache, by name."""
+    caches = {'results': result_cache, 'intermediates': intermediate_cache, 'segments': segment_cache,
+              'metadata': metadata_cache}
+    return {name: cache.stats() for name, cache in caches.items()}
+
+@app.route('/stats')
+def stats():
+    return jsonify(jobs=job_queue.depth(), render_pool=render_pool.stats() if render_pool is not None else None,
+                   janitor=janitor.stats(), caches=cache_stats())
+
+@app.route('/healthz')
+def healthz():
+    # For load balancers: touches neither the job queue nor anything imported lazily
+    return jsonify(status='ok', pid=os.getpid())
+
+@app.route('/metrics')
+def prometheus_metrics():
+    for state, count in job_queue.depth().items():
+        JOBS_IN_FLIGHT.set(count, state=state)
+    # Lookups and evictions are counted as they happen (see cache.py)
+    for name, entry in cache_stats().items():
+        CACHE_ENTRIES.set(entry['entries'], cache=name)
+        if 'bytes' in entry:
+            CACHE_BYTES.set(entry['bytes'], cache=name)
+    return REGISTRY.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
 @app.route('/results/<filename>')
 def show_result(filename):
     if '..' in filename or filename.startswith('/'): 
         flash('Invalid filename.', 'error')
         return redirect(url_for('index'))
-    gif_url = url_for('static', filename=f'generated_gifs/{filename}')
-    return render_template('results.html', gif_url=gif_url, filename=filename)
+
+    if '.' not in filename:
+        # A job id rather than a GIF: wait for the job, then show what it produced
+        job = job_queue.get(filename)
+        if job is None:
+            flash('Unknown job.', 'error')
+            return redirect(url_for('index'))
+        if job.status == DONE and 'clips' in job.result:
+            # A batch has no single result to show; its manifest lists them all
+            return redirect(url_for('job_status', job_id=job.id))
+        if job.status == DONE and job.params.get('preview'):
+            return show_preview(job)
+        if job.status == DONE:
+            return redirect(url_for('show_result', filename=job.result['filename']))
+        if job.status == FAILED:
+            flash(job_error_message(job), 'error')
+            return redirect(url_for('index'))
+        return render_template('pending.html', job=job, status_url=url_for('job_status', job_id=job.id),
+                               preview_url=preview_url(request.args.get('preview')))
+
+    if 'format' in request.args:
+        converted = format_or_flash(filename)
+        if converted is None:
+            return redirect(url_for('index'))
+        if converted != filename:
+            return redirect(url_for('show_result', filename=converted))
+
+    # Viewing a render counts as using it, which keeps the janitor off it
+    result_cache.touch(*os.path.splitext(filename))
+    try:
+        gif_url = file_url(filename)
+    except FileNotFoundError:
+        flash('That file is no longer available. Please generate it again.', 'error')
+        return redirect(url_for('index'))
+    details = gif_details(os.path.join(app.config['GENERATED_GIF_FOLDER'], filename))
+    return render_template('results.html', gif_url=gif_url, filename=filename, details=details,
+                           output_format=file_format(filename) or OUTPUT_FORMATS['gif'], formats=OUTPUT_FORMATS.values())
+
+def show_preview(job: Job):
+    """
+    The results page for a finished preview job, with a form that confirms
+    it (rendering the full GIF from the same form fields) and a link back
+    to the form to adjust them.
+    """
+    params = job.params
+    form = {name: params[name] for name in ('youtube_url', 'video_start_time', 'video_end_time', 'meme_text',
+                                            'text_start_time', 'output_format')}
+    if params.get('max_bytes'):
+        form['max_size_mb'] = params['max_bytes'] / 1024 ** 2
+    if params.get('max_seconds'):
+        form['max_render_seconds'] = params['max_seconds']
+    form.update({name: params[name] for name in ('fps', 'max_width', 'max_height') if params.get(name)})
+    filename = job.result['filename']
+    result_cache.touch(*os.path.splitext(filename))
+    try:
+        gif_url = file_url(filename)
+    except FileNotFoundError:
+        flash('That preview is no longer available. Please generate it again.', 'error')
+        return redirect(url_for('index'))
+    return render_template('results.html', gif_url=gif_url,
+                           filename=filename, details=gif_details(os.path.join(app.config['GENERATED_GIF_FOLDER'], filename)),
+                           output_format=OUTPUT_FORMATS['gif'], formats=(), preview_form=form)
+
+def preview_url(filename: str) -> str:
+    """
+    The URL of a cached preview to show while its full render runs, or None.
+    """
+    if not filename or '..' in filename or '/' in filename:
+        return None
+    if not result_cache.touch(*os.path.splitext(filename)):
+        return None
+    try:
+        return file_url(filename)
+    except FileNotFoundError:
+        return None # Evicted in the meantime
+
+def rendered_path(filename: str) -> str:
+    return os.path.join(app.root_path, app.config['GENERATED_GIF_FOLDER'], filename)
+
+def file_url(filename: str) -> str:
+    """
+    The immutable URL of a rendered file (see delivery.py), which names its
+    content; FileNotFoundError if the file is gone.
+    """
+    digest = content_digests.get(rendered_path(filename))
+    return url_for('serve_file', digest=digest[:URL_DIGEST_LENGTH], filename=filename)
+
+def send_counted(route: str, filename: str, immutable: bool = False, as_attachment: bool = False):
+    """
+    send_rendered() for a file of the generated GIF folder, counted in
+    FILE_RESPONSES; a 404 if the file is gone.
+    """
+    path = rendered_path(filename)
+    try:
+        digest = content_digests.get(path)
+    except FileNotFoundError:
+        abort(404)
+    response = send_rendered(path, digest, immutable=immutable, as_attachment=as_attachment,
+                             offload=app.config['FILE_OFFLOAD'], offload_prefix=app.config['FILE_OFFLOAD_PREFIX'])
+    FILE_RESPONSES.inc(route=route, status=response.status_code)
+    return response
+
+def format_or_flash(filename: str) -> str:
+    """
+    The file to serve in the format the client asked for: ``filename``
+    itself, or its conversion if that was made already. A conversion still
+    to be made is queued as a job, and the request is answered with
+    queue_conversion() instead. Returns None after flashing why when the
+    format cannot be had.
+    """
+    try:
+        output_format = requested_format(filename)
+    except ValueError as e:
+        flash(str(e), 'error')
+        return None
+    if output_format is None:
+        return filename
+    converted = converted_filename(filename, output_format)
+    if converted is not None:
+        return converted
+    if not os.path.exists(intermediate_cache.path_for(os.path.splitext(filename)[0])):
+        flash('That format is no longer available for this clip. Please generate it again.', 'error')
+        return None
+    abort(make_response(queue_conversion(filename, output_format)))
+
+def queue_conversion(filename: str, output_format: str):
+    """
+    Queues converting ``filename`` to ``output_format`` and sends the client
+    to the job's page, like /generate does. Converting takes seconds, too
+    long to hold a request thread.
+    """
+    queued = job_queue.depth()['queued']
+    if queued >= app.config['JOB_BACKLOG']:
+        return server_busy(queued)
+    job_id = job_queue.submit({'convert': filename, 'output_format': output_format})
+    if wants_json():
+        return jsonify(job_id=job_id, status_url=url_for('job_status', job_id=job_id)), 202
+    return redirect(url_for('show_result', filename=job_id), 303)
+
+@app.route('/files/<digest>/<filename>')
+def serve_file(digest, filename):
+    """
+    A rendered file under its immutable URL (see file_url), cacheable for
+    good. A URL whose file has changed since redirects to the current one.
+    """
+    if '..' in filename or filename.startswith('/') or not result_cache.touch(*os.path.splitext(filename)):
+        abort(404)
+    try:
+        current = content_digests.get(rendered_path(filename))[:URL_DIGEST_LENGTH]
+    except FileNotFoundError:
+        abort(404)
+    if digest != current:
+        return redirect(url_for('serve_file', digest=current, filename=filename))
+    return send_counted('files', filename, immutable=True)
 
 @app.route('/download/<filename>')
 def download_gif(filename):
     if '..' in filename or filename.startswith('/'): 
         flash('Invalid filename.', 'error')
         return redirect(url_for('index'))
-    return send_from_directory(app.config['GENERATED_GIF_FOLDER'], filename, as_attachment=True)
+    converted = format_or_flash(filename)
+    if converted is None:
+        return redirect(url_for('index'))
+    result_cache.touch(*os.path.splitext(converted))
+    # The same URL may get another file later (or another format), so it is revalidated every time
+    response = send_counted('download', converted, as_attachment=True)
+    if 'format' not in request.args:
+        # The format may have been picked from the Accept header
+        response.vary.add('Accept')
+    return response
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
@@ -0,0 +1,145 @@
+"""
+Benchmark: decoding throughput as a function of source resolution.
+
+For each source size a synthetic video is generated (tests/fixtures.make_video)
+and decoded the four ways a render can read it, keeping only what a GIF at
+``--gif-fps`` frames per second and at most ``--max-width`` pixels wide needs:
+
+* ``moviepy``: VideoFileClip at the source size. Its reader passes every
+  source frame up to Python and drops the ones between GIF frames there.
+* ``moviepy_scaled``: the same with ``target_resolution``, so ffmpeg scales
+  but every source frame still reaches Python.
+* ``decoder``: frames.decode_batches at the source size, which drops
+  frames inside ffmpeg.
+* ``decoder_scaled``: decode_batches at the GIF size, which drops and scales
+  frames inside ffmpeg (what render_gif does with ``max_width``).
+
+``render`` and ``render_scaled`` put the same two decodes through the whole
+of render_gif with the ``stream`` encoder, to show what the smaller frames
+save downstream of the decoder.
+
+Each run reports wall and CPU time (ffmpeg included), the frames and bytes
+that reached Python, throughput as source frames per second of wall time,
+and the speedup over ``moviepy`` (``render`` for the render modes).
+Results are printed as JSON.
+
+    python benchmarks/decode_benchmark.py [--sizes 640x360 1280x720 1920x1080] [--duration 4] [--fps 30]
+        [--gif-fps 10] [--max-width 480] [--repeat 3]
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from moviepy.editor import VideoFileClip
+
+from frames import decode_batches, probe_video
+from gif_generator import _fit_size, render_gif
+from tests.fixtures import make_video
+
+MODES = ('moviepy', 'moviepy_scaled', 'decoder', 'decoder_scaled', 'render', 'render_scaled')
+# What each mode's speedup is measured against
+BASELINES = {'moviepy_scaled': 'moviepy', 'decoder': 'moviepy', 'decoder_scaled': 'moviepy',
+             'render_scaled': 'render'}
+
+def _cpu_seconds() -> float:
+    return sum(usage.ru_utime + usage.ru_stime for usage in (resource.getrusage(resource.RUSAGE_SELF),
+                                                              resource.getrusage(resource.RUSAGE_CHILDREN)))
+
+def _read_moviepy(path: str, fps: float, size: tuple, scaled: bool) -> tuple:
+    """Frames and bytes reaching Python through MoviePy's reader."""
+    clip = VideoFileClip(path, target_resolution=(size[1], size[0])) if scaled else VideoFileClip(path)
+    try:
+        frames = sum(1 for _ in clip.iter_frames(fps=fps))
+        width, height = clip.size
+        # Skipped frames are read from the pipe too, then thrown away
+        source_frames = round(clip.duration * clip.fps)
+    finally:
+        clip.close()
+    return frames, source_frames * width * height * 3
+
+def _read_decoder(path: str, fps: float, size: tuple) -> tuple:
+    """Frames and bytes reaching Python through decode_batches."""
+    frames = data = 0
+    for batch in decode_batches(path, fps, size):
+        frames += len(batch)
+        data += batch.nbytes
+    return frames, data
+
+def _render(path: str, fps: float, max_width: int) -> tuple:
+    """Frames and bytes reaching Python through a whole render."""
+    info = probe_video(path)
+    width, height = _fit_size(info.width, info.height, max_width)
+    output_path = f'{path}.gif'
+    try:
+        result = render_gif(path, output_path, fps=fps, encoder='stream', max_width=max_width)
+        frames = round(result.duration * result.fps)
+    finally:
+        if os.path.exists(output_path): os.remove(output_path)
+    return frames, frames * width * height * 3
+
+def bench_decode(path: str, mode: str, fps: float, max_width: int, repeat: int = 1) -> dict:
+    info = probe_video(path)
+    size = _fit_size(info.width, info.height, max_width)
+    runs = []
+    for _ in range(repeat):
+        cpu_before = _cpu_seconds()
+        started = time.perf_counter()
+        if mode.startswith('moviepy'):
+            frames, data = _read_moviepy(path, fps, size, mode == 'moviepy_scaled')
+        elif mode.startswith('render'):
+            frames, data = _render(path, fps, max_width if mode == 'render_scaled' else None)
+        else:
+            frames, data = _read_decoder(path, fps, size if mode == 'decoder_scaled' else (info.width, info.height))
+        runs.append((time.perf_counter() - started, _cpu_seconds() - cpu_before, frames, data))
+    seconds, cpu_seconds, frames, data = min(runs)
+    source_frames = round(info.duration * info.fps)
+    return {
+        'mode': mode,
+        'seconds': round(seconds, 4),
+        'cpu_seconds': round(cpu_seconds, 4),
+        'frames': frames,
+        'bytes_to_python': data,
+        'source_frames_per_second': round(source_frames / seconds, 1),
+    }
+
+def run_benchmark(sizes: list, duration: float = 4, fps: int = 30, gif_fps: float = 10, max_width: int = 480,
+                  repeat: int = 1, modes: tuple = MODES) -> dict:
+    cases = []
+    with tempfile.TemporaryDirectory(prefix='decode-benchmark-') as work_dir:
+        for width, height in sizes:
+            path = make_video(os.path.join(work_dir, f'{width}x{height}.mp4'), duration, size=(width, height), fps=fps,
+                              keyframe_interval=fps * 2, bframes=3, noise=False)
+            runs = {mode: bench_decode(path, mode, gif_fps, max_width, repeat) for mode in modes}
+            for mode, run in runs.items():
+                baseline = runs.get(BASELINES.get(mode, mode))
+                if baseline is not None:
+                    run['speedup'] = round(baseline['seconds'] / run['seconds'], 2)
+            cases.append({'size': [width, height], 'output_size': list(_fit_size(width, height, max_width)),
+                          'runs': list(runs.values())})
+    return {'duration': duration, 'fps': fps, 'gif_fps': gif_fps, 'max_width': max_width, 'cases': cases}
+
+def _size(value: str) -> tuple:
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', type=_size, nargs='+', default=[(640, 360), (1280, 720), (1920, 1080)])
+    parser.add_argument('--duration', type=float, default=4)
+    parser.add_argument('--fps', type=int, default=30, help='frame rate of the source videos')
+    parser.add_argument('--gif-fps', type=float, default=10)
+    parser.add_argument('--max-width', type=int, default=480)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    results = run_benchmark(args.sizes, args.duration, args.fps, args.gif_fps, args.max_width, args.repeat)
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Benchmark: GIF size and encode time with and without frame deltas.
+
+Encodes a synthetic clip with encoders.encode_stream, once storing every
+frame whole and once per ``--thresholds`` value storing only what changed
+(see gifwriter.FrameDelta). The clip is what deltas are for: a still,
+textured background (a gradient with grain, like a camera on a tripod)
+with a small box moving across it for part of the clip and resting for the
+rest. Sizes, times, the frames actually written and the mean error against
+the source frames are reported as JSON.
+
+    python benchmarks/gif_delta_benchmark.py [--width 480] [--height 270] [--duration 4] [--fps 10]
+        [--thresholds 0 8 16] [--grain 4] [--repeat 3]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image, ImageSequence
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from encoders import encode_stream
+
+class StillBackgroundClip:
+    """
+    Frames of a still background with a box moving over it for the first
+    half of ``duration`` and resting for the second; ``grain`` adds noise
+    that changes from frame to frame, as a camera sensor does.
+    """
+
+    def __init__(self, size: tuple, duration: float, grain: int = 0, seed: int = 0):
+        width, height = size
+        self.size = size
+        self.duration = duration
+        self.grain = grain
+        self.seed = seed
+        ramp = np.linspace(40, 200, width)[None, :, None] + np.linspace(0, 40, height)[:, None, None]
+        texture = np.random.default_rng(seed).normal(0, 12, (height, width, 3))
+        self.background = np.clip(ramp + texture, 0, 255).astype(np.uint8)
+
+    def iter_frames(self, fps: float, dtype: str = 'uint8'):
+        width, height = self.size
+        box = max(8, height // 6)
+        for index in range(int(self.duration * fps)):
+            frame = self.background.copy()
+            progress = min(1.0, index / fps / (self.duration / 2))
+            left = int(progress * (width - box))
+            top = (height - box) // 2
+            frame[top:top + box, left:left + box] = (220, 30, 30)
+            if self.grain:
+                # Seeded per frame, so every pass over the clip is the same
+                noise = np.random.default_rng((self.seed, index)).integers(-self.grain, self.grain + 1, frame.shape)
+                frame = np.clip(frame.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+            yield frame
+
+def _decoded_error(path: str, clip: StillBackgroundClip, fps: float) -> float:
+    """Mean absolute error of the GIF against the source, per shown frame."""
+    with Image.open(path) as gif:
+        shown = []
+        for frame in ImageSequence.Iterator(gif):
+            rgb = np.asarray(frame.convert('RGB'), dtype=np.int16)
+            # A lengthened frame stands in for the ones merged into it
+            shown.extend([rgb] * max(1, round(frame.info['duration'] / (1000 / fps))))
+    errors = [np.abs(decoded - source).mean() for decoded, source in zip(shown, clip.iter_frames(fps))]
+    return round(float(np.mean(errors)), 2)
+
+def bench_encode(clip: StillBackgroundClip, fps: float, delta_threshold: int, work_dir: str, repeat: int) -> dict:
+    path = os.path.join(work_dir, f'delta-{delta_threshold}.gif')
+    seconds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        stats = encode_stream(clip, path, fps, delta_threshold=delta_threshold)
+        seconds.append(time.perf_counter() - started)
+    with Image.open(path) as gif:
+        frames = gif.n_frames
+    return {
+        'delta_threshold': delta_threshold,
+        'output_bytes': stats.output_bytes,
+        'seconds': round(min(seconds), 4),
+        'frames_written': frames,
+        'mean_error': _decoded_error(path, clip, fps),
+    }
+
+def run_benchmark(size: tuple, duration: float, fps: float, thresholds: list, grain: int = 0,
+                  repeat: int = 1) -> dict:
+    clip = StillBackgroundClip(size, duration, grain=grain)
+    with tempfile.TemporaryDirectory(prefix='gif-delta-benchmark-') as work_dir:
+        runs = [bench_encode(clip, fps, threshold, work_dir, repeat) for threshold in [None, *thresholds]]
+    whole = runs[0]
+    for run in runs[1:]:
+        run['size_ratio'] = round(run['output_bytes'] / whole['output_bytes'], 3)
+        run['time_ratio'] = round(run['seconds'] / whole['seconds'], 3)
+    return {'frame_size': list(size), 'duration': duration, 'fps': fps, 'grain': grain,
+            'frames': int(duration * fps), 'runs': runs}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--width', type=int, default=480)
+    parser.add_argument('--height', type=int, default=270)
+    parser.add_argument('--duration', type=float, default=4)
+    parser.add_argument('--fps', type=float, default=10)
+    parser.add_argument('--thresholds', type=int, nargs='+', default=[0, 8, 16])
+    parser.add_argument('--grain', type=int, default=0, help='per-frame sensor noise, 0-255')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    results = run_benchmark((args.width, args.height), args.duration, args.fps, args.thresholds,
+                            grain=args.grain, repeat=args.repeat)
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Microbenchmark: per-frame cost of drawing a caption.
+
+Compares MoviePy's CompositeVideoClip (the previous path, fed the same
+bitmap through an ImageClip with a mask, since TextClip needs ImageMagick)
+with the numpy batch blending in frames.blend. When ImageMagick is
+installed, the one-off cost of TextClip is reported next to Pillow's
+rasterization.
+
+    python benchmarks/overlay_benchmark.py [--width 640] [--height 360] [--frames 200]
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from moviepy.editor import CompositeVideoClip, ImageClip, TextClip, VideoClip
+
+from captions import rasterize_text
+from frames import OverlayLayer, composite_batches
+
+def _per_frame_us(seconds: float, frames: int) -> float:
+    return round(seconds / frames * 1e6, 1)
+
+def bench_composite_clip(base_frame, rgba, frames, fps):
+    base = VideoClip(lambda t: base_frame, duration=frames / fps)
+    text = ImageClip(rgba[..., :3]).set_mask(ImageClip(rgba[..., 3] / 255.0, ismask=True))
+    final = CompositeVideoClip([base, text.set_position(('center', 'bottom')).set_duration(base.duration)])
+    started = time.perf_counter()
+    for index in range(frames):
+        final.get_frame(index / fps)
+    elapsed = time.perf_counter() - started
+    started = time.perf_counter()
+    for index in range(frames):
+        base.get_frame(index / fps)
+    # Only count what compositing adds on top of producing the base frame
+    return elapsed - (time.perf_counter() - started)
+
+def bench_numpy_batches(base_frame, rgba, frames, fps, batch_size):
+    layer = OverlayLayer(rgba, ('center', 'bottom'), 0, frames / fps)
+    batches = [np.repeat(base_frame[None], min(batch_size, frames - start), axis=0)
+               for start in range(0, frames, batch_size)]
+    started = time.perf_counter()
+    for _ in composite_batches(iter(batches), [layer], fps):
+        pass
+    return time.perf_counter() - started
+
+def bench_rasterize(text, font_size):
+    rasterize_text.cache_clear()
+    started = time.perf_counter()
+    rasterize_text(text, 'Arial', font_size, 'white', 'black', 2)
+    cold = time.perf_counter() - started
+    started = time.perf_counter()
+    rasterize_text(text, 'Arial', font_size, 'white', 'black', 2)
+    return cold, time.perf_counter() - started
+
+def bench_textclip(text, font_size):
+    if not shutil.which('convert'):
+        return None
+    started = time.perf_counter()
+    TextClip(text, fontsize=font_size, color='white', font='Arial').close()
+    return time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=360)
+    parser.add_argument('--frames', type=int, default=200)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--font-size', type=int, default=48)
+    parser.add_argument('--text', default='WHEN THE BENCHMARK FINALLY PASSES')
+    args = parser.parse_args()
+
+    fps = 10
+    base_frame = np.random.default_rng(0).integers(0, 256, (args.height, args.width, 3), dtype=np.uint8)
+    cold, warm = bench_rasterize(args.text, args.font_size)
+    rgba = rasterize_text(args.text, 'Arial', args.font_size, 'white', 'black', 2)
+    textclip = bench_textclip(args.text, args.font_size)
+
+    results = {
+        'frame_size': [args.width, args.height],
+        'caption_size': [rgba.shape[1], rgba.shape[0]],
+        'frames': args.frames,
+        'composite_clip_us_per_frame': _per_frame_us(bench_composite_clip(base_frame, rgba, args.frames, fps), args.frames),
+        'numpy_batch_us_per_frame': _per_frame_us(bench_numpy_batches(base_frame, rgba, args.frames, fps, args.batch_size), args.frames),
+        'rasterize_ms': round(cold * 1e3, 2),
+        'rasterize_cached_us': round(warm * 1e6, 2),
+        'textclip_ms': round(textclip * 1e3, 2) if textclip is not None else None,
+    }
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+"""
+Stage-level benchmark of the GIF pipeline on synthetic local videos.
+
+For every combination of source resolution, duration and frame rate, a test
+video is generated with ffmpeg (tests/fixtures.make_video), served by the
+local Range-capable HTTP server, and put through the pipeline one stage at a
+time: download_video_segment (with yt-dlp replaced by a stand-in resolving
+to that server), convert_to_gif on the segment and add_text_overlay on the
+GIF. The download and conversion are measured for both cut modes (see
+gif_generator.CUT_MODES): ``download`` and ``convert_to_gif`` re-encode
+the segment, ``download_copy`` and ``convert_copy`` copy it, and pay for
+decoding from the keyframe before the cut instead. Cuts start between
+keyframes, ``--start`` seconds into the video. Each stage runs in a fresh process so its peak RSS is its own, and
+reports wall time, CPU time (ffmpeg included), peak RSS of Python and of
+the ffmpeg subprocesses, and output bytes.
+
+Results are written as JSON. Given an earlier run as ``--baseline``, stages
+whose wall and CPU time both grew by more than ``--threshold`` are reported
+and the exit status is 1, so the script can gate a CI job.
+
+    python benchmarks/pipeline_benchmark.py [--sizes 320x240 640x360] [--durations 2 6] [--fps 25]
+        [--start 0.5] [--repeat 3] [--output results.json] [--baseline previous.json] [--threshold 0.2]
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from unittest.mock import patch
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, PROJECT_ROOT)
+
+from tests.fixtures import FFMPEG_BINARY, LocalExtractor, RangeHTTPServer, make_video
+
+STAGES = ('download', 'download_copy', 'convert_to_gif', 'convert_copy', 'add_text_overlay')
+# Metrics compared against the baseline; a stage is only flagged when all of them grew
+TIME_METRICS = ('wall_seconds', 'cpu_seconds')
+# Differences below this many seconds are noise, whatever the ratio
+MIN_SECONDS = 0.05
+
+def _stage_download(stream_url: str, output_dir: str, start: float, duration: float,
+                    cut_mode: str = 'encode') -> str:
+    from gif_generator import download_video_segment
+    with patch('gif_generator.yt_dlp.YoutubeDL', LocalExtractor(stream_url)):
+        return download_video_segment('https://www.youtube.com/watch?v=benchmark01', start, start + duration,
+                                      output_dir=output_dir, cut_mode=cut_mode)
+
+def _stage_convert(video_path: str, output_path: str, fps: float) -> str:
+    from gif_generator import convert_to_gif
+    return convert_to_gif(video_path, output_path, fps=fps)
+
+def _stage_overlay(gif_path: str, output_path: str, text: str) -> str:
+    from gif_generator import add_text_overlay
+    return add_text_overlay(gif_path, output_path, text, text_start_time=0.5)
+
+_STAGE_FUNCTIONS = {
+    'download': _stage_download,
+    'download_copy': _stage_download,
+    'convert_to_gif': _stage_convert,
+    'convert_copy': _stage_convert,
+    'add_text_overlay': _stage_overlay,
+}
+
+def _cpu_seconds(usage) -> float:
+    return usage.ru_utime + usage.ru_stime
+
+def run_stage(stage: str, kwargs: dict) -> dict:
+    """
+    Runs one stage and measures it; meant to run in a fresh process, as
+    peak RSS is a high-water mark over the life of the process.
+    """
+    # Imports are not part of any stage
+    import gif_generator # noqa: F401
+    started = time.perf_counter()
+    self_before = resource.getrusage(resource.RUSAGE_SELF)
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    path = _STAGE_FUNCTIONS[stage](**kwargs)
+    wall = time.perf_counter() - started
+    self_after = resource.getrusage(resource.RUSAGE_SELF)
+    children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        'path': path,
+        'wall_seconds': round(wall, 4),
+        'cpu_seconds': round(_cpu_seconds(self_after) - _cpu_seconds(self_before) +
+                             _cpu_seconds(children_after) - _cpu_seconds(children_before), 4),
+        'peak_rss_kb': self_after.ru_maxrss,
+        'subprocess_peak_rss_kb': children_after.ru_maxrss,
+        'output_bytes': os.path.getsize(path),
+    }
+
+def _in_fresh_process(stage: str, kwargs: dict) -> dict:
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+        return executor.submit(run_stage, stage, kwargs).result()
+
+def run_case(work_dir: str, size: tuple, duration: float, fps: int, gif_fps: float = 10,
+             text: str = 'BENCHMARK', repeat: int = 1, start: float = 0.5) -> dict:
+    """
+    Benchmarks every stage on one synthetic video; with ``repeat`` above 1
+    each stage keeps its fastest run.
+    """
+    name = f'{size[0]}x{size[1]}-{duration:g}s-{fps}fps'
+    case_dir = os.path.join(work_dir, name)
+    source_path = make_video(os.path.join(case_dir, 'serve', 'source.mp4'), start + duration, size=size, fps=fps,
+                             bframes=3)
+    stages = {}
+    with RangeHTTPServer(os.path.dirname(source_path)) as server:
+        inputs = {
+            'download': lambda: {'stream_url': server.url('source.mp4'), 'output_dir': case_dir,
+                                 'start': start, 'duration': duration},
+            'download_copy': lambda: {'stream_url': server.url('source.mp4'), 'output_dir': case_dir,
+                                      'start': start, 'duration': duration, 'cut_mode': 'copy'},
+            'convert_to_gif': lambda: {'video_path': stages['download']['path'],
+                                       'output_path': os.path.join(case_dir, 'clip.gif'), 'fps': gif_fps},
+            'convert_copy': lambda: {'video_path': stages['download_copy']['path'],
+                                     'output_path': os.path.join(case_dir, 'clip-copy.gif'), 'fps': gif_fps},
+            'add_text_overlay': lambda: {'gif_path': stages['convert_to_gif']['path'],
+                                         'output_path': os.path.join(case_dir, 'captioned.gif'), 'text': text},
+        }
+        for stage in STAGES:
+            runs = []
+            for _ in range(repeat):
+                server.reset()
+                result = _in_fresh_process(stage, inputs[stage]())
+                if stage.startswith('download'):
+                    result['bytes_fetched'] = server.bytes_sent
+                runs.append(result)
+            stages[stage] = min(runs, key=lambda run: run['wall_seconds'])
+    for result in stages.values():
+        del result['path']
+    return {'name': name, 'size': list(size), 'start': start, 'duration': duration, 'fps': fps, 'gif_fps': gif_fps,
+            'source_bytes': os.path.getsize(source_path), 'stages': stages}
+
+def run_benchmarks(sizes: list, durations: list, fps_values: list, repeat: int = 1, gif_fps: float = 10,
+                   start: float = 0.5) -> dict:
+    """
+    Benchmarks every combination of source size, duration and frame rate.
+    """
+    work_dir = tempfile.mkdtemp(prefix='gif-benchmark-')
+    try:
+        cases = [run_case(work_dir, size, duration, fps, gif_fps=gif_fps, repeat=repeat, start=start)
+                 for size in sizes for duration in durations for fps in fps_values]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'cpus': os.cpu_count(), 'ffmpeg': FFMPEG_BINARY},
+        'cases': cases,
+    }
+
+def find_regressions(baseline: dict, current: dict, threshold: float = 0.2) -> list:
+    """
+    Stages of cases present in both runs whose wall and CPU time both grew
+    by more than ``threshold`` (0.2 being 20%), as human-readable lines.
+    """
+    baseline_cases = {case['name']: case for case in baseline['cases']}
+    regressions = []
+    for case in current['cases']:
+        before_case = baseline_cases.get(case['name'])
+        if before_case is None:
+            continue
+        for stage, after in case['stages'].items():
+            before = before_case['stages'].get(stage)
+            if before is None:
+                continue
+            # Requiring both keeps a busy machine (wall only) or noisy accounting (CPU only) from failing the check
+            slower = [metric for metric in TIME_METRICS
+                      if after[metric] > before[metric] * (1 + threshold) and after[metric] - before[metric] > MIN_SECONDS]
+            if len(slower) == len(TIME_METRICS):
+                regressions.append(f"{case['name']} {stage}: " + ', '.join(
+                    f'{metric} {before[metric]:.3f} -> {after[metric]:.3f} (+{after[metric] / before[metric] - 1:.0%})'
+                    for metric in slower))
+    return regressions
+
+def _size(value: str) -> tuple:
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', type=_size, nargs='+', default=[(320, 240), (640, 360), (1280, 720)])
+    parser.add_argument('--durations', type=float, nargs='+', default=[2, 6])
+    parser.add_argument('--fps', type=int, nargs='+', default=[25])
+    parser.add_argument('--gif-fps', type=float, default=10)
+    parser.add_argument('--start', type=float, default=0.5, help='seconds into the video the cuts start')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--output', help='write the results here as well as to stdout')
+    parser.add_argument('--baseline', help='results of an earlier run to check for regressions')
+    parser.add_argument('--threshold', type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.sizes, args.durations, args.fps, repeat=args.repeat, gif_fps=args.gif_fps,
+                             start=args.start)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(json.load(f), results, args.threshold)
+        for line in regressions:
+            print(f'Regression: {line}', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
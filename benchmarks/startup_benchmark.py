@@ -0,0 +1,161 @@
+"""
+Benchmark: startup time and first-request latency.
+
+Each run starts a fresh interpreter, so nothing is imported yet, and measures
+in it:
+
+* ``import_seconds``: importing the app.
+* ``preload_seconds``: importing gif_generator.HEAVY_IMPORTS afterwards, as
+  gunicorn's parent does before forking (``preloaded`` mode only).
+* ``first_request_seconds``: the first request to each of ``--paths``,
+  through Flask's test client.
+* ``heavy_modules_after_requests``: the heavy modules those requests
+  imported, which should be none.
+* ``modules_loaded``: the modules imported by then.
+* ``first_use_seconds``: importing HEAVY_IMPORTS after the requests, which
+  is what the first download or render pays (``lazy`` mode only).
+
+The ``server`` mode starts gunicorn with gunicorn.conf.py and ``--workers``
+workers, and measures the time from launch until ``/healthz`` answers and
+the latency of the first request to each path after that. It is skipped
+when gunicorn is not installed. Results are printed as JSON.
+
+    python benchmarks/startup_benchmark.py [--paths / /healthz] [--workers 2] [--repeat 3]
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+MODES = ('lazy', 'preloaded', 'server')
+PATHS = ('/', '/healthz')
+# How long gunicorn may take to answer its first health check
+SERVER_START_TIMEOUT = 60
+
+# Run in a fresh interpreter: argv[1] is the project root, argv[2] a JSON list of
+# paths, argv[3] '1' to preload the heavy modules before the first request
+_CHILD = '''
+import json, sys, time
+sys.path.insert(0, sys.argv[1])
+started = time.perf_counter()
+import app
+import gif_generator
+result = {'import_seconds': time.perf_counter() - started}
+if sys.argv[3] == '1':
+    started = time.perf_counter()
+    gif_generator.preload_heavy_modules()
+    result['preload_seconds'] = time.perf_counter() - started
+client = app.app.test_client()
+result['first_request_seconds'] = {}
+for path in json.loads(sys.argv[2]):
+    started = time.perf_counter()
+    status = client.get(path).status_code
+    result['first_request_seconds'][path] = time.perf_counter() - started
+    if status != 200:
+        raise SystemExit(f'{path} answered {status}')
+result['heavy_modules_after_requests'] = sorted(
+    {module for module, _ in gif_generator.HEAVY_IMPORTS.values() if module in sys.modules})
+result['modules_loaded'] = len(sys.modules)
+if sys.argv[3] != '1':
+    started = time.perf_counter()
+    gif_generator.preload_heavy_modules()
+    result['first_use_seconds'] = time.perf_counter() - started
+print(json.dumps(result))
+'''
+
+def _round(result: dict) -> dict:
+    return {key: _round(value) if isinstance(value, dict) else round(value, 4) if isinstance(value, float) else value
+            for key, value in result.items()}
+
+def bench_process(preload: bool, paths: tuple = PATHS) -> dict:
+    """One fresh interpreter importing the app and serving its first requests."""
+    # The app creates its folders in the working directory
+    with tempfile.TemporaryDirectory(prefix='startup-benchmark-') as work_dir:
+        started = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', _CHILD, ROOT, json.dumps(list(paths)), '1' if preload else '0'],
+                                cwd=work_dir, capture_output=True, text=True, check=True).stdout
+        process_seconds = time.perf_counter() - started
+    result = json.loads(output.strip().splitlines()[-1])
+    result['process_seconds'] = process_seconds
+    return _round(result)
+
+def gunicorn_available() -> bool:
+    try:
+        import gunicorn # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def _get(url: str, timeout: float = 10) -> int:
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        response.read()
+        return response.status
+
+def bench_server(workers: int, paths: tuple = PATHS) -> dict:
+    """gunicorn, from launch until it answers, then its first requests."""
+    port = _free_port()
+    env = dict(os.environ, PORT=str(port), WEB_CONCURRENCY=str(workers),
+               PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+    with tempfile.TemporaryDirectory(prefix='startup-benchmark-') as work_dir:
+        started = time.perf_counter()
+        server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py'),
+                                   'app:app'], cwd=work_dir, env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            while True:
+                if server.poll() is not None:
+                    raise RuntimeError(f'gunicorn exited with status {server.returncode}')
+                if time.perf_counter() - started > SERVER_START_TIMEOUT:
+                    raise RuntimeError(f'gunicorn did not answer within {SERVER_START_TIMEOUT}s')
+                try:
+                    _get(f'http://127.0.0.1:{port}/healthz', timeout=1)
+                    break
+                except OSError:
+                    time.sleep(0.01)
+            result = {'workers': workers, 'ready_seconds': time.perf_counter() - started, 'first_request_seconds': {}}
+            for path in paths:
+                request_started = time.perf_counter()
+                _get(f'http://127.0.0.1:{port}{path}')
+                result['first_request_seconds'][path] = time.perf_counter() - request_started
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+    return _round(result)
+
+def run_benchmark(paths: tuple = PATHS, workers: int = 2, repeat: int = 1, modes: tuple = MODES) -> dict:
+    runs = []
+    for mode in modes:
+        if mode == 'server' and not gunicorn_available():
+            continue
+        results = [bench_server(workers, paths) if mode == 'server' else bench_process(mode == 'preloaded', paths)
+                   for _ in range(repeat)]
+        # The fastest start: slower ones waited on something else
+        best = min(results, key=lambda result: result.get('ready_seconds', result.get('process_seconds')))
+        runs.append({'mode': mode, **best})
+    return {'paths': list(paths), 'repeat': repeat, 'runs': runs}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--paths', nargs='+', default=list(PATHS))
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers in the server mode')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    args = parser.parse_args()
+
+    results = run_benchmark(tuple(args.paths), args.workers, args.repeat, tuple(args.modes))
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+"""
+Fitting a render into a file size and/or render time budget.
+
+Instead of a fixed frame rate at the source resolution, the frame rate,
+output width and palette size are picked per clip from a quality ladder.
+A short trial encode of a few sampled windows of the clip calibrates a
+simple cost model: bytes and seconds grow with the number of output pixels,
+and bytes also with the bits per palette index. The best setting the model
+says fits the budget is tried again on the same windows to correct the model
+where it matters, and the clip is then rendered once. If that render still
+overshoots the byte budget, it is redone one time at the setting the actual
+output points to.
+"""
+import math
+import os
+import time
+from dataclasses import dataclass
+
+FPS_STEPS = (15, 12, 10, 8, 6, 5)
+WIDTH_STEPS = (640, 480, 400, 320, 240, 160)
+COLOR_STEPS = (256, 128, 64, 32)
+# The first trial encode runs at no more than this width, however large the source
+TRIAL_WIDTH = 480
+# Estimates are aimed this far under the budget, to absorb the model's error
+SAFETY_MARGIN = 0.9
+
+@dataclass
+class RenderBudget:
+    """
+    Limits for a render: the size of the output in bytes and/or the seconds
+    spent rendering it, trial encodes included. Either may be None, not both.
+    """
+    max_bytes: int = None
+    max_seconds: float = None
+
+    def __post_init__(self):
+        if self.max_bytes is None and self.max_seconds is None:
+            raise ValueError('A render budget needs max_bytes, max_seconds or both')
+        for name in ('max_bytes', 'max_seconds'):
+            value = getattr(self, name)
+            if value is not None and value <= 0:
+                raise ValueError(f'{name} must be positive, got {value}')
+
+@dataclass(frozen=True)
+class Setting:
+    """One step of the quality ladder."""
+    fps: float
+    width: int
+    height: int
+    max_colors: int
+
+    @property
+    def quality(self) -> float:
+        # Resolution matters most, then smooth motion, then color depth
+        return math.log(self.width) + 0.75 * math.log(self.fps) + 0.25 * math.log(self.max_colors)
+
+    def pixels(self, seconds: float) -> float:
+        """Output pixels over ``seconds`` of the clip."""
+        return self.width * self.height * self.fps * seconds
+
+@dataclass
+class RenderPlan:
+    """
+    The setting a budgeted render settled on, what the model expected of it,
+    and what it took: trial encodes, full renders and total seconds.
+    """
+    fps: float
+    width: int
+    height: int
+    max_colors: int
+    estimated_bytes: int
+    estimated_seconds: float
+    trials: int
+    passes: int
+    output_bytes: int = 0
+    seconds: float = 0.0
+    within_budget: bool = True
+
+def ladder(source_size: tuple, max_fps: float) -> list:
+    """
+    Every setting up to the source size and ``max_fps``, best first.
+    """
+    source_width, source_height = source_size
+    widths = [source_width] + [width for width in WIDTH_STEPS if width < source_width]
+    fps_steps = [max_fps] + [fps for fps in FPS_STEPS if fps < max_fps]
+    settings = [Setting(fps, width, max(1, round(width * source_height / source_width)), colors)
+                for fps in fps_steps for width in widths for colors in COLOR_STEPS]
+    return sorted(settings, key=lambda setting: setting.quality, reverse=True)
+
+def sample_windows(duration: float, sample_seconds: float = 2.0, count: int = 3) -> list:
+    """
+    ``(start, length)`` windows spread over the clip, ``sample_seconds`` long
+    in total; a clip that short is sampled whole.
+    """
+    if duration <= sample_seconds:
+        return [(0.0, duration)]
+    length = sample_seconds / count
+    return [(duration * (i + 0.5) / count - length / 2, length) for i in range(count)]
+
+def _bits(max_colors: int) -> float:
+    return math.log2(max_colors)
+
+class _CostModel:
+    """
+    Bytes and seconds per output pixel, measured by encoding ``seconds`` of
+    the clip at ``setting``.
+    """
+
+    def __init__(self, setting: Setting, seconds: float, output_bytes: int, encode_seconds: float):
+        pixels = setting.pixels(seconds)
+        self.bytes_per_pixel_bit = output_bytes / (pixels * _bits(setting.max_colors))
+        self.seconds_per_pixel = encode_seconds / pixels
+
+    def bytes(self, setting: Setting, duration: float) -> float:
+        return self.bytes_per_pixel_bit * setting.pixels(duration) * _bits(setting.max_colors)
+
+    def seconds(self, setting: Setting, duration: float) -> float:
+        return self.seconds_per_pixel * setting.pixels(duration)
+
+def _pick(settings: list, model: _CostModel, duration: float, budget: RenderBudget, seconds_left: float) -> Setting:
+    """
+    The best setting the model expects to fit, or the cheapest one.
+    """
+    for setting in settings:
+        if budget.max_bytes is not None and model.bytes(setting, duration) > SAFETY_MARGIN * budget.max_bytes:
+            continue
+        if seconds_left is not None and model.seconds(setting, duration) > SAFETY_MARGIN * seconds_left:
+            continue
+        return setting
+    return settings[-1]
+
+def render_within_budget(render, output_path: str, duration: float, source_size: tuple, max_fps: float,
+                         budget: RenderBudget, sample_seconds: float = 2.0, clock=time.monotonic) -> tuple:
+    """
+    Renders a clip of ``duration`` seconds to ``output_path`` at the best
+    setting that fits ``budget``; returns ``(plan, stats)`` with the
+    RenderPlan and the EncodeStats of the render that was kept.
+
+    ``render(setting, path, window)`` encodes the clip at a Setting to
+    ``path`` and returns EncodeStats; ``window`` is a ``(start, length)``
+    pair for trial encodes and None for the whole clip. A budget that cannot
+    be met even at the cheapest setting still gets that render, with
+    ``within_budget`` False on the plan.
+    """
+    started = clock()
+
+    def seconds_left():
+        return None if budget.max_seconds is None else budget.max_seconds - (clock() - started)
+
+    settings = ladder(source_size, max_fps)
+    windows = sample_windows(duration, sample_seconds)
+    sampled = sum(length for _, length in windows)
+    # A clip short enough to be sampled whole gets a full render out of its trial
+    whole = len(windows) == 1
+    trial_path = f'{output_path}.trial.gif'
+
+    setting = next((s for s in settings if s.width <= TRIAL_WIDTH), settings[-1])
+    trials = 0
+    try:
+        while True:
+            trial_bytes = trial_seconds = 0
+            for window in windows:
+                stats = render(setting, trial_path, window)
+                trial_bytes += stats.output_bytes
+                trial_seconds += stats.seconds
+            trials += 1
+            model = _CostModel(setting, sampled, trial_bytes, trial_seconds)
+            choice = _pick(settings, model, duration, budget, seconds_left())
+            # Two trials are enough: the second one calibrates the model right
+            # around the setting it picks
+            if choice == setting or trials == 2:
+                break
+            setting = choice
+
+        reuse_trial = whole and choice == setting
+        setting = choice
+        attempts = passes = 0
+        while True:
+            estimated = (model.bytes(setting, duration), model.seconds(setting, duration))
+            if reuse_trial:
+                os.replace(trial_path, output_path)
+                reuse_trial = False
+            else:
+                stats = render(setting, output_path, None)
+                passes += 1
+            attempts += 1
+            if budget.max_bytes is None or stats.output_bytes <= budget.max_bytes or attempts == 2:
+                break
+            # Too big: refit on the real output and step down once
+            model = _CostModel(setting, duration, stats.output_bytes, stats.seconds)
+            cheaper = settings[settings.index(setting) + 1:]
+            if not cheaper:
+                break
+            retry = _pick(cheaper, model, duration, budget, seconds_left())
+            if seconds_left() is not None and model.seconds(retry, duration) > seconds_left():
+                break
+            setting = retry
+    finally:
+        if os.path.exists(trial_path):
+            os.remove(trial_path)
+
+    seconds = clock() - started
+    within_budget = ((budget.max_bytes is None or stats.output_bytes <= budget.max_bytes) and
+                     (budget.max_seconds is None or seconds <= budget.max_seconds))
+    plan = RenderPlan(setting.fps, setting.width, setting.height, setting.max_colors,
+                      estimated_bytes=round(estimated[0]), estimated_seconds=estimated[1], trials=trials,
+                      passes=passes, output_bytes=stats.output_bytes, seconds=seconds, within_budget=within_budget)
+    return plan, stats
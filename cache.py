@@ -0,0 +1,490 @@
+"""
+Caches that let repeated requests skip work.
+
+ResultCache is a content-addressed cache of finished renders.
+
+Each entry is a single file named after the hash of everything that
+determines its content (see gif_generator.render_cache_key), so identical
+requests map to the same file. The directory itself is the index: entries
+are touched on every hit and the least recently used ones are evicted once
+the directory grows past ``max_bytes``, or when unused for ``max_age``. That
+keeps several processes sharing one cache directory consistent without any
+extra bookkeeping.
+
+SegmentCache keeps downloaded source segments, so changing only the caption
+of a clip skips the download.
+
+MetadataCache keeps what yt-dlp resolved for a video, so repeated requests
+for it skip extraction.
+
+Each cache's sweep() also removes entries that expired without anything
+being added, and scratch files left behind by renders that crashed; see
+janitor.py, which calls it periodically.
+
+Every cache counts its hits and misses (see stats()). A cache given a
+``name`` also counts them, and its evictions, into the Prometheus metrics
+below, labelled with that name.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+from metrics import Counter
+
+CACHE_LOOKUPS = Counter('gif_cache_lookups_total', 'Cache lookups by cache and result (hit or miss)', ['cache', 'result'])
+CACHE_EVICTIONS = Counter('gif_cache_evictions_total', 'Cache entries evicted by quota or age', ['cache'])
+
+class _Counts:
+    """Hit, miss and eviction counts of one cache, exported if it has a name."""
+
+    def __init__(self, name: str = None):
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._counts_lock = threading.Lock()
+
+    def _count_lookup(self, hit: bool):
+        with self._counts_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if self.name is not None:
+            CACHE_LOOKUPS.inc(cache=self.name, result='hit' if hit else 'miss')
+
+    def _count_evictions(self, count: int):
+        with self._counts_lock:
+            self.evictions += count
+        if self.name is not None and count:
+            CACHE_EVICTIONS.inc(count, cache=self.name)
+
+def cache_key(params: dict) -> str:
+    """
+    Hashes JSON-serializable render parameters into a stable cache key.
+    """
+    canonical = json.dumps(params, sort_keys=True, separators=(',', ':'), default=list)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+class ResultCache(_Counts):
+    """
+    A size-bounded LRU cache of rendered files kept in ``directory``.
+
+    A key may have one entry per file extension (e.g. the GIF and WebP
+    versions of one render): ``extension`` is the default and
+    ``extensions`` lists any others, all of them counting toward
+    ``max_bytes``. With a ``max_age``, entries not read for that many
+    seconds are evicted too.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 1024 ** 3, extension: str = '.gif', extensions: tuple = (),
+                 max_age: float = None, name: str = None):
+        super().__init__(name)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.extension = extension
+        self.extensions = (extension,) + tuple(other for other in extensions if other != extension)
+        os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, key: str, extension: str = None) -> str:
+        return os.path.join(self.directory, f'{key}{extension or self.extension}')
+
+    def temp_path_for(self, key: str, extension: str = None) -> str:
+        """
+        A unique scratch path next to the entry, for rendering before put().
+        """
+        return os.path.join(self.directory, f'{key}.{uuid.uuid4().hex}.tmp{extension or self.extension}')
+
+    def get(self, key: str, extension: str = None) -> str:
+        """
+        Returns the cached file for ``key``, or None on a miss.
+        """
+        path = self.path_for(key, extension)
+        try:
+            # Refresh the entry's position in the LRU order
+            os.utime(path)
+        except FileNotFoundError:
+            self._count_lookup(False)
+            return None
+        self._count_lookup(True)
+        return path
+
+    def touch(self, key: str, extension: str = None) -> bool:
+        """
+        Marks the entry for ``key`` as used, like get() but without counting
+        a hit or miss: for serving a render, which is not a render reused.
+        False if there is no such entry.
+        """
+        try:
+            os.utime(self.path_for(key, extension))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def put(self, key: str, source_path: str, extension: str = None) -> str:
+        """
+        Moves ``source_path`` into the cache as the entry for ``key``.
+
+        The move is an atomic rename, so readers see either no entry or the
+        complete file. ``source_path`` should be on the same filesystem,
+        e.g. from temp_path_for().
+        """
+        path = self.path_for(key, extension)
+        os.replace(source_path, path)
+        self.evict(keep=path)
+        return path
+
+    def _entries(self) -> list:
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.extensions) or '.tmp' in name:
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue # Evicted by another process in the meantime
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self, keep: str = None) -> list:
+        """
+        Removes expired entries, then least recently used ones until the
+        cache fits in ``max_bytes``; returns the removed paths. ``keep`` is
+        never evicted.
+        """
+        return [path for path, _ in self._evict(keep)]
+
+    def _evict(self, keep: str = None) -> list:
+        now = time.time()
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        removed = []
+        for mtime, size, path in entries:
+            # Oldest first, so once one entry may stay, all the rest may too
+            if total <= self.max_bytes and (self.max_age is None or now - mtime <= self.max_age):
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed.append((path, size))
+        self._count_evictions(len(removed))
+        return removed
+
+    def sweep(self, scratch_max_age: float) -> list:
+        """
+        Evicts what the quota and ``max_age`` no longer allow and removes
+        scratch files untouched for ``scratch_max_age`` seconds, which no
+        render can still be writing; returns ``(path, bytes)`` pairs.
+        """
+        return self._evict() + _sweep_scratch(self.directory, scratch_max_age, lambda name: '.tmp' in name)
+
+    def stats(self) -> dict:
+        entries = self._entries()
+        with self._counts_lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(entries),
+                'bytes': sum(size for _, size, _ in entries),
+            }
+
+@dataclass
+class CachedSegment:
+    """A cached source segment covering ``[start, end)`` seconds of a video."""
+    path: str
+    start: float
+    end: float
+
+class SegmentCache(_Counts):
+    """
+    Keeps downloaded source segments so that re-rendering a clip (e.g. with a
+    new caption) skips the download.
+
+    Entries are keyed by (video id, format) and named after their time range,
+    so a request can be served from any cached segment that contains it.
+    Entries unused for ``max_age`` seconds are evicted, then least recently
+    used ones until the directory fits in ``max_bytes``.
+
+    A ``.lock`` file coordinates threads and processes sharing the directory:
+    readers hold it shared while they copy out of an entry, and eviction
+    holds it exclusively, so an entry is never deleted under a reader.
+    New entries appear through an atomic rename.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 2 * 1024 ** 3, max_age: float = 6 * 3600, name: str = None):
+        super().__init__(name)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        os.makedirs(directory, exist_ok=True)
+        self._lock_path = os.path.join(directory, '.lock')
+
+    @contextmanager
+    def _file_lock(self, operation: int):
+        # Each call opens its own descriptor, so flock also serializes threads
+        with open(self._lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _prefix(video_id: str, fmt: str) -> str:
+        return hashlib.sha256(f'{video_id}\0{fmt}'.encode('utf-8')).hexdigest()[:24]
+
+    def _entries(self, prefix: str = None) -> list:
+        entries = []
+        for name in os.listdir(self.directory):
+            parts = name[:-len('.mp4')].split('_') if name.endswith('.mp4') else []
+            if len(parts) != 3 or (prefix is not None and parts[0] != prefix):
+                continue # Not an entry: the lock file, or a scratch file being stored
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((CachedSegment(path, int(parts[1]) / 1000, int(parts[2]) / 1000), stat))
+        return entries
+
+    @contextmanager
+    def lookup(self, video_id: str, start: float, end: float, fmt: str):
+        """
+        Yields the smallest cached segment containing ``[start, end)``, or
+        None. The entry cannot be evicted until the ``with`` block exits.
+        """
+        with self._file_lock(fcntl.LOCK_SH):
+            containing = [(segment.end - segment.start, segment)
+                          for segment, _ in self._entries(self._prefix(video_id, fmt))
+                          if segment.start <= start and segment.end >= end]
+            segment = min(containing, key=lambda item: item[0])[1] if containing else None
+            self._count_lookup(segment is not None)
+            if segment is not None:
+                try:
+                    os.utime(segment.path)
+                except FileNotFoundError:
+                    pass
+            yield segment
+
+    def copy_overlapping(self, video_id: str, start: float, end: float, fmt: str, output_dir: str) -> CachedSegment:
+        """
+        Copies the cached segment sharing the most time with ``[start, end)``
+        into ``output_dir`` and returns the copy, or None if nothing overlaps.
+        """
+        with self._file_lock(fcntl.LOCK_SH):
+            overlapping = [(min(end, segment.end) - max(start, segment.start), segment)
+                           for segment, _ in self._entries(self._prefix(video_id, fmt))]
+            overlapping = [item for item in overlapping if item[0] > 0]
+            if not overlapping:
+                return None
+            segment = max(overlapping, key=lambda item: item[0])[1]
+            copy_path = os.path.join(output_dir, f'{uuid.uuid4().hex}.mp4')
+            _link_or_copy(segment.path, copy_path)
+            return CachedSegment(copy_path, segment.start, segment.end)
+
+    def store(self, video_id: str, start: float, end: float, fmt: str, path: str) -> str:
+        """
+        Adds a copy of the segment at ``path`` covering ``[start, end)`` and
+        evicts whatever the quota no longer allows. ``path`` is left in place.
+        """
+        prefix = self._prefix(video_id, fmt)
+        entry_path = os.path.join(self.directory, f'{prefix}_{round(start * 1000)}_{round(end * 1000)}.mp4')
+        scratch_path = os.path.join(self.directory, f'{uuid.uuid4().hex}.tmp')
+        _link_or_copy(path, scratch_path)
+        os.replace(scratch_path, entry_path)
+
+        # Segments the new one covers completely are dead weight
+        superseded = [segment.path for segment, _ in self._entries(prefix)
+                      if segment.path != entry_path and start <= segment.start and segment.end <= end]
+        self.evict(extra=superseded, keep=entry_path)
+        return entry_path
+
+    def evict(self, extra: list = (), keep: str = None) -> list:
+        """
+        Removes expired entries, then least recently used ones until the
+        cache fits in ``max_bytes``; returns the removed paths.
+        """
+        return [path for path, _ in self._evict(extra, keep)]
+
+    def _evict(self, extra: list = (), keep: str = None) -> list:
+        removed = []
+        with self._file_lock(fcntl.LOCK_EX):
+            now = time.time()
+            entries = sorted(self._entries(), key=lambda item: item[1].st_mtime)
+            total = sum(stat.st_size for _, stat in entries)
+            for segment, stat in entries:
+                if segment.path == keep:
+                    continue
+                if segment.path in extra or now - stat.st_mtime > self.max_age or total > self.max_bytes:
+                    try:
+                        os.remove(segment.path)
+                    except FileNotFoundError:
+                        pass
+                    total -= stat.st_size
+                    removed.append((segment.path, stat.st_size))
+        self._count_evictions(len(removed))
+        return removed
+
+    def sweep(self, scratch_max_age: float) -> list:
+        """
+        Like ResultCache.sweep(); scratch files are copies being stored.
+        """
+        return self._evict() + _sweep_scratch(self.directory, scratch_max_age, lambda name: name.endswith('.tmp'))
+
+    def stats(self) -> dict:
+        entries = self._entries()
+        with self._counts_lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(entries),
+                'bytes': sum(stat.st_size for _, stat in entries),
+            }
+
+class MetadataCache(_Counts):
+    """
+    Keeps the metadata yt-dlp resolved for a video (duration, file name and
+    stream URLs) for ``ttl`` seconds, so repeated requests for the same video
+    skip extraction, which is most of the wait before the first media byte.
+
+    Entries are JSON files named after the hash of (video id, format),
+    written through an atomic rename, so every process sharing the
+    directory sees them. An entry also expires at the ``expires_at`` given
+    to put(), e.g. when its stream URLs stop being valid.
+    """
+
+    def __init__(self, directory: str, ttl: float = 1800, name: str = None):
+        super().__init__(name)
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, video_id: str, fmt: str) -> str:
+        return os.path.join(self.directory, f'{cache_key({"video_id": video_id, "format": fmt})}.json')
+
+    def get(self, video_id: str, fmt: str) -> dict:
+        """
+        Returns the cached metadata for ``video_id``, or None if there is
+        none or it has expired.
+        """
+        try:
+            with open(self._path(video_id, fmt)) as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self._count_lookup(False)
+            return None
+        if entry['expires_at'] <= time.time():
+            self.invalidate(video_id, fmt)
+            self._count_lookup(False)
+            return None
+        self._count_lookup(True)
+        return entry['info']
+
+    def put(self, video_id: str, fmt: str, info: dict, expires_at: float = None):
+        """
+        Stores JSON-serializable ``info`` for ``ttl`` seconds, or until
+        ``expires_at`` if that is sooner.
+        """
+        expiry = time.time() + self.ttl
+        if expires_at is not None:
+            expiry = min(expiry, expires_at)
+        scratch_path = os.path.join(self.directory, f'{uuid.uuid4().hex}.tmp')
+        with open(scratch_path, 'w') as f:
+            json.dump({'expires_at': expiry, 'info': info}, f)
+        os.replace(scratch_path, self._path(video_id, fmt))
+
+    def invalidate(self, video_id: str, fmt: str):
+        """
+        Drops the entry for ``video_id``, e.g. after its stream URLs failed.
+        """
+        try:
+            os.remove(self._path(video_id, fmt))
+        except FileNotFoundError:
+            pass
+
+    def sweep(self, scratch_max_age: float) -> list:
+        """
+        Removes expired entries, which get() only drops when asked for, and
+        stale scratch files; returns ``(path, bytes)`` pairs.
+        """
+        now = time.time()
+        removed = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path) as f:
+                    expired = json.load(f)['expires_at'] <= now
+            except (FileNotFoundError, ValueError, KeyError):
+                continue
+            if expired:
+                removed.append((path, _remove(path)))
+        self._count_evictions(len(removed))
+        return removed + _sweep_scratch(self.directory, scratch_max_age, lambda name: name.endswith('.tmp'))
+
+    def stats(self) -> dict:
+        entries = [name for name in os.listdir(self.directory) if name.endswith('.json')]
+        with self._counts_lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(entries),
+            }
+
+def _remove(path: str) -> int:
+    """
+    Deletes a file and returns the bytes it took, 0 if it was already gone.
+    A reader that has it open keeps reading the old data until it closes it.
+    """
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+    except FileNotFoundError:
+        return 0
+    return size
+
+def _sweep_scratch(directory: str, max_age: float, is_scratch) -> list:
+    """
+    Removes the files in ``directory`` whose name ``is_scratch`` and that
+    were not modified for ``max_age`` seconds; returns ``(path, bytes)`` pairs.
+    """
+    now = time.time()
+    removed = []
+    for name in os.listdir(directory):
+        if not is_scratch(name):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            if now - os.path.getmtime(path) <= max_age:
+                continue
+        except FileNotFoundError:
+            continue
+        removed.append((path, _remove(path)))
+    return removed
+
+def _link_or_copy(source: str, destination: str):
+    """
+    Hard-links ``source`` to ``destination``, copying when linking is not
+    possible (e.g. across filesystems).
+    """
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
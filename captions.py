@@ -0,0 +1,50 @@
+"""
+Caption rasterization.
+
+Text is drawn in-process with Pillow's FreeType renderer into an RGBA
+bitmap, instead of shelling out to ImageMagick through MoviePy's TextClip.
+Bitmaps are kept in an LRU cache keyed by everything that affects them
+(text, font, size, color and stroke), so a caption is rasterized once and
+reused by every frame of a render and by later renders with the same style.
+"""
+import math
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+
+@lru_cache(maxsize=32)
+def load_font(font: str, size: int) -> ImageFont.FreeTypeFont:
+    """
+    Loads ``font`` (a file name or path, e.g. 'Arial' or 'DejaVuSans.ttf')
+    at ``size`` pixels, falling back to Pillow's bundled font when it is not
+    installed.
+    """
+    try:
+        return ImageFont.truetype(font, size)
+    except OSError:
+        print(f"Warning: Font '{font}' not found. Using the default font.")
+        return ImageFont.load_default(size)
+
+@lru_cache(maxsize=256)
+def rasterize_text(text: str, font: str, font_size: int, color: str,
+                   stroke_color: str = None, stroke_width: int = 0) -> np.ndarray:
+    """
+    Returns ``text`` drawn on a transparent background as a read-only
+    ``(h, w, 4)`` uint8 array, cropped to the ink. Multi-line text is
+    centered line by line, like ImageMagick's ``label:``.
+    """
+    face = load_font(font, font_size)
+    fill = ImageColor.getrgb(color)
+    stroke_fill = ImageColor.getrgb(stroke_color) if stroke_color else None
+    measure = ImageDraw.Draw(Image.new('RGBA', (1, 1)))
+    left, top, right, bottom = measure.multiline_textbbox((0, 0), text, font=face, align='center',
+                                                          stroke_width=stroke_width)
+    left, top, right, bottom = math.floor(left), math.floor(top), math.ceil(right), math.ceil(bottom)
+    image = Image.new('RGBA', (max(right - left, 1), max(bottom - top, 1)), fill[:3] + (0,))
+    ImageDraw.Draw(image).multiline_text((-left, -top), text, font=face, fill=fill, align='center',
+                                         stroke_width=stroke_width, stroke_fill=stroke_fill)
+    rgba = np.asarray(image).copy()
+    # Shared through the cache, so nobody may draw on it
+    rgba.flags.writeable = False
+    return rgba
@@ -0,0 +1,108 @@
+"""
+Serving rendered files so that repeat fetches cost next to nothing.
+
+A rendered file is served under a URL naming a digest of its content (see
+ContentDigests), so each URL stands for exactly one version of the file.
+Responses on such URLs are cacheable for a year and marked ``immutable``,
+and they carry the full digest as a strong ETag. That ETag holds for as
+long as the content does. File mtimes cannot serve as validators here.
+ResultCache refreshes them on every read to keep its LRU order, so Flask's
+default mtime-based ETag and Last-Modified changed with every view, and no
+conditional request could ever be answered with a 304.
+
+send_rendered() answers GET and HEAD with Range (206) and If-None-Match
+(304) support. With an offload mode the worker only sends headers and
+leaves the bytes to a fronting proxy. ``x-accel-redirect`` (nginx) names the
+file under an internal location of the proxy, and ``x-sendfile`` (Apache's
+mod_xsendfile, lighttpd) gives its path. The proxy then also answers Range
+requests.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from flask import current_app, request
+from werkzeug.utils import send_file
+
+OFFLOAD_MODES = ('', 'x-accel-redirect', 'x-sendfile')
+# The longest freshness lifetime caches are expected to honor; the URL changes with the content anyway
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+# Hex digits of the digest that go into URLs; the ETag has all of them
+URL_DIGEST_LENGTH = 16
+
+class ContentDigests:
+    """
+    SHA-256 digests of files, remembered for the ``max_entries`` files read
+    most recently, so each version of a file is only read once.
+
+    A version is identified by the file's device, inode and size, never its
+    mtime. That relies on files being replaced by a rename rather than
+    rewritten in place, as ResultCache.put() does.
+    """
+
+    def __init__(self, max_entries: int = 4096, chunk_size: int = 1024 * 1024):
+        self.max_entries = max_entries
+        self.chunk_size = chunk_size
+        self._digests = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path: str) -> str:
+        """
+        The hex digest of the file at ``path``; FileNotFoundError if there
+        is none.
+        """
+        stat = os.stat(path)
+        version = (path, stat.st_dev, stat.st_ino, stat.st_size)
+        with self._lock:
+            digest = self._digests.get(version)
+            if digest is not None:
+                self._digests.move_to_end(version)
+                return digest
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(self.chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+        digest = digest.hexdigest()
+        with self._lock:
+            self._digests[version] = digest
+            while len(self._digests) > self.max_entries:
+                self._digests.popitem(last=False)
+        return digest
+
+def send_rendered(path: str, digest: str, immutable: bool = False, as_attachment: bool = False,
+                  offload: str = '', offload_prefix: str = '/'):
+    """
+    A response serving the file at ``path``, whose content hashes to
+    ``digest``, for the current request.
+
+    ``immutable`` responses may be cached for a year without revalidation,
+    which is only right on a URL that names the digest. Other responses
+    must be revalidated every time, which the strong ETag turns into a 304
+    while the content is unchanged. ``offload`` is one of OFFLOAD_MODES;
+    with ``x-accel-redirect`` the file is named as ``offload_prefix`` plus
+    its file name.
+    """
+    if offload not in OFFLOAD_MODES:
+        raise ValueError(f"Unknown offload mode '{offload}'. Choose one of: {', '.join(filter(None, OFFLOAD_MODES))}")
+    response = send_file(path, request.environ, as_attachment=as_attachment, use_x_sendfile=bool(offload),
+                         response_class=current_app.response_class, conditional=False, etag=digest,
+                         max_age=IMMUTABLE_MAX_AGE if immutable else None)
+    # Set from the mtime, which reads move; the ETag is the validator
+    del response.headers['Last-Modified']
+    if immutable:
+        response.cache_control.immutable = True
+    if offload:
+        # The proxy answers Range requests itself
+        response = response.make_conditional(request)
+        if response.status_code == 304:
+            # Some proxies would send the file anyway
+            del response.headers['X-Sendfile']
+        elif offload == 'x-accel-redirect':
+            del response.headers['X-Sendfile']
+            response.headers['X-Accel-Redirect'] = offload_prefix.rstrip('/') + '/' + os.path.basename(path)
+        return response
+    return response.make_conditional(request, accept_ranges=True, complete_length=os.path.getsize(path))
@@ -0,0 +1,240 @@
+"""
+GIF encoder backends used by gif_generator.render_gif.
+
+Every backend takes a MoviePy clip (already composited with any overlays),
+writes it to ``output_path`` at ``fps`` and returns EncodeStats, so backends
+can be swapped per call and compared on the same input. All but ``moviepy``
+only call the clip's ``iter_frames``, so they also take a frames.FrameStream.
+"""
+import itertools
+import os
+import subprocess
+import time
+from dataclasses import dataclass
+
+import numpy as np
+from moviepy.config import get_setting
+from PIL import Image
+
+from gifwriter import FrameDelta, GifWriter, frame_delays
+
+# Bump whenever a backend's output changes for the same input, so cached
+# renders made by the old code are not served anymore
+ENCODER_VERSION = 2
+
+DITHER_MODES = ('none', 'bayer', 'floyd_steinberg', 'sierra2', 'sierra2_4a', 'sierra3', 'burkes', 'atkinson')
+PALETTE_MODES = ('global', 'segment', 'frame')
+
+@dataclass
+class EncodeStats:
+    """How long an encode took and how large its output is."""
+    encoder: str
+    seconds: float
+    output_bytes: int
+
+def _file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+def encode_moviepy(clip, output_path: str, fps: float) -> EncodeStats:
+    """
+    Encodes through MoviePy's write_gif.
+    """
+    started = time.perf_counter()
+    clip.write_gif(output_path, fps=fps)
+    return EncodeStats('moviepy', time.perf_counter() - started, _file_size(output_path))
+
+def _palette_filter_graph(palette: str, dither: str, max_colors: int, segment_bounds: list) -> str:
+    """
+    Builds the palettegen/paletteuse filter graph for the raw frames on input 0.
+
+    ``global`` computes one palette over the whole clip, ``frame`` a palette per
+    frame, and ``segment`` one palette per ``segment_bounds`` time range.
+    """
+    use = f'paletteuse=dither={dither}'
+    if palette == 'global':
+        return f'[0:v]split[a][b];[a]palettegen=max_colors={max_colors}:stats_mode=full[p];[b][p]{use}'
+    if palette == 'frame':
+        return f'[0:v]split[a][b];[a]palettegen=max_colors={max_colors}:stats_mode=single[p];[b][p]{use}:new=1'
+
+    count = len(segment_bounds)
+    parts = [f"[0:v]split={count}{''.join(f'[s{i}]' for i in range(count))}"]
+    for i, (seg_start, seg_end) in enumerate(segment_bounds):
+        parts.append(f'[s{i}]trim=start={seg_start}:end={seg_end},setpts=PTS-STARTPTS,split[a{i}][b{i}]')
+        parts.append(f'[a{i}]palettegen=max_colors={max_colors}:stats_mode=full[p{i}]')
+        parts.append(f'[b{i}][p{i}]{use}:new=1[o{i}]')
+    parts.append(f"{''.join(f'[o{i}]' for i in range(count))}concat=n={count}:v=1:a=0")
+    return ';'.join(parts)
+
+def encode_ffmpeg(clip, output_path: str, fps: float, palette: str = 'global',
+                  dither: str = 'sierra2_4a', max_colors: int = 256,
+                  palette_segment: float = 2.0) -> EncodeStats:
+    """
+    Encodes by piping raw frames into ffmpeg's palettegen/paletteuse filters.
+
+    The palette is computed from the frames themselves (once, per frame, or per
+    ``palette_segment`` seconds depending on ``palette``) and applied with the
+    chosen ``dither`` mode, which gives smaller and cleaner GIFs than a fixed
+    palette. With ``global`` and ``segment`` palettes ffmpeg holds frames
+    until their palette is known, so its memory grows with the clip; ``frame``
+    and the ``stream`` backend do not.
+    """
+    if palette not in PALETTE_MODES:
+        raise ValueError(f"Unknown palette mode '{palette}'. Expected one of: {', '.join(PALETTE_MODES)}")
+    if dither not in DITHER_MODES:
+        raise ValueError(f"Unknown dither mode '{dither}'. Expected one of: {', '.join(DITHER_MODES)}")
+
+    segment_bounds = []
+    if palette == 'segment':
+        seg_start = 0.0
+        while seg_start < clip.duration:
+            segment_bounds.append((seg_start, min(seg_start + palette_segment, clip.duration)))
+            seg_start += palette_segment
+
+    output_args = ['-filter_complex', _palette_filter_graph(palette, dither, max_colors, segment_bounds), '-f', 'gif']
+    started = time.perf_counter()
+    with FfmpegPipe(output_path, clip.size, fps, output_args) as pipe:
+        for frame in clip.iter_frames(fps=fps, dtype='uint8'):
+            pipe.write(frame)
+    return EncodeStats('ffmpeg', time.perf_counter() - started, _file_size(output_path))
+
+class FfmpegPipe:
+    """
+    An ffmpeg process writing ``output_path`` from raw RGB frames of
+    ``size`` at ``fps`` fed to write(); ``output_args`` select the codec and
+    container.
+
+    Use as a context manager: leaving the block waits for ffmpeg and raises
+    OSError if it failed, and an exception inside the block kills it and
+    removes the partial file.
+    """
+
+    def __init__(self, output_path: str, size: tuple, fps: float, output_args: list):
+        self.output_path = output_path
+        width, height = size
+        cmd = [
+            get_setting('FFMPEG_BINARY'), '-y', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{width}x{height}', '-r', str(fps), '-i', '-',
+            *output_args, output_path,
+        ]
+        self._process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        self._broken = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    def write(self, frame: np.ndarray):
+        if self._broken:
+            return
+        try:
+            self._process.stdin.write(frame.tobytes())
+        except BrokenPipeError:
+            self._broken = True # ffmpeg exited early; close() reports why
+
+    def close(self):
+        _, stderr = self._process.communicate()
+        if self._process.returncode != 0:
+            raise OSError(f"ffmpeg could not encode {self.output_path}: {stderr.decode(errors='replace').strip()}")
+
+    def abort(self):
+        self._process.kill()
+        self._process.communicate()
+        if os.path.exists(self.output_path):
+            os.remove(self.output_path)
+
+STREAM_DITHER_MODES = {'none': Image.Dither.NONE, 'floyd_steinberg': Image.Dither.FLOYDSTEINBERG}
+
+def _window_palette(window: list, max_colors: int, sample_pixels: int = 256 * 256) -> Image.Image:
+    """
+    Computes one palette for a window of frames from a subsampled mosaic.
+    """
+    height, width = window[0].shape[:2]
+    step = max(1, int((height * width * len(window) / sample_pixels) ** 0.5))
+    mosaic = np.concatenate([frame[::step, ::step] for frame in window])
+    return Image.fromarray(mosaic).quantize(colors=max_colors, method=Image.Quantize.MEDIANCUT)
+
+def _mark_unchanged(image: Image.Image, unchanged: np.ndarray) -> int:
+    """
+    Paints the ``unchanged`` pixels of a quantized frame with a color of
+    their own, added after the palette, and returns its index.
+    """
+    palette = image.getpalette()
+    index = len(palette) // 3
+    image.putpalette(palette + [0, 0, 0])
+    image.paste(index, mask=Image.fromarray(unchanged))
+    return index
+
+def encode_stream(clip, output_path: str, fps: float, max_colors: int = 256,
+                  dither: str = 'floyd_steinberg', palette_window: int = 8,
+                  delta_threshold: int = None) -> EncodeStats:
+    """
+    Encodes frame by frame, writing each one as soon as it is quantized.
+
+    Frames are quantized in windows of ``palette_window`` frames sharing a
+    palette computed from that window, so at most one window is held in
+    memory however long the clip is. Pair with frames.FrameStream to
+    keep decoding bounded as well.
+
+    With a ``delta_threshold``, each frame only stores the rectangle around
+    pixels that changed by more than that (per channel, 0-255) since they
+    were last drawn, with the rest of the rectangle transparent, and frames
+    with no such pixel lengthen the frame before them instead. One of the
+    ``max_colors`` goes to transparency.
+    """
+    if dither not in STREAM_DITHER_MODES:
+        raise ValueError(f"Unknown dither mode '{dither}'. Expected one of: {', '.join(STREAM_DITHER_MODES)}")
+    if not 2 <= max_colors <= 256:
+        raise ValueError(f"max_colors must be between 2 and 256, got {max_colors}")
+    if delta_threshold is not None and not 0 <= delta_threshold < 255:
+        raise ValueError(f"delta_threshold must be between 0 and 254, got {delta_threshold}")
+
+    started = time.perf_counter()
+    frames = clip.iter_frames(fps=fps, dtype='uint8')
+    delays = frame_delays(fps)
+    delta = FrameDelta(delta_threshold) if delta_threshold is not None else None
+    colors = max_colors - 1 if delta is not None else max_colors
+    with GifWriter(output_path) as writer:
+        while True:
+            window = list(itertools.islice(frames, palette_window))
+            if not window:
+                break
+            palette = _window_palette(window, colors)
+            for frame in window:
+                if delta is None:
+                    image = Image.fromarray(frame).quantize(palette=palette, dither=STREAM_DITHER_MODES[dither])
+                    writer.add_frame(image, next(delays))
+                    continue
+                change = delta.update(frame)
+                if change is None:
+                    writer.extend_last(next(delays))
+                    continue
+                (left, top, right, bottom), unchanged = change
+                image = Image.fromarray(frame[top:bottom, left:right]).quantize(
+                    palette=palette, dither=STREAM_DITHER_MODES[dither])
+                transparency = _mark_unchanged(image, unchanged) if unchanged is not None else None
+                writer.add_frame(image, next(delays), offset=(left, top), transparency=transparency)
+    return EncodeStats('stream', time.perf_counter() - started, _file_size(output_path))
+
+ENCODERS = {
+    'moviepy': encode_moviepy,
+    'ffmpeg': encode_ffmpeg,
+    'stream': encode_stream,
+}
+
+def get_encoder(name: str):
+    """
+    Looks up an encoder backend by name.
+    """
+    try:
+        return ENCODERS[name]
+    except KeyError:
+        raise ValueError(f"Unknown GIF encoder '{name}'. Expected one of: {', '.join(ENCODERS)}") from None
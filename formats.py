@@ -0,0 +1,102 @@
+"""
+Output formats: GIF and the more compact animated WebP, APNG and silent
+looping MP4 (H.264) and WebM (VP9).
+
+GIFs go through the encoder backends in encoders.py. Every other format is
+written by ffmpeg, either from frames piped into it (write_frames) or
+straight from a file (transcode). A render can also keep an INTERMEDIATE
+copy of its captioned frames, losslessly compressed at the output size and
+frame rate, so any format can be produced from it later without
+downloading or decoding the source again.
+"""
+import subprocess
+import time
+from dataclasses import dataclass
+
+from moviepy.config import get_setting
+
+from encoders import EncodeStats, FfmpegPipe, _file_size
+
+# H.264 and VP9 in 4:2:0 need even frame sizes; pad odd ones by a pixel
+_EVEN_SIZE = ['-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2']
+
+@dataclass(frozen=True)
+class OutputFormat:
+    """
+    A file format renders can be written in. ``video`` formats play in a
+    ``<video>`` element rather than an ``<img>``.
+    """
+    name: str
+    extension: str
+    mimetype: str
+    output_args: tuple
+    video: bool = False
+
+OUTPUT_FORMATS = {
+    'gif': OutputFormat('gif', '.gif', 'image/gif', ()),
+    'webp': OutputFormat('webp', '.webp', 'image/webp',
+                         ('-c:v', 'libwebp_anim', '-quality', '75', '-compression_level', '4', '-loop', '0',
+                          '-f', 'webp')),
+    'apng': OutputFormat('apng', '.png', 'image/apng', ('-c:v', 'apng', '-plays', '0', '-f', 'apng')),
+    'mp4': OutputFormat('mp4', '.mp4', 'video/mp4',
+                        (*_EVEN_SIZE, '-c:v', 'libx264', '-preset', 'medium', '-crf', '23', '-pix_fmt', 'yuv420p',
+                         '-movflags', '+faststart', '-an', '-f', 'mp4'), video=True),
+    'webm': OutputFormat('webm', '.webm', 'video/webm',
+                         (*_EVEN_SIZE, '-c:v', 'libvpx-vp9', '-crf', '33', '-b:v', '0', '-deadline', 'good',
+                          '-cpu-used', '4', '-row-mt', '1', '-pix_fmt', 'yuv420p', '-an', '-f', 'webm'), video=True),
+}
+
+# Lossless RGB, so conversions from it look exactly like a render from the source
+INTERMEDIATE = OutputFormat('intermediate', '.mkv', 'video/x-matroska',
+                            ('-c:v', 'libx264rgb', '-preset', 'ultrafast', '-crf', '0', '-f', 'matroska'), video=True)
+
+def get_format(name: str) -> OutputFormat:
+    """
+    Looks up an output format by name.
+    """
+    try:
+        return OUTPUT_FORMATS[name]
+    except KeyError:
+        raise ValueError(f"Unknown output format '{name}'. Expected one of: {', '.join(OUTPUT_FORMATS)}") from None
+
+def write_frames(clip, output_path: str, fps: float, output_format: OutputFormat) -> EncodeStats:
+    """
+    Encodes a clip (anything with ``size`` and ``iter_frames``) with ffmpeg.
+    """
+    started = time.perf_counter()
+    with FfmpegPipe(output_path, clip.size, fps, list(output_format.output_args)) as pipe:
+        for frame in clip.iter_frames(fps=fps, dtype='uint8'):
+            pipe.write(frame)
+    return EncodeStats(output_format.name, time.perf_counter() - started, _file_size(output_path))
+
+def transcode(input_path: str, output_path: str, output_format: OutputFormat) -> EncodeStats:
+    """
+    Converts a video file in a single ffmpeg process, frames never passing
+    through Python.
+    """
+    cmd = [get_setting('FFMPEG_BINARY'), '-y', '-loglevel', 'error', '-i', input_path, '-an',
+           *output_format.output_args, output_path]
+    started = time.perf_counter()
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise OSError(f"ffmpeg could not convert {input_path}: {result.stderr.strip()}")
+    return EncodeStats(output_format.name, time.perf_counter() - started, _file_size(output_path))
+
+class TeeStream:
+    """
+    Passes a clip's frames through iter_frames() unchanged while also
+    writing each one to ``pipe`` (an encoders.FfmpegPipe), so one decode
+    feeds two encoders.
+    """
+
+    def __init__(self, clip, pipe: FfmpegPipe):
+        self.clip = clip
+        self.pipe = pipe
+        self.size = clip.size
+        self.duration = clip.duration
+        self.fps = getattr(clip, 'fps', None)
+
+    def iter_frames(self, fps: float = None, dtype: str = 'uint8'):
+        for frame in self.clip.iter_frames(fps=fps, dtype=dtype):
+            self.pipe.write(frame)
+            yield frame
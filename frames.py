@@ -0,0 +1,194 @@
+"""
+A streaming frame pipeline: decode -> resize -> overlay.
+
+Frames come out of an ffmpeg subprocess in small batches of numpy arrays,
+already resampled to the output frame rate and size, and captions are
+blended onto a whole batch at a time as it passes. Nothing holds more than
+the batch being processed, so memory use does not grow with the clip's
+duration or the number of frames. FrameStream wraps the pipeline in the small part of the
+MoviePy clip interface the encoders use (``size``, ``duration`` and
+``iter_frames``), so it can be passed to an encoder in place of a clip.
+"""
+import subprocess
+from dataclasses import dataclass
+
+import numpy as np
+from moviepy.config import get_setting
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+from metrics import stage
+
+@dataclass
+class VideoInfo:
+    """What the container says about a video's first video stream."""
+    width: int
+    height: int
+    fps: float
+    duration: float
+
+def probe_video(path: str) -> VideoInfo:
+    """
+    Reads size, frame rate and duration without decoding any frames.
+    """
+    infos = ffmpeg_parse_infos(path)
+    width, height = infos['video_size']
+    return VideoInfo(width, height, infos.get('video_fps') or 0, infos.get('duration') or 0)
+
+def decode_batches(path: str, fps: float, size: tuple, batch_size: int = 8, start: float = 0.0,
+                   duration: float = None):
+    """
+    Yields the frames of ``path`` at ``fps`` frames per second, scaled to
+    ``size`` by ffmpeg, as ``(n, height, width, 3)`` uint8 arrays of up to
+    ``batch_size`` frames. ``start`` and ``duration`` (in seconds) limit
+    decoding to a window of the file.
+
+    Only one batch is held at a time. Closing the generator early stops the
+    decoder.
+    """
+    width, height = size
+    window = ['-ss', str(start)] if start else []
+    if duration is not None:
+        window += ['-t', str(duration)]
+    cmd = [
+        get_setting('FFMPEG_BINARY'), '-loglevel', 'error', *window, '-i', path, '-an',
+        '-vf', f'fps={fps},scale={width}:{height}:flags=bicubic',
+        '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-',
+    ]
+    frame_bytes = width * height * 3
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=frame_bytes)
+    try:
+        while True:
+            data = process.stdout.read(frame_bytes * batch_size)
+            count = len(data) // frame_bytes
+            if count:
+                # A bytearray keeps the frames writable for the overlay stage
+                yield np.frombuffer(bytearray(data[:count * frame_bytes]), dtype=np.uint8).reshape(count, height, width, 3)
+            if len(data) < frame_bytes * batch_size:
+                break
+    finally:
+        process.stdout.close()
+        if process.poll() is None:
+            process.kill()
+        stderr = process.stderr.read()
+        process.stderr.close()
+        process.wait()
+    if process.returncode != 0:
+        raise OSError(f"ffmpeg could not decode {path}: {stderr.decode(errors='replace').strip()}")
+
+def decode_frames(path: str, fps: float, size: tuple):
+    """
+    Like decode_batches(), one ``(height, width, 3)`` frame at a time.
+    """
+    for batch in decode_batches(path, fps, size):
+        yield from batch
+
+@dataclass
+class OverlayLayer:
+    """
+    An RGBA image (``(h, w, 4)`` uint8) drawn at ``position`` between
+    ``start`` and ``end`` seconds. ``position`` follows MoviePy's
+    ``set_position``: pixels, or 'left'/'center'/'right' and
+    'top'/'center'/'bottom'.
+    """
+    rgba: np.ndarray
+    position: tuple
+    start: float
+    end: float
+
+    def __post_init__(self):
+        # Blending is out = (rgb * a + frame * (255 - a)) / 255; the terms that
+        # only depend on the layer are computed once, in 16-bit integers
+        alpha = self.rgba[..., 3:4].astype(np.uint16)
+        self.premultiplied = self.rgba[..., :3].astype(np.uint16) * alpha
+        self.inverse_alpha = 255 - alpha
+
+_NAMED_POSITIONS = {'center': ('center', 'center'), 'left': ('left', 'center'), 'right': ('right', 'center'),
+                    'top': ('center', 'top'), 'bottom': ('center', 'bottom')}
+
+def resolve_position(position, frame_size: tuple, layer_size: tuple) -> tuple:
+    """
+    Turns a MoviePy-style position into the top-left pixel of the layer.
+    """
+    if isinstance(position, str):
+        position = _NAMED_POSITIONS[position]
+    x, y = position
+    (frame_w, frame_h), (layer_w, layer_h) = frame_size, layer_size
+    if isinstance(x, str):
+        x = {'left': 0, 'center': (frame_w - layer_w) / 2, 'right': frame_w - layer_w}[x]
+    if isinstance(y, str):
+        y = {'top': 0, 'center': (frame_h - layer_h) / 2, 'bottom': frame_h - layer_h}[y]
+    return int(x), int(y)
+
+def blend(frames: np.ndarray, layer: OverlayLayer, times: np.ndarray):
+    """
+    Alpha-blends ``layer`` in place onto the frames of the ``(n, h, w, 3)``
+    batch ``frames`` whose time (from ``times``) falls in its window, in one
+    array operation over the whole batch. The layer is clipped to the frame.
+    """
+    on_screen = np.flatnonzero((layer.start <= times) & (times < layer.end))
+    if not len(on_screen):
+        return
+    frame_h, frame_w = frames.shape[1:3]
+    layer_h, layer_w = layer.rgba.shape[:2]
+    x, y = resolve_position(layer.position, (frame_w, frame_h), (layer_w, layer_h))
+    left, top = max(x, 0), max(y, 0)
+    right, bottom = min(x + layer_w, frame_w), min(y + layer_h, frame_h)
+    if left >= right or top >= bottom:
+        return
+    layer_rows, layer_cols = slice(top - y, bottom - y), slice(left - x, right - x)
+    # The window is a time interval, so the frames it covers are contiguous
+    region = frames[on_screen[0]:on_screen[-1] + 1, top:bottom, left:right]
+    blended = region * layer.inverse_alpha[layer_rows, layer_cols] + layer.premultiplied[layer_rows, layer_cols]
+    region[...] = (blended + 127) // 255
+
+def composite_batches(batches, layers: list, fps: float, start: float = 0.0):
+    """
+    Draws every layer that is on screen at each frame's time onto it; takes
+    and yields ``(n, h, w, 3)`` batches. The first frame is at ``start``
+    seconds.
+    """
+    index = 0
+    for batch in batches:
+        times = start + (index + np.arange(len(batch))) / fps
+        with stage('composite'):
+            for layer in layers:
+                blend(batch, layer, times)
+        index += len(batch)
+        yield batch
+
+def composite_frames(frames, layers: list, fps: float):
+    """
+    Like composite_batches(), one ``(h, w, 3)`` frame at a time.
+    """
+    for batch in composite_batches((frame[None] for frame in frames), layers, fps):
+        yield batch[0]
+
+class FrameStream:
+    """
+    A clip-like view of ``video_path`` decoded at ``size`` with ``layers``
+    blended on. Each call to iter_frames() decodes the file again, so the
+    stream can be consumed more than once without keeping any frames.
+
+    ``start`` and ``duration`` restrict the stream to a window of the video;
+    layer times stay relative to the start of the video.
+    """
+
+    def __init__(self, video_path: str, info: VideoInfo, size: tuple = None, layers: list = (),
+                 start: float = 0.0, duration: float = None):
+        self.video_path = video_path
+        self.info = info
+        self.size = tuple(size) if size else (info.width, info.height)
+        self.start = start
+        self.duration = info.duration - start if duration is None else duration
+        self.fps = info.fps
+        self.layers = list(layers)
+        # Without a window the decoder runs to the real end of the stream,
+        # which can be a little past the duration the container reports
+        self._decode_duration = duration
+
+    def iter_frames(self, fps: float = None, dtype: str = 'uint8'):
+        fps = fps or self.fps
+        batches = decode_batches(self.video_path, fps, self.size, start=self.start, duration=self._decode_duration)
+        for batch in composite_batches(batches, self.layers, fps, self.start):
+            for frame in batch:
+                yield frame if dtype == 'uint8' else frame.astype(dtype)
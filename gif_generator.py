@@ -1,83 +1,201 @@
+import importlib
 import os
-import yt_dlp
-from moviepy.editor import VideoFileClip, TextClip, CompositeVideoClip
-from yt_dlp import DownloadError
+import re
+import shutil
+import subprocess
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import parse_qs, urlparse
+from dataclasses import asdict, dataclass
+import numpy as np
+from moviepy.config import get_setting
+from encoders import ENCODER_VERSION, FfmpegPipe, encode_stream, get_encoder
+from formats import INTERMEDIATE, TeeStream, get_format, transcode, write_frames
+from frames import FrameStream, OverlayLayer, blend, probe_video
+from captions import rasterize_text
+from budget import RenderBudget, RenderPlan, render_within_budget
+from cache import CachedSegment, cache_key
+from metrics import call_traced, current_trace, stage
+from mp4edit import limit_edit_list
 
-def download_video_segment(youtube_url: str, start_time: int, end_time: int, output_dir: str = 'temp_videos') -> str:
+# yt-dlp format selection for source segments
+VIDEO_FORMAT = 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/mp4'
+# How a range is cut out of the source (see _fetch_segment): 'copy' keeps the
+# source's compressed video, 'encode' re-encodes video and audio with libx264/AAC
+CUT_MODES = ('copy', 'encode')
+# Cached stream URLs are dropped this many seconds before they expire
+URL_EXPIRY_MARGIN = 300
+# YouTube reports durations in whole seconds, truncated
+DURATION_SLACK = 1.0
+# Clips of a batch less than this many seconds apart are downloaded as one
+# range: fetching the gap costs less than starting another download
+BATCH_MERGE_GAP = 5.0
+# Imported on first use: yt-dlp and moviepy.editor take most of a second to
+# import, and pages that never download or render should not wait for them.
+# preload_heavy_modules() imports them ahead of time in a server's parent
+# process, so forked workers share them.
+HEAVY_IMPORTS = {
+    'yt_dlp': ('yt_dlp', None),
+    'DownloadError': ('yt_dlp', 'DownloadError'),
+    'VideoFileClip': ('moviepy.editor', 'VideoFileClip'),
+}
+
+def __getattr__(name: str):
+    if name not in HEAVY_IMPORTS:
+        raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+    module_name, attribute = HEAVY_IMPORTS[name]
+    value = importlib.import_module(module_name)
+    if attribute is not None:
+        value = getattr(value, attribute)
+    globals()[name] = value
+    return value
+
+def _heavy(name: str):
+    """One of HEAVY_IMPORTS, imported if it was not yet (or as patched in)."""
+    return globals()[name] if name in globals() else __getattr__(name)
+
+def preload_heavy_modules():
+    """Imports everything in HEAVY_IMPORTS now rather than on first use."""
+    for name in HEAVY_IMPORTS:
+        _heavy(name)
+
+class TimeRangeError(ValueError):
+    """A requested time range that lies outside the video."""
+
+def download_video_segment(youtube_url: str, start_time: int, end_time: int, output_dir: str = 'temp_videos',
+                           segment_cache=None, metadata_cache=None, cut_mode: str = 'encode') -> str:
     """
     Downloads a segment of a YouTube video.
+
+    yt-dlp only resolves the stream URLs; ffmpeg then seeks into them with
+    HTTP range requests, so just the requested time range (starting from the
+    keyframe that precedes ``start_time``) is fetched and the full source is
+    never written to disk.
+
+    ``cut_mode`` (one of CUT_MODES) says how the range is cut. ``encode``
+    re-encodes it, audio included. ``copy`` keeps the video stream exactly
+    as it was sent, drops the audio without fetching it, and leaves the
+    frames between the preceding keyframe and ``start_time`` for the
+    decoder to skip, so the segment still starts and ends on the exact
+    frames asked for.
+
+    With a SegmentCache as ``segment_cache``, a range inside a cached segment
+    is trimmed out of it without touching the network, and a range that
+    overlaps one only downloads the missing part. Either way the caller gets
+    its own file, which it may delete.
+
+    With a MetadataCache as ``metadata_cache``, the streams yt-dlp resolved
+    for the video are reused until they expire, and a range past the end of
+    a video whose duration is known is rejected with TimeRangeError before
+    anything is downloaded.
+
+    Every call works in a private scratch directory inside ``output_dir`` and
+    renames the finished file next to it, so concurrent downloads (even of
+    the same video) never see each other's partial files. The scratch
+    directory is removed whatever happens.
     """
+    if cut_mode not in CUT_MODES:
+        raise ValueError(f"Unknown cut mode '{cut_mode}'. Expected one of: {', '.join(CUT_MODES)}")
+    if metadata_cache is not None:
+        check_time_range(youtube_url, start_time, end_time, metadata_cache)
     os.makedirs(output_dir, exist_ok=True)
+    token = uuid.uuid4().hex[:12]
+    work_dir = os.path.join(output_dir, f'job-{token}')
+    os.mkdir(work_dir)
+    try:
+        if segment_cache is None:
+            path = _download_range(youtube_url, start_time, end_time, work_dir, metadata_cache=metadata_cache,
+                                   cut_mode=cut_mode)
+        else:
+            path = _download_cached_range(youtube_url, start_time, end_time, work_dir, segment_cache,
+                                          metadata_cache, cut_mode)
+        # e.g. <id>_<title>.<token>.mp4: named after the video, unique per call
+        output_path = os.path.join(output_dir, f'{os.path.splitext(os.path.basename(path))[0]}.{token}.mp4')
+        os.replace(path, output_path)
+        return output_path
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
 
-    ydl_opts = {
-        'format': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/mp4',
-        'outtmpl': f'{output_dir}/%(id)s_%(title)s.%(ext)s',
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio', # Placeholder, actual cutting is done by postprocessor_args
-            'preferredcodec': 'aac', # Placeholder
-        }],
-        'postprocessor_args': [
-            '-ss', str(start_time),
-            '-to', str(end_time),
-            '-c:v', 'libx264', '-c:a', 'aac', # Re-encode
-            '-avoid_negative_ts', 'make_zero', # Avoid issues with negative timestamps
-        ],
-        # 'ffmpeg_location': '/path/to/ffmpeg', # Optional: specify if not in PATH
-    }
+def _segment_format(cut_mode: str) -> str:
+    """
+    What segments cut in ``cut_mode`` are cached as. Copied segments start
+    with frames for the decoder to skip, so they are never joined with
+    re-encoded ones.
+    """
+    return VIDEO_FORMAT if cut_mode == 'encode' else f'{VIDEO_FORMAT} ({cut_mode})'
+
+def _download_cached_range(youtube_url: str, start_time: float, end_time: float, work_dir: str, segment_cache,
+                           metadata_cache=None, cut_mode: str = 'encode') -> str:
+    """
+    Produces ``[start_time, end_time)`` in ``work_dir``, going through the
+    segment cache and downloading only what it is missing.
+    """
+    video_id = normalize_video_id(youtube_url)
+    output_path = os.path.join(work_dir, f'{video_id}.mp4')
+    segment_format = _segment_format(cut_mode)
+    with segment_cache.lookup(video_id, start_time, end_time, segment_format) as cached:
+        if cached is not None and (cached.start, cached.end) == (start_time, end_time):
+            # e.g. the full render of a previewed range: nothing to cut
+            shutil.copyfile(cached.path, output_path)
+            return output_path
+        if cached is not None:
+            return _trim_segment(cached.path, start_time - cached.start, end_time - start_time, output_path,
+                                 cut_mode)
 
+    overlap = segment_cache.copy_overlapping(video_id, start_time, end_time, segment_format, work_dir)
+    if overlap is None:
+        segment = CachedSegment(_download_range(youtube_url, start_time, end_time, work_dir,
+                                                metadata_cache=metadata_cache, cut_mode=cut_mode),
+                                start_time, end_time)
+    else:
+        # Download only what the cached segment is missing and join the pieces
+        pieces = [overlap.path]
+        if start_time < overlap.start:
+            pieces.insert(0, _download_range(youtube_url, start_time, overlap.start, work_dir,
+                                             output_path=os.path.join(work_dir, 'head.mp4'),
+                                             metadata_cache=metadata_cache, cut_mode=cut_mode))
+        if end_time > overlap.end:
+            pieces.append(_download_range(youtube_url, overlap.end, end_time, work_dir,
+                                          output_path=os.path.join(work_dir, 'tail.mp4'),
+                                          metadata_cache=metadata_cache, cut_mode=cut_mode))
+        segment = CachedSegment(_concat_segments(pieces, os.path.join(work_dir, 'joined.mp4'), cut_mode),
+                                min(start_time, overlap.start), max(end_time, overlap.end))
+    segment_cache.store(video_id, segment.start, segment.end, segment_format, segment.path)
+
+    if (segment.start, segment.end) == (start_time, end_time):
+        return segment.path
+    return _trim_segment(segment.path, start_time - segment.start, end_time - start_time, output_path, cut_mode)
+
+def _download_range(youtube_url: str, start_time: float, end_time: float, output_dir: str, output_path: str = None,
+                    metadata_cache=None, cut_mode: str = 'encode') -> str:
+    """
+    Resolves the streams with yt-dlp (or takes them from ``metadata_cache``)
+    and fetches ``[start_time, end_time)``.
+
+    The file is named after the video unless ``output_path`` is given. Cached
+    stream URLs that no longer work are resolved again, once.
+    """
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info_dict = ydl.extract_info(youtube_url, download=True)
-            # Construct the filename based on outtmpl and info_dict
-            # yt-dlp replaces special characters in title, so we rely on its generated filename
-            # The actual filename is available after download in info_dict['_filename'] if using generic extractor
-            # or more reliably by listing the directory if only one file is expected.
-            # For simplicity, we'll assume the postprocessor_args correctly name and place the file.
-            
-            # After processing, yt-dlp might change the extension or filename slightly.
-            # We need to find the actual file created.
-            # A common pattern is that the original extension might be kept before processing,
-            # and then a new file with .mp4 is created.
-            
-            # Simplest approach: find the first .mp4 file in the output_dir
-            # This assumes only one video is processed at a time in this directory by this function.
-            downloaded_files = [f for f in os.listdir(output_dir) if f.endswith('.mp4')]
-            if not downloaded_files:
-                # Fallback if no mp4, maybe original extension was kept
-                 downloaded_files = [f for f in os.listdir(output_dir) if ydl.prepare_filename(info_dict).startswith(os.path.join(output_dir, os.path.splitext(f)[0]))]
-
-            if downloaded_files:
-                # Assuming the first match is our processed file
-                # If multiple files, this might pick the wrong one.
-                # A more robust way would be to get the exact output filename from ydl_opts['outtmpl']
-                # and info_dict, then expect that name.
-                
-                # yt-dlp's prepare_filename can give the expected name BEFORE postprocessing.
-                # The postprocessor might change it.
-                # Let's try to guess the filename based on the template
-                base_name_template = ydl.prepare_filename(info_dict).rsplit('.', 1)[0]
-                
-                # Search for files that start with the base name and end with .mp4
-                possible_files = [f for f in os.listdir(output_dir) if f.startswith(os.path.basename(base_name_template)) and f.endswith('.mp4')]
-
-                if not possible_files: # if no such file, maybe the original extension was kept by postprocessing
-                    original_ext = ydl.prepare_filename(info_dict).rsplit('.', 1)[-1]
-                    possible_files = [f for f in os.listdir(output_dir) if f.startswith(os.path.basename(base_name_template)) and f.endswith(f'.{original_ext}')]
-
-
-                if possible_files:
-                    # To be safer, sort by modification time if multiple matches, take newest.
-                    # For now, just take the first one.
-                    processed_filename = possible_files[0]
-                    return os.path.join(output_dir, processed_filename)
-                else:
-                    # If still no file, this is an issue.
-                    raise FileNotFoundError(f"Could not find processed video file in {output_dir} for {youtube_url}")
-
-            else:
-                raise FileNotFoundError(f"No video file found in {output_dir} after download attempt for {youtube_url}")
-
-    except DownloadError as e:
+        video, cached = _resolve_video(youtube_url, output_dir, metadata_cache)
+        _check_range(start_time, end_time, video['duration'])
+        if output_path is None:
+            # The segment is always re-muxed into mp4, whatever the source container was
+            output_path = os.path.join(output_dir, video['filename'] + '.mp4')
+
+        try:
+            _fetch_segment(video['sources'], start_time, end_time, output_path, cut_mode)
+        except _heavy('DownloadError'):
+            if not cached:
+                raise
+            metadata_cache.invalidate(normalize_video_id(youtube_url), VIDEO_FORMAT)
+            video, _ = _resolve_video(youtube_url, output_dir, metadata_cache)
+            _fetch_segment(video['sources'], start_time, end_time, output_path, cut_mode)
+
+        if not os.path.exists(output_path):
+            raise FileNotFoundError(f"No video file found in {output_dir} after download attempt for {youtube_url}")
+        return output_path
+
+    except _heavy('DownloadError') as e:
         print(f"Error downloading video: {e}")
         # Consider re-raising or returning a specific error code/value
         raise  # Re-raise the exception for the caller to handle
@@ -85,30 +203,529 @@ def download_video_segment(youtube_url: str, start_time: int, end_time: int, out
         print(f"An unexpected error occurred during download: {e}")
         raise
 
-def convert_to_gif(video_path: str, gif_path: str, fps: int = 10) -> str:
+def _resolve_video(youtube_url: str, output_dir: str, metadata_cache=None) -> tuple:
+    """
+    Returns ``(video, cached)``: the video's id, title, duration (None if
+    unknown), file name stem and stream ``[url, http_headers]`` pairs, and
+    whether they came from ``metadata_cache`` rather than yt-dlp.
+
+    Freshly extracted metadata is stored in ``metadata_cache`` until its
+    stream URLs expire.
+    """
+    video_id = normalize_video_id(youtube_url)
+    if metadata_cache is not None:
+        video = metadata_cache.get(video_id, VIDEO_FORMAT)
+        if video is not None:
+            return video, True
+
+    ydl_opts = {
+        'format': VIDEO_FORMAT,
+        'outtmpl': f'{output_dir}/%(id)s_%(title)s.%(ext)s',
+        'quiet': True,
+        'no_warnings': True,
+    }
+    with stage('extract'), _heavy('yt_dlp').YoutubeDL(ydl_opts) as ydl:
+        info_dict = ydl.extract_info(youtube_url, download=False)
+        filename = os.path.splitext(os.path.basename(ydl.prepare_filename(info_dict)))[0]
+    video = {
+        'id': info_dict.get('id'),
+        'title': info_dict.get('title'),
+        'duration': info_dict.get('duration'),
+        'filename': filename,
+        'sources': [[url, headers] for url, headers in _stream_sources(info_dict)],
+    }
+    if metadata_cache is not None:
+        metadata_cache.put(video_id, VIDEO_FORMAT, video, expires_at=_sources_expiry(video['sources']))
+    return video, False
+
+def _sources_expiry(sources: list) -> float:
     """
-    Converts a video file to a GIF.
+    When the first of the stream URLs stops working, less a margin, going by
+    the ``expire`` timestamp YouTube puts in them; None if they carry none.
     """
+    expiries = []
+    for url, _ in sources:
+        try:
+            expiries.append(float(parse_qs(urlparse(url).query)['expire'][0]))
+        except (KeyError, ValueError):
+            pass
+    return min(expiries) - URL_EXPIRY_MARGIN if expiries else None
+
+def _check_range(start_time: float, end_time: float, duration: float):
+    """
+    Raises TimeRangeError if the range does not fit in a video of
+    ``duration`` seconds; a None duration fits anything.
+    """
+    if duration is None:
+        return
+    if start_time >= duration or end_time > duration + DURATION_SLACK:
+        raise TimeRangeError(f"The video is {duration:g} seconds long, so {start_time:g}-{end_time:g} s "
+                             f"is out of range")
+
+def check_time_range(youtube_url: str, start_time: float, end_time: float, metadata_cache):
+    """
+    Raises TimeRangeError if ``metadata_cache`` knows the video is too short
+    for the range. Never touches the network: an uncached video passes.
+    """
+    video = metadata_cache.get(normalize_video_id(youtube_url), VIDEO_FORMAT)
+    if video is not None:
+        _check_range(start_time, end_time, video['duration'])
+
+def _ffmpeg_binary() -> str:
+    """
+    Returns the ffmpeg executable MoviePy is configured with, so downloads and
+    rendering always go through the same binary.
+    """
+    return get_setting('FFMPEG_BINARY')
+
+def _stream_sources(info_dict: dict) -> list:
+    """
+    Returns ``(url, http_headers)`` pairs for the streams yt-dlp selected.
+
+    Merged formats (``bestvideo+bestaudio``) list one entry per stream in
+    ``requested_formats``; single-file formats carry the URL on the info dict.
+    """
+    formats = info_dict.get('requested_formats') or [info_dict]
+    sources = [(f['url'], f.get('http_headers') or {}) for f in formats if f.get('url')]
+    if not sources:
+        raise _heavy('DownloadError')(f"No stream URL found for {info_dict.get('id', 'unknown video')}")
+    return sources
+
+# Keeps the first video stream as it is, edit list and all, without audio
+_COPY_VIDEO = ['-map', '0:v:0', '-c:v', 'copy', '-an']
+
+def _fetch_segment(sources: list, start_time: float, end_time: float, output_path: str,
+                   cut_mode: str = 'encode') -> str:
+    """
+    Fetches ``[start_time, end_time)`` of the given streams into ``output_path``.
+
+    ``-ss`` is passed as an input option, so ffmpeg seeks the demuxer to the
+    keyframe before ``start_time`` and only reads from there on. When
+    encoding, everything between that keyframe and ``start_time`` is decoded
+    and dropped, which keeps the cut frame-accurate. When copying, those
+    frames are kept but left out of the MP4's edit list, which the decoder
+    honours; that costs nothing when ``start_time`` is a keyframe, and at
+    most one keyframe interval of extra decoding in the render otherwise.
+    See mp4edit for the end of the cut.
+    """
+    if cut_mode == 'copy':
+        # Merged formats list the video stream first; the audio is never needed
+        sources = sources[:1]
+    cmd = [_ffmpeg_binary(), '-y', '-loglevel', 'error']
+    for url, headers in sources:
+        if headers:
+            cmd += ['-headers', ''.join(f'{key}: {value}\r\n' for key, value in headers.items())]
+        cmd += ['-ss', str(start_time), '-i', url]
+    cmd += ['-t', str(end_time - start_time)]
+    if cut_mode == 'copy':
+        cmd += _COPY_VIDEO
+    else:
+        cmd += [
+            '-c:v', 'libx264', '-c:a', 'aac', # Re-encode
+            '-avoid_negative_ts', 'make_zero', # Avoid issues with negative timestamps
+        ]
+    cmd.append(output_path)
+
+    # Fetching and cutting happen in the same ffmpeg process, so they are one stage
+    with stage('download') as timing:
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        if result.returncode != 0:
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            raise _heavy('DownloadError')(f"ffmpeg could not fetch the segment: {result.stderr.strip()}")
+        if cut_mode == 'copy':
+            limit_edit_list(output_path, end_time - start_time)
+        timing.bytes = os.path.getsize(output_path)
+    return output_path
+
+def _trim_segment(source_path: str, offset: float, duration: float, output_path: str,
+                  cut_mode: str = 'encode') -> str:
+    """
+    Cuts ``duration`` seconds starting ``offset`` seconds into a local segment.
+    """
+    cmd = [_ffmpeg_binary(), '-y', '-loglevel', 'error', '-ss', str(offset), '-i', source_path, '-t', str(duration)]
+    if cut_mode == 'copy':
+        cmd += _COPY_VIDEO
+    else:
+        cmd += ['-c:v', 'libx264', '-preset', 'veryfast', '-c:a', 'aac']
+    cmd.append(output_path)
+    with stage('trim'):
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        if result.returncode == 0 and cut_mode == 'copy':
+            limit_edit_list(output_path, duration)
+    if result.returncode != 0:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise OSError(f"ffmpeg could not trim {source_path}: {result.stderr.strip()}")
+    return output_path
+
+def _concat_segments(paths: list, output_path: str, cut_mode: str = 'encode') -> str:
+    """
+    Joins consecutive segments end to end. Re-encoded ones all come out of
+    _fetch_segment with the same codecs, so the streams are copied. Copied
+    ones start with frames that only their own edit lists skip, which the
+    concat demuxer would show, so each is decoded on its own and the join
+    is encoded.
+    """
+    list_path = None
+    if cut_mode == 'copy':
+        inputs = [arg for path in paths for arg in ('-i', path)]
+        cmd = [_ffmpeg_binary(), '-y', '-loglevel', 'error', *inputs,
+               '-filter_complex', f'concat=n={len(paths)}:v=1:a=0', '-c:v', 'libx264', '-preset', 'veryfast',
+               output_path]
+    else:
+        list_path = output_path + '.txt'
+        with open(list_path, 'w') as f:
+            for path in paths:
+                f.write(f"file '{os.path.abspath(path)}'\n")
+        cmd = [_ffmpeg_binary(), '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', list_path,
+               '-c', 'copy', output_path]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True)
+    finally:
+        if list_path is not None:
+            os.remove(list_path)
+    if result.returncode != 0:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise OSError(f"ffmpeg could not join segments: {result.stderr.strip()}")
+    return output_path
+
+@dataclass
+class TextOverlay:
+    """
+    A caption drawn on top of the rendered GIF.
+
+    ``start_time`` is in seconds into the GIF; a ``duration`` of -1 keeps the
+    text on screen until the end. ``stroke_width`` pixels of ``stroke_color``
+    outline the glyphs when both are set.
+    """
+    text: str
+    start_time: float = 0.0
+    duration: float = -1
+    font_size: int = 24
+    font_color: str = 'white'
+    position: tuple = ('center', 'bottom')
+    font: str = 'Arial'
+    stroke_color: str = None
+    stroke_width: int = 0
+
+@dataclass
+class RenderResult:
+    """What render_gif produced, and how long encoding took with which backend."""
+    path: str
+    fps: float
+    duration: float
+    encoder: str
+    encode_seconds: float
+    output_bytes: int
+    cached: bool = False
+    plan: RenderPlan = None
+    output_format: str = 'gif'
+
+@dataclass(frozen=True)
+class PreviewSettings:
+    """
+    The corners a preview render cuts to be back within about a second: it
+    is at most ``width`` pixels wide, runs at ``fps`` or less, has at most
+    ``max_frames`` frames (long clips get a lower frame rate instead of
+    being cut short) and a palette of ``max_colors``. Like full renders,
+    it only stores what changed between frames (see encoders.encode_stream).
+    """
+    width: int = 240
+    fps: float = 6
+    max_frames: int = 36
+    max_colors: int = 32
+    delta_threshold: int = 8
+
+@dataclass
+class Clip:
+    """One clip of a batch (see create_gifs): a time range and its captions."""
+    start_time: float
+    end_time: float
+    overlays: list = ()
+
+def _overlay_timing(overlay: TextOverlay, clip_duration: float) -> tuple:
+    """
+    Clamps an overlay's start time and duration to the clip.
+    """
+    text_start_time = overlay.start_time
+    # Ensure text_start_time is within bounds
+    if text_start_time < 0:
+        text_start_time = 0
+    elif text_start_time > clip_duration:
+        text_start_time = clip_duration
+        print(f"Warning: Text start time ({overlay.start_time}s) exceeds GIF duration ({clip_duration}s). Text may not be visible.")
+
+    if overlay.duration == -1 or (text_start_time + overlay.duration > clip_duration):
+        text_duration = clip_duration - text_start_time
+    else:
+        text_duration = overlay.duration
+    return text_start_time, text_duration
+
+def render_gif(video_path: str, output_path: str, overlays: list = (), fps: float = None,
+               encoder: str = 'moviepy', encoder_options: dict = None, budget: RenderBudget = None,
+               output_format: str = 'gif', intermediate_path: str = None,
+               preview: PreviewSettings = None, max_width: int = None, max_height: int = None) -> RenderResult:
+    """
+    Renders a video file to a GIF, drawing ``overlays`` on the way.
+
+    The source is decoded once and the GIF is quantized and encoded once, so
+    captions never go through an intermediate GIF. ``fps`` defaults to the
+    source frame rate. ``encoder`` names a backend from encoders.ENCODERS and
+    ``encoder_options`` are passed through to it (e.g. ``palette``/``dither``
+    for the ffmpeg backend).
+
+    ``max_width`` and ``max_height`` bound the output size; a larger source
+    is scaled down to fit, keeping its aspect ratio, and is never scaled up.
+    Scaling and frame rate decimation happen in ffmpeg as the source is
+    decoded, so only frames at the output size and rate reach Python.
+    The ``moviepy`` backend is the exception: its reader scales in ffmpeg
+    but still passes every source frame up, dropping those it skips.
+
+    Captions are rasterized once (see captions.rasterize_text) and
+    alpha-blended onto the frames with numpy. The ``moviepy`` backend needs a
+    MoviePy clip, captioned through a frame filter. Every other backend is
+    fed by a FrameStream instead, which decodes and captions a few frames at
+    a time, so memory use stays flat however long the clip is.
+
+    With a RenderBudget as ``budget``, frame rate (at most ``fps``), output
+    width and palette size are chosen to fit it (see budget.py) and the
+    result's ``plan`` reports the choice. That needs a backend other than
+    ``moviepy``.
+
+    ``output_format`` names another format from formats.OUTPUT_FORMATS (e.g.
+    'webp' or 'mp4') to write instead of a GIF; the encoder is then unused.
+    With an ``intermediate_path``, the captioned frames are also written
+    there losslessly, for convert_rendered() to make other formats from
+    later. The ``moviepy`` backend cannot keep an intermediate.
+
+    With PreviewSettings as ``preview``, a small, rough GIF is rendered
+    instead, for checking the range and caption timing quickly. Previews
+    always go through the ``stream`` backend, with one palette for all
+    frames and no dithering, whatever ``encoder`` is. A preview has no
+    budget, intermediate or other format.
+    """
+    encode = get_encoder(encoder)
+    get_format(output_format)
+    if preview is not None and (budget is not None or output_format != 'gif' or intermediate_path is not None):
+        raise ValueError('A preview is always a GIF, without a budget or an intermediate')
+    if budget is not None and encoder == 'moviepy':
+        raise ValueError("A size or time budget needs the 'stream' or 'ffmpeg' encoder")
+    if budget is not None and output_format != 'gif':
+        raise ValueError('Size and time budgets only apply to GIF output')
     if not os.path.exists(video_path):
         raise FileNotFoundError(f"Video file not found: {video_path}")
 
-    output_gif_dir = os.path.dirname(gif_path)
-    if output_gif_dir: # Ensure directory exists if gif_path includes a directory
-        os.makedirs(output_gif_dir, exist_ok=True)
+    output_dir = os.path.dirname(output_path)
+    if output_dir: # Ensure directory exists if output_path includes a directory
+        os.makedirs(output_dir, exist_ok=True)
 
+    if preview is not None:
+        try:
+            return _render_preview(video_path, output_path, overlays, fps, preview, max_width, max_height)
+        except Exception as e:
+            print(f"Error rendering preview: {e}")
+            raise
+    if encoder != 'moviepy' or output_format != 'gif':
+        try:
+            if budget is not None:
+                return _render_budgeted(video_path, output_path, overlays, fps, encode, encoder_options, budget,
+                                        intermediate_path, max_width, max_height)
+            return _render_stream(video_path, output_path, overlays, fps, encode, encoder_options, output_format,
+                                  intermediate_path, max_width, max_height)
+        except Exception as e:
+            print(f"Error rendering GIF: {e}")
+            raise
+    if intermediate_path is not None:
+        print("Warning: The moviepy encoder cannot keep an intermediate; other formats will need a new render.")
+
+    clip = None
+    final_clip = None
     try:
-        clip = VideoFileClip(video_path)
-        clip.write_gif(gif_path, fps=fps)
-        clip.close() # Release resources
-        return gif_path
+        scale = 1.0
+        if max_width or max_height:
+            info = probe_video(video_path)
+            width, height = _fit_size(info.width, info.height, max_width, max_height)
+            scale = width / info.width
+        if scale < 1:
+            clip = _heavy('VideoFileClip')(video_path, target_resolution=(height, width))
+        else:
+            clip = _heavy('VideoFileClip')(video_path)
+        layers = _text_layers(overlays, clip.duration, scale)
+        output_fps = _output_fps(fps, clip.fps)
+
+        final_clip = clip.fl(lambda get_frame, t: _captioned_frame(get_frame, t, layers)) if layers else clip
+        with stage('encode') as timing:
+            stats = encode(final_clip, output_path, output_fps, **(encoder_options or {}))
+            timing.bytes = stats.output_bytes
+
+        return RenderResult(path=output_path, fps=output_fps, duration=clip.duration, encoder=stats.encoder,
+                            encode_seconds=stats.seconds, output_bytes=stats.output_bytes)
     except Exception as e:
-        print(f"Error converting video to GIF: {e}")
-        # Clean up partial GIF if created? MoviePy might handle this.
-        if os.path.exists(gif_path):
-            # Potentially remove corrupted/partial gif
-            # os.remove(gif_path) # Or leave it for inspection
-            pass
+        print(f"Error rendering GIF: {e}")
         raise
+    finally:
+        # Release resources, including when an error occurs mid-process
+        if clip is not None:
+            clip.close()
+        if final_clip is not None and final_clip is not clip:
+            final_clip.close()
+
+def _captioned_frame(get_frame, t: float, layers: list) -> np.ndarray:
+    """
+    A MoviePy frame filter drawing the layers that are on screen at ``t``.
+    """
+    frame = get_frame(t)
+    if not any(layer.start <= t < layer.end for layer in layers):
+        return frame
+    # Decoded frames may be read-only buffers, so draw on a copy
+    with stage('composite'):
+        batch = np.array(frame, dtype=np.uint8)[None]
+        for layer in layers:
+            blend(batch, layer, np.array([t]))
+    return batch[0]
+
+def _output_fps(fps: float, source_fps: float) -> float:
+    """
+    The requested fps, or the source fps, or a default if that is invalid too.
+    """
+    if fps:
+        return fps
+    if not source_fps or source_fps <= 0:
+        print(f"Warning: Source FPS is invalid ({source_fps}). Using default FPS of 10.")
+        return 10
+    return source_fps
+
+def _fit_size(width: int, height: int, max_width: int = None, max_height: int = None) -> tuple:
+    """
+    ``(width, height)`` scaled down to fit within ``max_width`` and
+    ``max_height`` (either may be None), keeping the aspect ratio.
+    """
+    scale = min(1.0, max_width / width if max_width else 1.0, max_height / height if max_height else 1.0)
+    if scale == 1:
+        return width, height
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def _text_layers(overlays: list, clip_duration: float, scale: float = 1.0) -> list:
+    """
+    Rasterizes each visible overlay's text into an RGBA layer, with its
+    on-screen window clamped to the clip. ``scale`` resizes text, stroke and
+    pixel positions for output smaller than the source.
+    """
+    layers = []
+    for overlay in overlays:
+        text_start_time, text_duration = _overlay_timing(overlay, clip_duration)
+        if text_duration <= 0:
+            print(f"Warning: Calculated text duration is {text_duration}s. Text will not be visible. GIF duration: {clip_duration}, start_time: {text_start_time}")
+            continue
+        font_size = max(1, round(overlay.font_size * scale))
+        stroke_width = max(1, round(overlay.stroke_width * scale)) if overlay.stroke_width else 0
+        position = overlay.position
+        if scale != 1 and not isinstance(position, str):
+            position = tuple(value if isinstance(value, str) else value * scale for value in position)
+        with stage('captions'):
+            rgba = rasterize_text(overlay.text, overlay.font, font_size, overlay.font_color,
+                                  overlay.stroke_color, stroke_width)
+        layers.append(OverlayLayer(rgba, position, text_start_time, text_start_time + text_duration))
+    return layers
+
+def _write(clip, output_path: str, fps: float, output_format: str, encode, encoder_options: dict,
+           intermediate_path: str = None):
+    """
+    Encodes a clip-like stream in ``output_format``, GIFs with the ``encode``
+    backend, also keeping its frames at ``intermediate_path`` if given.
+    """
+    if intermediate_path is not None:
+        with FfmpegPipe(intermediate_path, clip.size, fps, list(INTERMEDIATE.output_args)) as pipe:
+            return _write(TeeStream(clip, pipe), output_path, fps, output_format, encode, encoder_options)
+    if output_format == 'gif':
+        return encode(clip, output_path, fps, **(encoder_options or {}))
+    return write_frames(clip, output_path, fps, get_format(output_format))
+
+def _render_stream(video_path: str, output_path: str, overlays: list, fps: float, encode,
+                   encoder_options: dict, output_format: str = 'gif', intermediate_path: str = None,
+                   max_width: int = None, max_height: int = None) -> RenderResult:
+    info = probe_video(video_path)
+    output_fps = _output_fps(fps, info.fps)
+    size = _fit_size(info.width, info.height, max_width, max_height)
+    layers = _text_layers(overlays, info.duration, size[0] / info.width)
+    with stage('encode') as timing:
+        stats = _write(FrameStream(video_path, info, size=size, layers=layers), output_path, output_fps, output_format,
+                       encode, encoder_options, intermediate_path)
+        timing.bytes = stats.output_bytes
+    return RenderResult(path=output_path, fps=output_fps, duration=info.duration, encoder=stats.encoder,
+                        encode_seconds=stats.seconds, output_bytes=stats.output_bytes, output_format=output_format)
+
+def _render_preview(video_path: str, output_path: str, overlays: list, fps: float, preview: PreviewSettings,
+                    max_width: int = None, max_height: int = None) -> RenderResult:
+    info = probe_video(video_path)
+    output_fps = min(_output_fps(fps, info.fps), preview.fps)
+    if info.duration * output_fps > preview.max_frames:
+        output_fps = preview.max_frames / info.duration
+    size = _fit_size(info.width, info.height, min(preview.width, max_width or preview.width), max_height)
+    width = size[0]
+    # Decoding at the small size and rate is where most of the time goes
+    stream = FrameStream(video_path, info, size=size, layers=_text_layers(overlays, info.duration, width / info.width))
+    with stage('encode') as timing:
+        # A palette per window of frames would take longer to compute than the frames take to decode
+        stats = encode_stream(stream, output_path, output_fps, max_colors=preview.max_colors, dither='none',
+                              palette_window=preview.max_frames, delta_threshold=preview.delta_threshold)
+        timing.bytes = stats.output_bytes
+    return RenderResult(path=output_path, fps=output_fps, duration=info.duration, encoder=stats.encoder,
+                        encode_seconds=stats.seconds, output_bytes=stats.output_bytes)
+
+def _render_budgeted(video_path: str, output_path: str, overlays: list, fps: float, encode,
+                     encoder_options: dict, budget: RenderBudget, intermediate_path: str = None,
+                     max_width: int = None, max_height: int = None) -> RenderResult:
+    info = probe_video(video_path)
+    layers_by_width = {}
+
+    def render(setting, path, window):
+        if setting.width not in layers_by_width:
+            layers_by_width[setting.width] = _text_layers(overlays, info.duration, setting.width / info.width)
+        start, length = window or (0.0, None)
+        stream = FrameStream(video_path, info, size=(setting.width, setting.height),
+                             layers=layers_by_width[setting.width], start=start, duration=length)
+        # Any render of the whole clip may be the one that is kept, so the
+        # intermediate is rewritten each time and always matches the output
+        whole = window is None or window == (0.0, info.duration)
+        with stage('encode' if window is None else 'trial_encode') as timing:
+            stats = _write(stream, path, setting.fps, 'gif', encode, dict(encoder_options or {}, max_colors=setting.max_colors),
+                           intermediate_path if whole else None)
+            timing.bytes = stats.output_bytes
+        return stats
+
+    # The largest setting tried is the source fitted to the size limits
+    plan, stats = render_within_budget(render, output_path, info.duration,
+                                       _fit_size(info.width, info.height, max_width, max_height),
+                                       _output_fps(fps, info.fps), budget)
+    return RenderResult(path=output_path, fps=plan.fps, duration=info.duration, encoder=stats.encoder,
+                        encode_seconds=plan.seconds, output_bytes=stats.output_bytes, plan=plan)
+
+def convert_rendered(intermediate_path: str, output_path: str, output_format: str = 'gif', encoder: str = 'moviepy',
+                     encoder_options: dict = None) -> RenderResult:
+    """
+    Makes ``output_format`` out of a render's intermediate (see render_gif),
+    which already has the captions, size and frame rate of the render. GIFs
+    go through ``encoder``; other formats are transcoded by ffmpeg alone.
+    """
+    if output_format == 'gif':
+        return render_gif(intermediate_path, output_path, encoder=encoder, encoder_options=encoder_options)
+    info = probe_video(intermediate_path)
+    with stage('convert') as timing:
+        stats = transcode(intermediate_path, output_path, get_format(output_format))
+        timing.bytes = stats.output_bytes
+    return RenderResult(path=output_path, fps=info.fps, duration=info.duration, encoder=stats.encoder,
+                        encode_seconds=stats.seconds, output_bytes=stats.output_bytes, output_format=output_format)
+
+def convert_to_gif(video_path: str, gif_path: str, fps: int = 10, max_width: int = None,
+                   max_height: int = None) -> str:
+    """
+    Converts a video file to a GIF, at most ``max_width`` by ``max_height``
+    pixels if given.
+    """
+    return render_gif(video_path, gif_path, fps=fps, max_width=max_width, max_height=max_height).path
 
 def add_text_overlay(input_gif_path: str, output_gif_path: str, text: str,
                      text_start_time: float, duration_on_screen: float = -1,
@@ -116,70 +733,337 @@ def add_text_overlay(input_gif_path: str, output_gif_path: str, text: str,
                      position: tuple = ('center', 'bottom'), font: str = 'Arial') -> str:
     """
     Adds text overlay to an existing GIF.
+
+    Prefer passing the overlay to render_gif with the source video, which
+    avoids decoding and re-quantizing an intermediate GIF.
     """
     if not os.path.exists(input_gif_path):
         raise FileNotFoundError(f"Input GIF not found: {input_gif_path}")
 
-    output_gif_dir = os.path.dirname(output_gif_path)
-    if output_gif_dir: # Ensure directory exists
-        os.makedirs(output_gif_dir, exist_ok=True)
+    overlay = TextOverlay(text, start_time=text_start_time, duration=duration_on_screen,
+                          font_size=font_size, font_color=font_color, position=position, font=font)
+    return render_gif(input_gif_path, output_gif_path, overlays=[overlay]).path
+
+YOUTUBE_ID_PATTERN = re.compile(
+    r'(?:youtube(?:-nocookie)?\.com/(?:watch\?(?:.*&)?v=|embed/|shorts/|live/|v/)|youtu\.be/)([A-Za-z0-9_-]{11})'
+)
+
+def normalize_video_id(youtube_url: str) -> str:
+    """
+    Returns the YouTube video id for any of the usual URL shapes
+    (watch?v=, youtu.be/, shorts/, embed/...), so equivalent links compare
+    equal. Other URLs are returned stripped.
+    """
+    match = YOUTUBE_ID_PATTERN.search(youtube_url)
+    return match.group(1) if match else youtube_url.strip()
+
+def render_cache_key(youtube_url: str, start_time: float, end_time: float, overlays: list = (), fps: float = 10,
+                     encoder: str = 'moviepy', encoder_options: dict = None, budget: RenderBudget = None,
+                     preview: PreviewSettings = None, max_width: int = None, max_height: int = None) -> str:
+    """
+    The ResultCache key for a render: a hash of the normalized video id, the
+    time range, fps, every overlay's text, timing and font settings, the
+    encoder with its options and version, and the budget, preview settings
+    and size limits if there are any.
+    """
+    params = {
+        'video_id': normalize_video_id(youtube_url),
+        'start_time': float(start_time),
+        'end_time': float(end_time),
+        'fps': fps,
+        'overlays': [asdict(overlay) for overlay in overlays],
+        'encoder': encoder,
+        'encoder_options': encoder_options or {},
+        'encoder_version': ENCODER_VERSION,
+    }
+    if budget is not None:
+        # Only added when set, so keys of unbudgeted renders stay as they were
+        params['budget'] = asdict(budget)
+    if preview is not None:
+        params['preview'] = asdict(preview)
+    if max_width:
+        params['max_width'] = max_width
+    if max_height:
+        params['max_height'] = max_height
+    return cache_key(params)
+
+def _run(render_pool, fn, *args, **kwargs):
+    """
+    Calls ``fn`` in the RenderPool if there is one, or right here.
+    """
+    if render_pool is not None:
+        # The child's stage timings come back with the result
+        result, stages = render_pool.run(call_traced, fn, *args, **kwargs)
+        if current_trace() is not None:
+            current_trace().merge(stages)
+        return result
+    return fn(*args, **kwargs)
 
+def convert_cached(key: str, output_format: str, cache, intermediate_cache, encoder: str = 'moviepy',
+                   encoder_options: dict = None, render_pool=None) -> RenderResult:
+    """
+    Adds the ``output_format`` version of the render cached under ``key`` to
+    ``cache``, converting it from the render's intermediate in
+    ``intermediate_cache`` without the source. Returns None if that
+    intermediate is no longer cached.
+    """
+    extension = get_format(output_format).extension
+    intermediate_path = intermediate_cache.get(key)
+    if intermediate_path is None:
+        return None
+    output_path = cache.temp_path_for(key, extension)
     try:
-        gif_clip = VideoFileClip(input_gif_path)
+        result = _run(render_pool, convert_rendered, intermediate_path, output_path, output_format, encoder,
+                      encoder_options)
+        result.path = cache.put(key, output_path, extension)
+        return result
+    except Exception:
+        if os.path.exists(output_path): os.remove(output_path)
+        raise
 
-        # Ensure text_start_time is within bounds
-        if text_start_time < 0:
-            text_start_time = 0
-        elif text_start_time > gif_clip.duration:
-            text_start_time = gif_clip.duration
-            print(f"Warning: Text start time ({text_start_time}s) exceeds GIF duration ({gif_clip.duration}s). Text may not be visible.")
+def create_gif(youtube_url: str, start_time: int, end_time: int, output_dir: str, overlays: list = (),
+               fps: float = 10, encoder: str = 'moviepy', encoder_options: dict = None,
+               temp_dir: str = 'temp_videos', cache=None, segment_cache=None, report_progress=None,
+               render_pool=None, budget: RenderBudget = None, output_format: str = 'gif',
+               intermediate_cache=None, metadata_cache=None, preview: PreviewSettings = None,
+               cut_mode: str = 'encode', max_width: int = None, max_height: int = None) -> RenderResult:
+    """
+    Downloads a segment of a YouTube video and renders it to a GIF in ``output_dir``.
 
+    With a ResultCache as ``cache`` (whose directory should be ``output_dir``),
+    a GIF rendered earlier with the same parameters is returned without
+    downloading or rendering anything, and a SegmentCache as ``segment_cache``
+    lets renders of an already downloaded clip skip the download. A
+    MetadataCache as ``metadata_cache`` lets them skip resolving the video
+    with yt-dlp.
+    With a RenderPool as ``render_pool`` the render runs in a child process.
+    ``report_progress`` is an optional callable taking the completed fraction.
+    A RenderBudget as ``budget`` is passed on to render_gif.
 
-        if duration_on_screen == -1 or (text_start_time + duration_on_screen > gif_clip.duration):
-            text_duration = gif_clip.duration - text_start_time
-        else:
-            text_duration = duration_on_screen
-        
-        if text_duration <= 0:
-            print(f"Warning: Calculated text duration is {text_duration}s. Text will not be visible. GIF duration: {gif_clip.duration}, start_time: {text_start_time}")
-            # If duration is zero or negative, just copy the original gif or return error
-            # For now, let it proceed, moviepy might handle it or create a very short/no text.
-            # A better approach might be to not add text if duration is <=0
-            if text_duration <=0 and gif_clip.duration > 0 : # only write if there is something to write
-                 gif_clip.write_gif(output_gif_path, fps=gif_clip.fps or 10) # use original fps or default
-                 gif_clip.close()
-                 return output_gif_path
-
-
-        txt_clip = TextClip(text, fontsize=font_size, color=font_color, font=font)
-        txt_clip = txt_clip.set_position(position).set_start(text_start_time).set_duration(text_duration)
-
-        # CompositeVideoClip needs a list of clips, with the base clip first
-        final_clip = CompositeVideoClip([gif_clip, txt_clip])
-        
-        # Use original GIF's fps, or a default if not available (e.g., 10 fps)
-        output_fps = gif_clip.fps
-        if not output_fps or output_fps <= 0:
-            print(f"Warning: Input GIF FPS is invalid ({gif_clip.fps}). Using default FPS of 10.")
-            output_fps = 10
-            
-        final_clip.write_gif(output_gif_path, fps=output_fps)
-        
-        gif_clip.close()
-        txt_clip.close()
-        final_clip.close()
-        
-        return output_gif_path
-    except Exception as e:
-        print(f"Error adding text to GIF: {e}")
-        if os.path.exists(output_gif_path):
-            # os.remove(output_gif_path) # Optional: remove partial/corrupted output
-            pass
-        # Ensure clips are closed if an error occurs mid-process
-        if 'gif_clip' in locals() and gif_clip: gif_clip.close()
-        if 'txt_clip' in locals() and txt_clip: txt_clip.close()
-        if 'final_clip' in locals() and final_clip: final_clip.close()
+    ``output_format`` picks another format from formats.OUTPUT_FORMATS,
+    cached under the same key with its own extension. With a ResultCache as
+    ``intermediate_cache`` (extension '.mkv') each render keeps its
+    intermediate there, and later requests for the same render in another
+    format are converted from it (see convert_cached) instead of rendered
+    from the source.
+
+    PreviewSettings as ``preview`` make a quick, rough GIF (see render_gif),
+    cached apart from the full render. With a ``segment_cache``, the full
+    render of a range that was previewed then reuses the downloaded segment
+    as it is.
+
+    ``cut_mode`` says how the segment is cut out of the source (see
+    download_video_segment), and ``max_width`` and ``max_height`` bound the
+    size of the output (see render_gif).
+
+    Inside metrics.tracing(), the time spent in each stage is recorded into
+    the trace, also when it runs in the render pool: ``extract`` (yt-dlp),
+    ``download`` (fetching and cutting the segment), ``trim`` (cutting
+    cached segments), ``captions``, ``composite``, ``encode`` (which
+    includes decoding and compositing), ``trial_encode`` (budget trials) and
+    ``convert``, with bytes for the download and the outputs.
+    """
+    if budget is not None and output_format != 'gif':
+        raise ValueError('Size and time budgets only apply to GIF output')
+    if preview is not None:
+        # Other formats of a preview are never asked for
+        intermediate_cache = None
+    key = None
+    if cache is not None:
+        key = render_cache_key(youtube_url, start_time, end_time, overlays, fps, encoder, encoder_options, budget,
+                               preview, max_width, max_height)
+        cached = _cached_result(key, end_time - start_time, fps, encoder, encoder_options, budget, output_format,
+                                cache, intermediate_cache, render_pool)
+        if cached is not None:
+            return cached
+
+    video_path = None
+    try:
+        if report_progress: report_progress(0.05)
+        video_path = download_video_segment(youtube_url, start_time, end_time, output_dir=temp_dir,
+                                            segment_cache=segment_cache, metadata_cache=metadata_cache,
+                                            cut_mode=cut_mode)
+
+        if not video_path or not os.path.exists(video_path):
+            raise FileNotFoundError('Failed to download video segment. Check URL and times. The video might be too long, private, or unavailable.')
+        if report_progress: report_progress(0.5)
+        return _render_segment(video_path, output_dir, key, overlays, fps, encoder, encoder_options, budget,
+                               output_format, cache, intermediate_cache, render_pool, preview, max_width, max_height)
+    finally:
+        # This copy of the segment is never needed once the GIF exists
+        if video_path and os.path.exists(video_path): os.remove(video_path)
+
+def _cached_result(key: str, duration: float, fps: float, encoder: str, encoder_options: dict,
+                   budget: RenderBudget, output_format: str, cache, intermediate_cache, render_pool) -> RenderResult:
+    """
+    The render cached under ``key`` in ``output_format``, converted from its
+    intermediate if need be; None if it has to be rendered from the source.
+    """
+    cached_path = cache.get(key, get_format(output_format).extension)
+    if cached_path:
+        return RenderResult(path=cached_path, fps=fps, duration=duration, encoder=encoder, encode_seconds=0.0,
+                            output_bytes=os.path.getsize(cached_path), cached=True, output_format=output_format)
+    # The intermediate has no palette limit, so a budgeted GIF is always rendered from the source
+    if intermediate_cache is not None and budget is None:
+        return convert_cached(key, output_format, cache, intermediate_cache, encoder, encoder_options, render_pool)
+    return None
+
+def _render_segment(video_path: str, output_dir: str, key: str, overlays: list, fps: float, encoder: str,
+                    encoder_options: dict, budget: RenderBudget, output_format: str, cache, intermediate_cache,
+                    render_pool, preview: PreviewSettings = None, max_width: int = None,
+                    max_height: int = None) -> RenderResult:
+    """
+    Renders a downloaded segment, into ``cache`` under ``key`` if there is a
+    cache, else into ``output_dir``, keeping its intermediate if there is an
+    ``intermediate_cache``. Nothing partial is left behind on failure.
+    """
+    extension = get_format(output_format).extension
+    if cache is not None:
+        output_path = cache.temp_path_for(key, extension)
+    else:
+        output_path = os.path.join(output_dir, f"{uuid.uuid4().hex}{extension}")
+    intermediate_path = None
+    if intermediate_cache is not None and key is not None:
+        intermediate_path = intermediate_cache.temp_path_for(key)
+
+    try:
+        render_options = dict(overlays=overlays, fps=fps, encoder=encoder, encoder_options=encoder_options)
+        if budget is not None:
+            render_options['budget'] = budget
+        if preview is not None:
+            render_options['preview'] = preview
+        if max_width:
+            render_options['max_width'] = max_width
+        if max_height:
+            render_options['max_height'] = max_height
+        if output_format != 'gif':
+            render_options['output_format'] = output_format
+        if intermediate_path is not None:
+            render_options['intermediate_path'] = intermediate_path
+        result = _run(render_pool, render_gif, video_path, output_path, **render_options)
+
+        if not os.path.exists(output_path):
+            raise FileNotFoundError('Failed to convert video to GIF. The video segment might be too short or corrupted.')
+        if cache is not None:
+            result.path = cache.put(key, output_path, extension)
+        if intermediate_path is not None and os.path.exists(intermediate_path):
+            intermediate_cache.put(key, intermediate_path)
+        return result
+    except Exception:
+        if os.path.exists(output_path): os.remove(output_path)
         raise
+    finally:
+        if intermediate_path is not None and os.path.exists(intermediate_path): os.remove(intermediate_path)
+
+def merge_ranges(ranges: list, gap: float = BATCH_MERGE_GAP) -> list:
+    """
+    The union of ``(start, end)`` ranges as sorted, disjoint ranges, also
+    joining ranges less than ``gap`` seconds apart.
+    """
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start - merged[-1][1] < gap:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [tuple(r) for r in merged]
+
+def create_gifs(youtube_url: str, clips: list, output_dir: str, fps: float = 10, encoder: str = 'moviepy',
+                encoder_options: dict = None, temp_dir: str = 'temp_videos', cache=None, segment_cache=None,
+                report_progress=None, render_pool=None, output_format: str = 'gif', intermediate_cache=None,
+                metadata_cache=None, max_parallel: int = None, cut_mode: str = 'encode', max_width: int = None,
+                max_height: int = None) -> list:
+    """
+    Renders several Clips of one video, downloading the union of their
+    ranges (see merge_ranges) once instead of a segment per clip.
+
+    Takes the same caches and options as create_gif (``cut_mode`` also
+    applies to cutting the clips out of a range), which apply to every
+    clip; clips cached before are not downloaded at all. Each clip is cut
+    out of its downloaded range and rendered on a thread of its own, at most
+    ``max_parallel`` at a time (as many as ``render_pool`` has workers by
+    default, else one).
+
+    Returns one entry per clip, in order: its RenderResult, or the exception
+    that clip failed with. A failed download fails only the clips in its
+    range; the others are still rendered.
+    """
+    get_format(output_format)
+    results = [None] * len(clips)
+    keys = [None] * len(clips)
+    pending = []
+    for i, clip in enumerate(clips):
+        if cache is not None:
+            keys[i] = render_cache_key(youtube_url, clip.start_time, clip.end_time, clip.overlays, fps, encoder,
+                                       encoder_options, max_width=max_width, max_height=max_height)
+            try:
+                results[i] = _cached_result(keys[i], clip.end_time - clip.start_time, fps, encoder, encoder_options,
+                                            None, output_format, cache, intermediate_cache, render_pool)
+            except Exception as e:
+                results[i] = e
+        if results[i] is None:
+            pending.append(i)
+
+    ranges = merge_ranges([(clips[i].start_time, clips[i].end_time) for i in pending])
+    finished = len(clips) - len(pending)
+
+    def progress():
+        if report_progress: report_progress(0.1 + 0.9 * finished / len(clips))
+
+    progress()
+    os.makedirs(temp_dir, exist_ok=True)
+    work_dir = os.path.join(temp_dir, f'job-{uuid.uuid4().hex[:12]}')
+    os.mkdir(work_dir)
+    downloads = []
+    try:
+        sources = {}
+        for start, end in ranges:
+            in_range = [i for i in pending if start <= clips[i].start_time and clips[i].end_time <= end]
+            try:
+                path = download_video_segment(youtube_url, start, end, output_dir=temp_dir,
+                                              segment_cache=segment_cache, metadata_cache=metadata_cache,
+                                              cut_mode=cut_mode)
+                downloads.append(path)
+            except Exception as e:
+                print(f"Error downloading {start:g}-{end:g} s of {youtube_url}: {e}")
+                for i in in_range:
+                    results[i] = e
+                    finished += 1
+                progress()
+                continue
+            for i in in_range:
+                sources[i] = (path, start, end)
+
+        def render(i):
+            clip = clips[i]
+            path, start, end = sources[i]
+            if (clip.start_time, clip.end_time) != (start, end):
+                path = _trim_segment(path, clip.start_time - start, clip.end_time - clip.start_time,
+                                     os.path.join(work_dir, f'clip-{i}.mp4'), cut_mode)
+            return _render_segment(path, output_dir, keys[i], clip.overlays, fps, encoder, encoder_options, None,
+                                   output_format, cache, intermediate_cache, render_pool, None, max_width, max_height)
+
+        if max_parallel is None:
+            max_parallel = render_pool.max_workers if render_pool is not None else 1
+        with ThreadPoolExecutor(max_workers=max(1, max_parallel)) as executor:
+            # Threads do not share the caller's trace; their stages are merged here
+            futures = {executor.submit(call_traced, render, i): i for i in sources}
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    results[i], stages = future.result()
+                    if current_trace() is not None:
+                        current_trace().merge(stages)
+                except Exception as e:
+                    print(f"Error rendering clip {clips[i].start_time:g}-{clips[i].end_time:g} s: {e}")
+                    results[i] = e
+                finished += 1
+                progress()
+        return results
+    finally:
+        for path in downloads:
+            if os.path.exists(path): os.remove(path)
+        shutil.rmtree(work_dir, ignore_errors=True)
 
 # Example Usage (optional, for testing)
 if __name__ == '__main__':
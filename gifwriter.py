@@ -0,0 +1,150 @@
+"""
+An incremental GIF file writer.
+
+Pillow's GIF plugin only saves a whole sequence of images at once, so every
+frame has to be in memory before the first byte is written. GifWriter writes
+the header as soon as the first frame arrives and each frame as it is added,
+so memory use does not depend on the number of frames. Frames are palette
+("P" mode) images, each carrying its own local color table; Pillow still
+does the LZW compression.
+
+Frames may also cover just a rectangle of the canvas, with a transparent
+color for pixels that keep what the previous frames drew there, and a frame
+may be shown longer instead of repeating it. FrameDelta works out which
+rectangle and pixels of a frame need drawing at all, so mostly static clips
+(a talking head in front of a still background) only store what moves.
+"""
+import struct
+
+import numpy as np
+from PIL import GifImagePlugin, Image
+
+class GifWriter:
+    """
+    Writes palette frames to ``path`` one at a time.
+
+    ``loop`` is the NETSCAPE loop count (0 loops forever). Use as a context
+    manager, or call close() to write the trailer. The last frame added is
+    held back until the next one, so extend_last() can still lengthen it.
+    """
+
+    def __init__(self, path: str, loop: int = 0):
+        self.path = path
+        self.loop = loop
+        self.size = None
+        self.frames = 0
+        self._pending = None
+        self._file = open(path, 'wb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def _write_header(self, size: tuple):
+        self.size = size
+        width, height = size
+        # Logical screen without a global color table; every frame brings its own
+        self._file.write(b'GIF89a' + struct.pack('<HHBBB', width, height, 0, 0, 0))
+        self._file.write(b'!\xff\x0bNETSCAPE2.0\x03\x01' + struct.pack('<H', self.loop) + b'\x00')
+
+    def add_frame(self, image: Image.Image, delay: int, offset: tuple = (0, 0), transparency: int = None):
+        """
+        Appends a palette image shown for ``delay`` hundredths of a second.
+
+        The first frame sets the canvas size. Later ones may be smaller and
+        drawn at ``offset``; pixels of palette index ``transparency`` are
+        not drawn, so the canvas shows through them.
+        """
+        if image.mode != 'P':
+            raise ValueError(f"GIF frames must be palette images, got mode '{image.mode}'")
+        if self.size is None:
+            self._write_header(image.size)
+        self._flush()
+        self._pending = (image, delay, offset, transparency)
+        self.frames += 1
+
+    def extend_last(self, delay: int):
+        """
+        Shows the last frame added ``delay`` hundredths of a second longer,
+        in place of a frame that would look the same.
+        """
+        if self._pending is None:
+            raise ValueError('There is no frame to extend')
+        image, previous, offset, transparency = self._pending
+        self._pending = (image, previous + delay, offset, transparency)
+
+    def _flush(self):
+        if self._pending is None:
+            return
+        image, delay, offset, transparency = self._pending
+        self._pending = None
+        # Pillow takes the delay in milliseconds and stores hundredths
+        params = {'duration': delay * 10, 'include_color_table': True}
+        if offset != (0, 0) or transparency is not None:
+            # Leave the frame on the canvas for the next one to draw over
+            params.update(disposal=1, transparency=transparency)
+        chunks = GifImagePlugin.getdata(image, offset, **params)
+        self._file.writelines(chunks)
+        # getdata() collects into a class attribute that lives in a reference
+        # cycle until the next garbage collection; free the bytes right away
+        chunks.clear()
+
+    def close(self):
+        if self._file.closed:
+            return
+        try:
+            self._flush()
+            if self.size is not None:
+                self._file.write(b';')
+        finally:
+            self._file.close()
+
+class FrameDelta:
+    """
+    Compares each frame of a clip with what a GIF viewer already shows, for
+    drawing only what changed.
+
+    A pixel counts as changed when a channel differs by more than
+    ``threshold`` from the value it was last drawn with. Comparing with the
+    source values last drawn, rather than with the previous frame, means
+    slow changes still get drawn once they add up, and comparing before
+    quantization means palette noise never counts as change.
+    """
+
+    def __init__(self, threshold: int = 0):
+        self.threshold = threshold
+        self._drawn = None
+
+    def update(self, frame: np.ndarray):
+        """
+        Takes the next ``(height, width, 3)`` frame and returns None if no
+        pixel changed, or else ``(box, unchanged)``: the ``(left, top,
+        right, bottom)`` box around the changed pixels and a boolean mask
+        of the pixels in it that did not change (None when all did).
+        """
+        if self._drawn is None or self._drawn.shape != frame.shape:
+            self._drawn = frame.copy()
+            return (0, 0, frame.shape[1], frame.shape[0]), None
+        changed = (np.abs(frame.astype(np.int16) - self._drawn).max(axis=2) > self.threshold)
+        rows = np.flatnonzero(changed.any(axis=1))
+        if not len(rows):
+            return None
+        columns = np.flatnonzero(changed.any(axis=0))
+        top, bottom, left, right = rows[0], rows[-1] + 1, columns[0], columns[-1] + 1
+        changed = changed[top:bottom, left:right]
+        self._drawn[top:bottom, left:right][changed] = frame[top:bottom, left:right][changed]
+        return (int(left), int(top), int(right), int(bottom)), (None if changed.all() else ~changed)
+
+def frame_delays(fps: float):
+    """
+    Yields per-frame delays in hundredths of a second for ``fps``, spreading
+    the rounding so the total playback time never drifts (e.g. 8, 9, 8, ...
+    for 12 fps).
+    """
+    index = 0
+    while True:
+        yield round((index + 1) * 100 / fps) - round(index * 100 / fps)
+        index += 1
@@ -0,0 +1,75 @@
+"""
+Production server settings: ``gunicorn -c gunicorn.conf.py app:app`` (what
+run_app.sh starts).
+
+Gunicorn forks WEB_CONCURRENCY worker processes, one per core by default.
+The parent imports the app before forking (``preload_app``) along with the
+modules gif_generator otherwise imports on first use (yt-dlp, moviepy.editor),
+so workers share one copy of them copy-on-write and none of them pays for
+the imports on its first download or render. gc.freeze() then moves
+everything imported so far out of the collector's reach. Without it, the
+first collection in each worker writes to every tracked object, which
+copies most of the shared pages.
+
+Each worker is an app process of its own: its job threads, janitor and
+render processes start on its first request. The workers split the cores for
+rendering between them (RENDER_WORKERS each), and, unless JOB_DATABASE names
+another one, share a job queue in temp_videos/jobs.sqlite3 so a job can be
+polled through any of them. They also write their metrics to
+temp_videos/metrics (METRICS_FOLDER), which is emptied on start, so /metrics
+sums the counters and histograms of every worker, whichever one answers.
+All of these can still be set explicitly.
+
+A worker that is stopped (a deploy, a restart, scaling down) stops claiming
+jobs and gives its running ones half of ``graceful_timeout`` to finish; it
+then puts the rest back in the queue for the other workers, or for the next
+server. Workers that die without stopping, killed or crashed, leave their
+jobs to expire: the job queue requeues a job once its lease runs out.
+"""
+import gc
+import glob
+import os
+import time
+
+cores = os.cpu_count() or 1
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', cores))
+# Requests are short (renders run on job threads), but downloads of large
+# files should not hold up the rest of a worker
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 4))
+preload_app = True
+timeout = int(os.environ.get('WEB_TIMEOUT', 60))
+# How long a stopping worker has before it is killed
+graceful_timeout = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', 30))
+accesslog = '-'
+
+# Read by app.py, which the parent imports after this file
+os.environ.setdefault('RENDER_WORKERS', str(max(1, cores // workers)))
+if workers > 1:
+    os.environ.setdefault('JOB_DATABASE', os.path.join('temp_videos', 'jobs.sqlite3'))
+    os.environ.setdefault('METRICS_FOLDER', os.path.join('temp_videos', 'metrics'))
+
+def on_starting(server):
+    from gif_generator import preload_heavy_modules
+
+    # Totals of a previous run would otherwise be counted again
+    if os.environ.get('METRICS_FOLDER'):
+        for path in glob.glob(os.path.join(os.environ['METRICS_FOLDER'], '*.json')):
+            os.remove(path)
+
+    started = time.perf_counter()
+    preload_heavy_modules()
+    gc.freeze()
+    server.log.info('Preloaded heavy modules in %.2fs', time.perf_counter() - started)
+
+def worker_exit(server, worker):
+    # Also called in the parent for a worker that is already gone
+    if worker.pid != os.getpid():
+        return
+    from app import job_queue
+
+    released = job_queue.shutdown(timeout=graceful_timeout / 2)
+    if released:
+        server.log.info('Released %d unfinished job(s) back to the queue', released)
@@ -0,0 +1,156 @@
+"""
+Reclaiming disk space in the background.
+
+The caches bound themselves as entries are added (see cache.py), but some
+files outlive their use without anything being added: entries nobody has
+read in a long time, scratch files of renders that crashed, and job
+directories and downloaded segments in the temp folder left behind by a
+process that was killed before its cleanup ran. Janitor sweeps all of them
+from a daemon thread every ``interval`` seconds, so request handling never
+waits on it, and reports what each sweep reclaimed.
+
+Deleting is safe while a file is being served: files are only unlinked,
+never truncated, and a reader that has one open keeps reading it until it
+closes it. A request that comes after the unlink gets a 404 or a cache miss.
+Entries are evicted least recently read first, and serving a render reads
+it through its cache, so a file that is in use is the last to go.
+"""
+import os
+import shutil
+import threading
+import time
+from dataclasses import dataclass, field
+
+@dataclass
+class SweepReport:
+    """What one sweep removed: files and bytes, in total and per area."""
+    files: int = 0
+    bytes: int = 0
+    areas: dict = field(default_factory=dict)
+    seconds: float = 0.0
+
+    def add(self, area: str, removed: list):
+        """Counts ``(path, bytes)`` pairs removed from ``area``."""
+        entry = self.areas.setdefault(area, {'files': 0, 'bytes': 0})
+        for _, size in removed:
+            entry['files'] += 1
+            entry['bytes'] += size
+            self.files += 1
+            self.bytes += size
+
+def _tree_size(path: str) -> int:
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(path) for name in names
+               if not os.path.islink(os.path.join(root, name)))
+
+def _last_modified(path: str) -> float:
+    """The newest mtime of ``path`` and, for a directory, everything in it."""
+    if not os.path.isdir(path):
+        return os.path.getmtime(path)
+    return max([os.path.getmtime(path)] + [os.path.getmtime(os.path.join(root, name))
+                                           for root, _, names in os.walk(path) for name in names])
+
+def sweep_temp_dir(directory: str, max_age: float) -> list:
+    """
+    Removes job scratch directories (``job-*``) and downloaded segments
+    (``*.mp4``) directly in ``directory`` that were not modified for
+    ``max_age`` seconds; returns ``(path, bytes)`` pairs. Anything else,
+    such as the caches kept inside the temp folder, is left alone.
+    """
+    now = time.time()
+    removed = []
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if not (name.startswith('job-') and os.path.isdir(path) or name.endswith('.mp4') and os.path.isfile(path)):
+            continue
+        try:
+            if now - _last_modified(path) <= max_age:
+                continue
+            size = _tree_size(path)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except FileNotFoundError:
+            continue # Finished and cleaned up by its job in the meantime
+        removed.append((path, size))
+    return removed
+
+class Janitor:
+    """
+    Sweeps ``caches`` (a dict of name to ResultCache, SegmentCache or
+    MetadataCache) and the ``temp_dir`` scratch area in a background thread.
+
+    ``max_job_seconds`` bounds how long a job can run; scratch files and job
+    directories untouched for longer belong to no live job. ``on_sweep`` is
+    called with every SweepReport. The thread starts with start(), and again
+    in a forked child, like the job queue's workers.
+    """
+
+    def __init__(self, caches: dict, temp_dir: str, max_job_seconds: float, interval: float = 600, on_sweep=None):
+        self.caches = caches
+        self.temp_dir = temp_dir
+        self.max_job_seconds = max_job_seconds
+        self.interval = interval
+        self.on_sweep = on_sweep
+        self.sweeps = 0
+        self.reclaimed_files = 0
+        self.reclaimed_bytes = 0
+        self.last_report = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def sweep(self) -> SweepReport:
+        """Runs one sweep right here and returns its report."""
+        started = time.monotonic()
+        report = SweepReport()
+        for name, cache in self.caches.items():
+            report.add(name, cache.sweep(self.max_job_seconds))
+        if os.path.isdir(self.temp_dir):
+            report.add('temp', sweep_temp_dir(self.temp_dir, self.max_job_seconds))
+        report.seconds = round(time.monotonic() - started, 4)
+        with self._lock:
+            self.sweeps += 1
+            self.reclaimed_files += report.files
+            self.reclaimed_bytes += report.bytes
+            self.last_report = report
+        if self.on_sweep is not None:
+            self.on_sweep(report)
+        return report
+
+    def start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._wakeup.clear()
+            self._thread = threading.Thread(target=self._run, name='janitor', daemon=True)
+            self._thread.start()
+
+    def stop(self, wait: bool = True):
+        self._wakeup.set()
+        if wait and self._thread is not None:
+            self._thread.join()
+        self._pid = None
+
+    def _run(self):
+        while not self._wakeup.is_set():
+            try:
+                self.sweep()
+            except Exception as e:
+                # e.g. a permission problem; the next sweep tries again
+                print(f"Janitor sweep failed: {e}")
+            self._wakeup.wait(self.interval)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'sweeps': self.sweeps,
+                'reclaimed_files': self.reclaimed_files,
+                'reclaimed_bytes': self.reclaimed_bytes,
+                'last_sweep': self.last_report.areas if self.last_report else None,
+            }
@@ -0,0 +1,424 @@
+"""
+A small background job queue for GIF generation.
+
+Jobs live in a store: MemoryJobStore keeps them in this process, while
+SQLiteJobStore keeps them in a local SQLite file so several app processes
+can enqueue, run and report on the same jobs. JobQueue runs a bounded pool
+of worker threads that claim queued jobs from the store and execute them.
+
+A running job holds a lease that its worker renews every few seconds
+through ``updated_at``. When a worker dies with its process (a crash, a
+deploy, a server recycling its workers), its lease runs out and the job is
+queued again, or failed once it has been claimed ``max_attempts`` times.
+A process shutting down cleanly does not wait for that: jobs still running
+when ``shutdown()`` gives up on them are released to the queue right away.
+Finished jobs are deleted ``result_ttl`` seconds after they finished.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from dataclasses import asdict, dataclass, field
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+# error_type of a job whose workers died under it max_attempts times
+ABANDONED = 'JobAbandoned'
+
+@dataclass
+class Job:
+    """The state of one queued piece of work."""
+    id: str
+    params: dict
+    status: str = QUEUED
+    progress: float = 0.0
+    result: dict = None
+    error: str = None
+    error_type: str = None
+    attempts: int = 0
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+class MemoryJobStore:
+    """
+    Keeps jobs in a dict; only visible to the current process.
+    """
+
+    def __init__(self):
+        self._jobs = {}
+        self._queued = deque()
+        self._lock = threading.Lock()
+
+    def create(self, params: dict) -> Job:
+        job = Job(id=uuid.uuid4().hex, params=params)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._queued.append(job.id)
+        return job
+
+    def get(self, job_id: str) -> Job:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            # Hand out copies so callers never see a half-applied update
+            return Job(**job.to_dict()) if job else None
+
+    def claim(self) -> Job:
+        """
+        Marks the oldest queued job as running and returns it, or None.
+        """
+        with self._lock:
+            if not self._queued:
+                return None
+            job = self._jobs[self._queued.popleft()]
+            job.status = RUNNING
+            job.attempts += 1
+            job.updated_at = time.time()
+            return Job(**job.to_dict())
+
+    def count(self, status: str) -> int:
+        with self._lock:
+            if status == QUEUED:
+                return len(self._queued)
+            return sum(1 for job in self._jobs.values() if job.status == status)
+
+    def update(self, job_id: str, **fields):
+        with self._lock:
+            job = self._jobs[job_id]
+            for name, value in fields.items():
+                setattr(job, name, value)
+            job.updated_at = time.time()
+
+    def recover(self, lease: float, max_attempts: int) -> int:
+        """
+        Queues running jobs not renewed for ``lease`` seconds again, or
+        fails them after ``max_attempts`` claims; returns how many.
+        """
+        cutoff = time.time() - lease
+        with self._lock:
+            expired = sorted((job for job in self._jobs.values() if job.status == RUNNING and job.updated_at < cutoff),
+                             key=lambda job: job.created_at, reverse=True)
+            for job in expired:
+                job.updated_at = time.time()
+                if job.attempts >= max_attempts:
+                    job.status, job.error, job.error_type = FAILED, _abandoned_message(job), ABANDONED
+                else:
+                    job.status, job.progress = QUEUED, 0.0
+                    self._queued.appendleft(job.id)
+        return len(expired)
+
+    def release(self, job_id: str) -> bool:
+        """
+        Queues a running job again, ahead of the others, without counting
+        the claim; returns whether it was still running.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status != RUNNING:
+                return False
+            job.status, job.progress, job.attempts = QUEUED, 0.0, job.attempts - 1
+            job.updated_at = time.time()
+            self._queued.appendleft(job.id)
+            return True
+
+    def prune(self, max_age: float) -> int:
+        """Deletes jobs that finished more than ``max_age`` seconds ago; returns how many."""
+        cutoff = time.time() - max_age
+        with self._lock:
+            finished = [job.id for job in self._jobs.values() if job.status in (DONE, FAILED) and job.updated_at < cutoff]
+            for job_id in finished:
+                del self._jobs[job_id]
+        return len(finished)
+
+def _abandoned_message(job: Job) -> str:
+    return f'The job was interrupted {job.attempts} times and was given up'
+
+class SQLiteJobStore:
+    """
+    Keeps jobs in a SQLite database so that several processes on one host
+    share a single queue. Claiming a job happens inside an IMMEDIATE
+    transaction, so each job is handed to exactly one worker.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connection() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                ' id TEXT PRIMARY KEY, params TEXT NOT NULL, status TEXT NOT NULL,'
+                ' progress REAL NOT NULL, result TEXT, error TEXT, error_type TEXT,'
+                ' created_at REAL NOT NULL, updated_at REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)')
+            # Databases written before leases had no attempts column
+            if 'attempts' not in {row['name'] for row in conn.execute('PRAGMA table_info(jobs)')}:
+                conn.execute('ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0')
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _to_job(row: sqlite3.Row) -> Job:
+        return Job(
+            id=row['id'], params=json.loads(row['params']), status=row['status'],
+            progress=row['progress'], result=json.loads(row['result']) if row['result'] else None,
+            error=row['error'], error_type=row['error_type'], attempts=row['attempts'],
+            created_at=row['created_at'], updated_at=row['updated_at'],
+        )
+
+    def create(self, params: dict) -> Job:
+        job = Job(id=uuid.uuid4().hex, params=params)
+        self._connection().execute(
+            'INSERT INTO jobs (id, params, status, progress, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+            (job.id, json.dumps(params), job.status, job.progress, job.created_at, job.updated_at),
+        )
+        return job
+
+    def get(self, job_id: str) -> Job:
+        row = self._connection().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return self._to_job(row) if row else None
+
+    def claim(self) -> Job:
+        """
+        Marks the oldest queued job as running and returns it, or None.
+        """
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1', (QUEUED,)
+            ).fetchone()
+            if row is not None:
+                conn.execute('UPDATE jobs SET status = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?',
+                             (RUNNING, time.time(), row['id']))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        if row is None:
+            return None
+        job = self._to_job(row)
+        job.status = RUNNING
+        job.attempts += 1
+        return job
+
+    def count(self, status: str) -> int:
+        return self._connection().execute('SELECT COUNT(*) FROM jobs WHERE status = ?', (status,)).fetchone()[0]
+
+    def update(self, job_id: str, **fields):
+        if 'result' in fields:
+            fields['result'] = json.dumps(fields['result'])
+        fields['updated_at'] = time.time()
+        assignments = ', '.join(f'{name} = ?' for name in fields)
+        self._connection().execute(f'UPDATE jobs SET {assignments} WHERE id = ?', (*fields.values(), job_id))
+
+    def recover(self, lease: float, max_attempts: int) -> int:
+        """
+        Queues running jobs not renewed for ``lease`` seconds again, or
+        fails them after ``max_attempts`` claims; returns how many.
+        """
+        now = time.time()
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute('SELECT * FROM jobs WHERE status = ? AND updated_at < ?',
+                                (RUNNING, now - lease)).fetchall()
+            for row in rows:
+                job = self._to_job(row)
+                if job.attempts >= max_attempts:
+                    conn.execute('UPDATE jobs SET status = ?, error = ?, error_type = ?, updated_at = ? WHERE id = ?',
+                                 (FAILED, _abandoned_message(job), ABANDONED, now, job.id))
+                else:
+                    conn.execute('UPDATE jobs SET status = ?, progress = 0, updated_at = ? WHERE id = ?',
+                                 (QUEUED, now, job.id))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return len(rows)
+
+    def release(self, job_id: str) -> bool:
+        """
+        Queues a running job again without counting the claim; returns
+        whether it was still running.
+        """
+        return self._connection().execute(
+            'UPDATE jobs SET status = ?, progress = 0, attempts = attempts - 1, updated_at = ? WHERE id = ? AND status = ?',
+            (QUEUED, time.time(), job_id, RUNNING)).rowcount == 1
+
+    def prune(self, max_age: float) -> int:
+        """Deletes jobs that finished more than ``max_age`` seconds ago; returns how many."""
+        return self._connection().execute('DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?',
+                                          (DONE, FAILED, time.time() - max_age)).rowcount
+
+class JobQueue:
+    """
+    Runs ``handler(params, report_progress)`` for every submitted job on a
+    bounded pool of worker threads.
+
+    ``handler`` returns a JSON-serializable dict that becomes the job result;
+    an exception marks the job failed. ``report_progress`` takes a fraction
+    between 0 and 1. Workers are started on first use, and restarted in a
+    forked child, so importing the app never spawns threads. With a shared
+    store, queued jobs are picked up by whichever process has a free worker.
+
+    A running job's lease is renewed every third of ``lease`` seconds. The
+    workers look for expired leases and for jobs finished more than
+    ``result_ttl`` seconds ago on start and then every ``lease / 2`` seconds.
+
+    ``shutdown(timeout=...)`` stops claiming jobs and waits up to ``timeout``
+    seconds for the running ones, then releases those still running to the
+    queue, so another process picks them up without waiting for the lease.
+    """
+
+    def __init__(self, handler, store=None, max_workers: int = 2, poll_interval: float = 0.5, lease: float = 60,
+                 max_attempts: int = 2, result_ttl: float = 24 * 3600):
+        self.handler = handler
+        self.store = store if store is not None else MemoryJobStore()
+        self.max_workers = max_workers
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.result_ttl = result_ttl
+        self._next_maintenance = 0.0
+        self._wakeup = threading.Condition()
+        self._workers = []
+        self._running = set()
+        self._pid = None
+        self._stopping = False
+
+    def start(self):
+        with self._wakeup:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopping = False
+            self._running = set()
+            self._next_maintenance = 0.0
+            self._workers = [
+                threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True)
+                for i in range(self.max_workers)
+            ]
+            for worker in self._workers:
+                worker.start()
+
+    def shutdown(self, wait: bool = True, timeout: float = None) -> int:
+        """Stops the workers; returns how many running jobs were released."""
+        with self._wakeup:
+            self._stopping = True
+            self._wakeup.notify_all()
+        released = 0
+        if wait:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            for worker in self._workers:
+                worker.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+            with self._wakeup:
+                unfinished = list(self._running) if self._pid == os.getpid() else []
+                self._running.clear()
+            for job_id in unfinished:
+                try:
+                    released += self.store.release(job_id)
+                except Exception as e:
+                    print(f"Warning: Could not release job {job_id}: {e}")
+        self._pid = None
+        return released
+
+    def submit(self, params: dict) -> str:
+        self.start()
+        job = self.store.create(params)
+        with self._wakeup:
+            self._wakeup.notify()
+        return job.id
+
+    def get(self, job_id: str) -> Job:
+        self.start()
+        return self.store.get(job_id)
+
+    def depth(self) -> dict:
+        """Number of jobs waiting for a worker and being worked on."""
+        return {'queued': self.store.count(QUEUED), 'running': self.store.count(RUNNING)}
+
+    def _maintain(self):
+        """Recovers expired leases and prunes old jobs, at most every ``lease / 2`` seconds."""
+        with self._wakeup:
+            if time.time() < self._next_maintenance:
+                return
+            self._next_maintenance = time.time() + self.lease / 2
+        try:
+            recovered = self.store.recover(self.lease, self.max_attempts)
+            if recovered:
+                print(f"Recovered {recovered} job(s) whose worker stopped renewing the lease")
+            self.store.prune(self.result_ttl)
+        except Exception as e:
+            print(f"Warning: Job store maintenance failed: {e}")
+
+    def _work(self):
+        while True:
+            with self._wakeup:
+                if self._stopping:
+                    return
+            self._maintain()
+            job = self.store.claim()
+            if job is None:
+                with self._wakeup:
+                    if not self._stopping:
+                        self._wakeup.wait(self.poll_interval)
+                continue
+            self._run(job)
+
+    def _run(self, job: Job):
+        def report_progress(fraction: float):
+            self.store.update(job.id, progress=round(min(max(fraction, 0.0), 1.0), 3))
+
+        finished = threading.Event()
+
+        def renew_lease():
+            while not finished.wait(self.lease / 3) and self._owns(job.id):
+                try:
+                    self.store.update(job.id)
+                except Exception as e:
+                    print(f"Warning: Could not renew the lease of job {job.id}: {e}")
+
+        with self._wakeup:
+            self._running.add(job.id)
+        renewer = threading.Thread(target=renew_lease, name=f'job-lease-{job.id[:8]}', daemon=True)
+        renewer.start()
+        try:
+            result = self.handler(job.params, report_progress)
+        except Exception as e:
+            print(f"Job {job.id} failed: {e}")
+            # Released by shutdown(): the job is someone else's now
+            if self._owns(job.id):
+                # Errors relayed from another process carry the original type name
+                self.store.update(job.id, status=FAILED, error=str(e),
+                                  error_type=getattr(e, 'error_type', type(e).__name__))
+        else:
+            if self._owns(job.id):
+                self.store.update(job.id, status=DONE, progress=1.0, result=result)
+        finally:
+            finished.set()
+            with self._wakeup:
+                self._running.discard(job.id)
+
+    def _owns(self, job_id: str) -> bool:
+        with self._wakeup:
+            return job_id in self._running
@@ -0,0 +1,346 @@
+"""
+Per-stage timing and Prometheus metrics.
+
+The stages of a request (yt-dlp extraction, the download, caption
+rasterizing, compositing, encoding...) are timed with ``stage(name)`` into
+the StageTrace of the current context, if there is one; see tracing().
+Untraced code pays for a context variable lookup and nothing else. A trace
+holds plain per-stage totals, so it crosses into and out of render
+processes (see call_traced) and ends up in logs and job results as JSON.
+
+Counter, Gauge and Histogram are a small, dependency-free take on the
+Prometheus client types, and Registry.render() writes them in the text
+exposition format. Values are per process, and so is what ``value()``
+returns. Several processes serving one app (gunicorn's workers) would each
+report their own share under the same names, and a scrape would see
+whichever worker answered. After ``Registry.share(directory)``, every
+process writes its counters and histograms to a file of its own in
+``directory`` (once a second while they change, when scraped, and on
+exit), and render() sums the files of every process. Files of processes
+that are gone are kept, so totals never go down while the server runs;
+whoever starts the server empties the directory. Gauges are not summed:
+they are set from shared state (the job database, the caches on disk) right
+before a scrape, so the scraping process already sees all of it.
+"""
+import atexit
+import contextvars
+import glob
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+class StageTrace:
+    """
+    Seconds, calls and bytes per stage name, summed over every time the
+    stage ran (e.g. compositing runs once per batch of frames).
+    """
+
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, name: str, seconds: float, nbytes: int = 0, calls: int = 1):
+        entry = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0, 'bytes': 0})
+        entry['seconds'] += seconds
+        entry['calls'] += calls
+        entry['bytes'] += nbytes
+
+    def merge(self, stages: dict):
+        """Adds the ``stages`` of another trace, e.g. one from a render process."""
+        for name, entry in stages.items():
+            self.add(name, entry['seconds'], entry['bytes'], entry['calls'])
+
+    def to_dict(self) -> dict:
+        return {name: dict(entry, seconds=round(entry['seconds'], 4)) for name, entry in self.stages.items()}
+
+_current_trace = contextvars.ContextVar('stage_trace', default=None)
+
+def current_trace() -> StageTrace:
+    """The trace stages are recorded into right now, or None."""
+    return _current_trace.get()
+
+@contextmanager
+def tracing():
+    """
+    Records the stages run inside the block, on this thread, into a new
+    StageTrace, which it yields.
+    """
+    trace = StageTrace()
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+class _Stage:
+    """What a stage reports besides its time; set ``bytes`` inside the block."""
+    bytes = 0
+
+@contextmanager
+def stage(name: str):
+    """
+    Times the block into the current trace as stage ``name``, also when it
+    raises. Nested stages are all recorded, each with its full time.
+    """
+    trace = _current_trace.get()
+    record = _Stage()
+    started = time.perf_counter()
+    try:
+        yield record
+    finally:
+        if trace is not None:
+            trace.add(name, time.perf_counter() - started, record.bytes)
+
+def call_traced(fn, *args, **kwargs) -> tuple:
+    """
+    Calls ``fn`` in a trace of its own and returns ``(result, stages)``;
+    for running it in another process and merging the stages back.
+    """
+    with tracing() as trace:
+        result = fn(*args, **kwargs)
+    return result, trace.stages
+
+# Summed across the processes sharing a Registry's directory
+SHARED_KINDS = ('counter', 'histogram')
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+def _escape(value) -> str:
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+def _labels(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class Registry:
+    """A set of metrics rendered together."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self.directory = None
+        self.flush_interval = 1.0
+        self._flush_lock = threading.Lock()
+        self._changed = threading.Event()
+        self._pid = None
+        self._path = None
+
+    def share(self, directory: str, flush_interval: float = 1.0):
+        """Sums counters and histograms with every process sharing ``directory``."""
+        os.makedirs(directory, exist_ok=True)
+        if self.directory is None:
+            atexit.register(self._flush_at_exit)
+        self.directory = directory
+        self.flush_interval = flush_interval
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric '{metric.name}' is already registered")
+            self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        """Every metric in the Prometheus text format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        shared = self._merge_shared(metrics) if self.directory is not None else {}
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples(shared.get(metric.name)))
+        return '\n'.join(lines) + '\n'
+
+    def _mark_changed(self):
+        """Called on every update; starts this process's flusher on the first one."""
+        if self.directory is None:
+            return
+        if self._pid != os.getpid():
+            with self._flush_lock:
+                if self._pid != os.getpid():
+                    self._pid = os.getpid()
+                    self._path = os.path.join(self.directory, f'{self._pid}-{uuid.uuid4().hex[:8]}.json')
+                    threading.Thread(target=self._flush_changes, name='metrics-flusher', daemon=True).start()
+        self._changed.set()
+
+    def _flush_changes(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            self._changed.wait()
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"Warning: Could not write metrics to {self.directory}: {e}")
+            time.sleep(self.flush_interval)
+
+    def _flush_at_exit(self):
+        # Nobody is left to read it if the directory went first
+        if self._pid == os.getpid() and os.path.isdir(self.directory):
+            self.flush()
+
+    def flush(self):
+        """Writes this process's counters and histograms to its file in the shared directory."""
+        if self._pid != os.getpid():
+            return
+        with self._lock:
+            metrics = [metric for metric in self._metrics.values() if metric.kind in SHARED_KINDS]
+        with self._flush_lock:
+            self._changed.clear()
+            snapshot = {metric.name: [[list(key), value] for key, value in metric.snapshot().items()]
+                        for metric in metrics}
+            temp_path = self._path + '.tmp'
+            with open(temp_path, 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(temp_path, self._path)
+
+    def _merge_shared(self, metrics: list) -> dict:
+        """The values of every process's file summed, by metric name and label values."""
+        try:
+            self.flush()
+        except OSError as e:
+            print(f"Warning: Could not write metrics to {self.directory}: {e}")
+        merged = {metric.name: {} for metric in metrics if metric.kind in SHARED_KINDS}
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                # Removed, or not ours
+                continue
+            for name, values in snapshot.items():
+                if name not in merged:
+                    continue
+                for key, value in values:
+                    key = tuple(key)
+                    if key not in merged[name]:
+                        merged[name][key] = value
+                    elif isinstance(value, list):
+                        counts, total = merged[name][key]
+                        merged[name][key] = ([a + b for a, b in zip(counts, value[0])], total + value[1])
+                    else:
+                        merged[name][key] += value
+        return merged
+
+REGISTRY = Registry()
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), registry: Registry = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        self._registry = registry
+        self._pid = os.getpid()
+        if registry is not None:
+            registry.register(self)
+
+    def _own_values(self) -> dict:
+        """
+        The values, under the lock. A forked child of a process sharing its
+        counts starts from zero: what the parent counted is in its own file.
+        """
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            if self.kind in SHARED_KINDS and self._registry is not None and self._registry.directory is not None:
+                self._values = {}
+        return self._values
+
+    def _changed(self):
+        if self._registry is not None:
+            self._registry._mark_changed()
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._own_values().get(self._key(labels), 0)
+
+    def snapshot(self) -> dict:
+        """The values by label values, as of now."""
+        with self._lock:
+            return dict(self._own_values())
+
+    def samples(self, values: dict = None) -> list:
+        """Sample lines for ``values`` (as from snapshot()), by default this process's."""
+        values = sorted((self.snapshot() if values is None else values).items())
+        return [f'{self.name}{_labels(self.labelnames, key)} {_format_value(value)}' for key, value in values]
+
+class Counter(_Metric):
+    """A total that only goes up."""
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        if amount < 0:
+            raise ValueError('Counters cannot go down')
+        key = self._key(labels)
+        with self._lock:
+            values = self._own_values()
+            values[key] = values.get(key, 0) + amount
+        self._changed()
+
+class Gauge(_Metric):
+    """A value that is set to the current state, e.g. a queue depth."""
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._own_values()[key] = value
+
+# Seconds; from a cached lookup to a long render
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+class Histogram(_Metric):
+    """Observations counted into cumulative ``le`` buckets, with their sum."""
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS,
+                 registry: Registry = REGISTRY):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            values = self._own_values()
+            counts, total = values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            values[key] = (counts, total + value)
+        self._changed()
+
+    def value(self, **labels) -> tuple:
+        """``(count, sum)`` of the observations."""
+        with self._lock:
+            counts, total = self._own_values().get(self._key(labels), ([0] * len(self.buckets), 0.0))
+            return counts[-1], total
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {key: (list(counts), total) for key, (counts, total) in self._own_values().items()}
+
+    def samples(self, values: dict = None) -> list:
+        values = sorted((self.snapshot() if values is None else values).items())
+        lines = []
+        for key, (counts, total) in values:
+            for bound, count in zip(self.buckets, counts):
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, key, le)} {count}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, key)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, key)} {counts[-1]}')
+        return lines
@@ -0,0 +1,84 @@
+"""
+Frame-exact ends for MP4 segments cut without re-encoding.
+
+When ffmpeg copies a range of compressed video (``-c:v copy``) it can only
+start at a keyframe, so it keeps the frames from the keyframe before the cut
+and writes an edit list (``moov/trak/edts/elst``) telling decoders to skip
+them: the start is exact, with nothing re-encoded. The end is not. ffmpeg
+stops copying in decoding order, and with B-frames the last few frames it
+copies are shown after the requested end, so the edit runs that much long.
+
+limit_edit_list() shortens the edit in place to the requested duration.
+ffmpeg (and so everything here that decodes segments) drops the frames past
+it. Only fixed-size fields are rewritten, so the file keeps its size and
+layout, and nothing is decoded.
+"""
+import os
+import struct
+
+def _boxes(f, start: int, end: int):
+    """Yields ``(type, body_start, box_end)`` for the boxes in ``[start, end)``."""
+    position = start
+    while position + 8 <= end:
+        f.seek(position)
+        size, kind = struct.unpack('>I4s', f.read(8))
+        header = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header = 16
+        elif size == 0:
+            size = end - position
+        if size < header:
+            raise ValueError(f"Malformed '{kind.decode('latin-1')}' box at byte {position}")
+        yield kind, position + header, position + size
+        position += size
+
+def _find(f, start: int, end: int, path: tuple):
+    """Yields ``(body_start, box_end)`` of every box at ``path`` under ``[start, end)``."""
+    for kind, body, stop in _boxes(f, start, end):
+        if kind == path[0]:
+            if len(path) == 1:
+                yield body, stop
+            else:
+                yield from _find(f, body, stop, path[1:])
+
+def _movie_timescale(f, moov: tuple) -> int:
+    for body, _ in _find(f, *moov, (b'mvhd',)):
+        f.seek(body)
+        version = f.read(1)[0]
+        # version, flags, then creation and modification times of 4 or 8 bytes
+        f.seek(body + (20 if version == 1 else 12))
+        return struct.unpack('>I', f.read(4))[0]
+    raise ValueError('No movie header')
+
+def limit_edit_list(path: str, duration: float) -> bool:
+    """
+    Ends the edits of every track of the MP4 at ``path`` at most ``duration``
+    seconds into the presentation. Returns whether anything was shortened;
+    a file without edit lists is left as it is.
+    """
+    with open(path, 'r+b') as f:
+        moov = next(_find(f, 0, os.path.getsize(path), (b'moov',)), None)
+        if moov is None:
+            raise ValueError(f"{path} has no movie box")
+        limit = round(duration * _movie_timescale(f, moov))
+        shortened = False
+        for body, _ in _find(f, *moov, (b'trak', b'edts', b'elst')):
+            f.seek(body)
+            version = f.read(1)[0]
+            f.seek(body + 4)
+            count = struct.unpack('>I', f.read(4))[0]
+            # segment duration (movie timescale), media time (-1 for an empty edit), then the rate
+            entry = struct.Struct('>Qq' if version == 1 else '>Ii')
+            elapsed = 0
+            for i in range(count):
+                at = body + 8 + i * (entry.size + 4)
+                f.seek(at)
+                segment_duration, media_time = entry.unpack(f.read(entry.size))
+                if media_time >= 0 and elapsed + segment_duration > limit:
+                    segment_duration = max(0, limit - elapsed)
+                    f.seek(at)
+                    f.write(entry.pack(segment_duration, media_time))
+                    shortened = True
+                elapsed += segment_duration
+    return shortened
@@ -0,0 +1,11 @@
+"""
+Imported by RenderPool's forkserver before it forks any render.
+
+Naming gif_generator alone would leave moviepy.editor to its lazy import,
+which every render child would then pay for again (about a quarter of a
+second) since nothing it imports survives the render. Importing the heavy
+modules here, once, lets every child start with them.
+"""
+from gif_generator import preload_heavy_modules
+
+preload_heavy_modules()
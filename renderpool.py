@@ -0,0 +1,136 @@
+"""
+A process pool for CPU-bound rendering.
+
+MoviePy's frame processing is pure Python, so rendering on the job threads
+serializes on the GIL. RenderPool runs every render in a child process
+instead, at most ``max_workers`` at a time (one per core by default).
+
+Each render gets its own process, forked from a small single-threaded
+forkserver, so a job that runs past its timeout can be killed without
+affecting any other job. The child leads its own process group, which takes
+ffmpeg subprocesses down with it. The forkserver imports the ``preload``
+modules first; the default, render_preload, imports moviepy.editor and
+yt-dlp, so no render child imports them again.
+"""
+import multiprocessing
+import os
+import signal
+import threading
+import time
+
+class RenderTimeout(Exception):
+    """A render ran past its timeout and was killed."""
+
+class RenderCrashed(Exception):
+    """A render process died without reporting a result."""
+
+def _child_main(connection, fn, args, kwargs):
+    # Lead a new process group so a timeout also kills ffmpeg and friends
+    os.setsid()
+    try:
+        outcome = (True, fn(*args, **kwargs))
+    except BaseException as e:
+        outcome = (False, e)
+    try:
+        connection.send(outcome)
+    except Exception as e:
+        # e.g. an exception that cannot be pickled
+        connection.send((False, RuntimeError(f'{type(outcome[1]).__name__}: {outcome[1]} ({e})')))
+    finally:
+        connection.close()
+
+class RenderPool:
+    """
+    Runs ``fn(*args, **kwargs)`` in a child process with ``run()``, blocking
+    the calling thread until a worker slot is free and the child is done.
+
+    ``fn``, its arguments and its result must be picklable. A render taking
+    longer than ``timeout`` seconds is killed and raises RenderTimeout.
+    """
+
+    def __init__(self, max_workers: int = None, timeout: float = 300, start_method: str = 'forkserver',
+                 preload: list = ('render_preload',)):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self._context = multiprocessing.get_context(start_method)
+        if start_method == 'forkserver':
+            self._context.set_forkserver_preload(list(preload))
+        self._slots = threading.BoundedSemaphore(self.max_workers)
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.busy = 0
+        self.completed = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.busy_seconds = 0.0
+
+    def run(self, fn, *args, timeout: float = None, **kwargs):
+        with self._lock:
+            self.waiting += 1
+        self._slots.acquire()
+        with self._lock:
+            self.waiting -= 1
+            self.busy += 1
+        started = time.monotonic()
+        ok = False
+        try:
+            result = self._run_in_child(fn, args, kwargs, timeout or self.timeout)
+            ok = True
+            return result
+        finally:
+            self._slots.release()
+            with self._lock:
+                self.busy -= 1
+                self.busy_seconds += time.monotonic() - started
+                if ok:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+
+    def _run_in_child(self, fn, args, kwargs, timeout: float):
+        receiver, sender = self._context.Pipe(duplex=False)
+        process = self._context.Process(target=_child_main, args=(sender, fn, args, kwargs), daemon=True)
+        process.start()
+        sender.close()
+        try:
+            if not receiver.poll(timeout):
+                self._kill(process)
+                with self._lock:
+                    self.timed_out += 1
+                raise RenderTimeout(f'Rendering did not finish within {timeout:g} seconds')
+            ok, value = receiver.recv()
+        except EOFError:
+            process.join()
+            raise RenderCrashed(f'Render process exited with code {process.exitcode}')
+        finally:
+            receiver.close()
+            process.join()
+        if not ok:
+            raise value
+        return value
+
+    @staticmethod
+    def _kill(process):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            # The child has not called setsid() yet, so there is no group
+            process.kill()
+
+    def average_seconds(self, default: float = 10.0) -> float:
+        """Mean wall time of the renders finished so far."""
+        with self._lock:
+            finished = self.completed + self.failed
+            return self.busy_seconds / finished if finished else default
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'workers': self.max_workers,
+                'busy': self.busy,
+                'waiting': self.waiting,
+                'utilization': round(self.busy / self.max_workers, 3),
+                'completed': self.completed,
+                'failed': self.failed,
+                'timed_out': self.timed_out,
+            }
@@ -0,0 +1,199 @@
+"""
+Coalescing of identical in-flight work ("single-flight").
+
+SingleFlight.do(key, fn) runs ``fn`` once for any number of concurrent
+callers using the same key; they all get its result, or all see its
+exception. Nothing is remembered once the call has finished, so a failure
+is never cached and the next caller simply runs ``fn`` again.
+
+Threads of one process meet in a dict of pending calls. With ``lock_dir``
+set, processes on the same host also meet there: the process running ``fn``
+holds an exclusive flock on ``<key>.lock`` and leaves the outcome in
+``<key>.json``, while processes waiting for it block on a shared flock and
+read that outcome once it is released. Outcomes cross processes as JSON,
+so ``fn`` should return JSON-serializable values.
+
+Lock files that nobody holds are removed once they are ``outcome_ttl``
+seconds old, so one file per key ever seen does not pile up. The remover
+holds the exclusive lock while it unlinks, and a process that locked a file
+checks that the file is still at its path before running ``fn``; otherwise
+it starts over on the new file.
+"""
+import fcntl
+import json
+import os
+import threading
+import time
+import uuid
+
+class RemoteError(Exception):
+    """
+    An exception raised by ``fn`` in another process, re-raised in a waiter.
+
+    ``error_type`` is the name of the original exception class.
+    """
+
+    def __init__(self, error_type: str, message: str):
+        super().__init__(message)
+        self.error_type = error_type
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+class SingleFlight:
+    """
+    Runs one ``fn`` per key at a time and shares its outcome with every
+    caller that arrived while it was running.
+    """
+
+    def __init__(self, lock_dir: str = None, outcome_ttl: float = 300):
+        self.lock_dir = lock_dir
+        self.outcome_ttl = outcome_ttl
+        self.executions = 0
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+        if lock_dir:
+            os.makedirs(lock_dir, exist_ok=True)
+
+    def do(self, key: str, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run_across_processes(key, fn) if self.lock_dir else self._run(fn)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _run(self, fn):
+        with self._lock:
+            self.executions += 1
+        return fn()
+
+    def _run_across_processes(self, key: str, fn):
+        lock_path = os.path.join(self.lock_dir, f'{key}.lock')
+        outcome_path = os.path.join(self.lock_dir, f'{key}.json')
+        while True:
+            # Taken before trying the lock: an outcome written after the
+            # attempt failed is one this caller waited for
+            waiting_since = time.time()
+            with open(lock_path, 'a') as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # Another process is running fn: wait for it to let go
+                    fcntl.flock(lock_file, fcntl.LOCK_SH)
+                    outcome = self._read_outcome(outcome_path)
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                    if outcome is not None and outcome['finished_at'] >= waiting_since:
+                        with self._lock:
+                            self.coalesced += 1
+                        if outcome['ok']:
+                            return outcome['value']
+                        raise RemoteError(outcome['error_type'], outcome['error'])
+                    # It died without an outcome; try to run fn ourselves
+                    continue
+
+                if not _is_current(lock_file, lock_path):
+                    # Swept between opening and locking; lock the new file instead
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                    continue
+                try:
+                    try:
+                        value = self._run(fn)
+                    except Exception as e:
+                        self._write_outcome(outcome_path, {
+                            'ok': False, 'error': str(e),
+                            'error_type': getattr(e, 'error_type', type(e).__name__),
+                        })
+                        raise
+                    self._write_outcome(outcome_path, {'ok': True, 'value': value})
+                    return value
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                    self._sweep()
+
+    @staticmethod
+    def _read_outcome(path: str) -> dict:
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    @staticmethod
+    def _write_outcome(path: str, outcome: dict):
+        outcome['finished_at'] = time.time()
+        scratch_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(scratch_path, 'w') as f:
+            json.dump(outcome, f)
+        os.replace(scratch_path, path)
+
+    def _sweep(self):
+        """
+        Removes outcomes nobody can be waiting for anymore, and lock files
+        as old that nobody holds, at most once per ``outcome_ttl``.
+        """
+        now = time.time()
+        if now - self._last_sweep < self.outcome_ttl:
+            return
+        self._last_sweep = now
+        for name in os.listdir(self.lock_dir):
+            if not name.endswith(('.json', '.tmp', '.lock')):
+                continue
+            path = os.path.join(self.lock_dir, name)
+            try:
+                if now - os.path.getmtime(path) <= self.outcome_ttl:
+                    continue
+                if name.endswith('.lock'):
+                    _remove_idle_lock(path)
+                else:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+def _is_current(lock_file, path: str) -> bool:
+    """Whether ``lock_file`` is still the file at ``path`` (not swept since it was opened)."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return False
+    opened = os.fstat(lock_file.fileno())
+    return (stat.st_dev, stat.st_ino) == (opened.st_dev, opened.st_ino)
+
+def _remove_idle_lock(path: str):
+    """
+    Unlinks the lock file at ``path`` unless a process holds it. Done under
+    the exclusive lock, so whoever opened the file before the unlink only
+    gets the lock afterwards and sees that it is gone (see _is_current).
+    """
+    with open(path) as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return # In use
+        if _is_current(lock_file, path):
+            os.remove(path)
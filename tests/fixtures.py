@@ -0,0 +1,194 @@
+"""
+Local stand-ins used by the tests and benchmarks: synthetic fixture videos
+generated with ffmpeg, an HTTP server that honours Range requests and counts
+the bytes it sends, and a yt-dlp stand-in resolving every URL to it, so
+downloads can be exercised without touching YouTube.
+"""
+import os
+import re
+import shutil
+import socket
+import subprocess
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from moviepy.config import get_setting
+
+FFMPEG_BINARY = get_setting('FFMPEG_BINARY')
+
+
+def ffmpeg_available() -> bool:
+    return bool(FFMPEG_BINARY) and (os.path.exists(FFMPEG_BINARY) or shutil.which(FFMPEG_BINARY) is not None)
+
+
+def make_video(path: str, duration: float, size: tuple = (320, 240), fps: int = 25,
+               keyframe_interval: int = 25, noise: bool = True, audio: bool = False, bframes: int = 0) -> str:
+    """
+    Writes a synthetic H.264 test video to ``path``.
+
+    ``bframes`` allows up to that many B-frames in a row, which makes the
+    decoding order differ from the display order, as in most real videos.
+
+    ``noise`` adds temporal noise so the bitrate stays roughly constant over
+    the whole clip, which makes byte counts proportional to time ranges.
+    The moov atom is moved to the front so the file can be seeked over HTTP.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    width, height = size
+    video_filter = 'noise=alls=30:allf=t' if noise else 'null'
+    cmd = [FFMPEG_BINARY, '-y', '-loglevel', 'error',
+           '-f', 'lavfi', '-i', f'testsrc2=size={width}x{height}:rate={fps}:duration={duration}']
+    if audio:
+        cmd += ['-f', 'lavfi', '-i', f'sine=frequency=440:duration={duration}']
+    cmd += ['-vf', video_filter, '-c:v', 'libx264', '-preset', 'ultrafast',
+            '-g', str(keyframe_interval), '-bf', str(bframes), '-pix_fmt', 'yuv420p']
+    cmd += ['-c:a', 'aac'] if audio else ['-an']
+    cmd += ['-movflags', '+faststart', path]
+    subprocess.run(cmd, check=True, capture_output=True)
+    return path
+
+
+class _RangeRequestHandler(SimpleHTTPRequestHandler):
+    """SimpleHTTPRequestHandler with single-range ``Range`` support and byte accounting."""
+
+    def setup(self):
+        # A small send buffer keeps the count close to what the client actually
+        # consumed when it drops a connection early (e.g. after seeking away)
+        self.request.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 16 * 1024)
+        super().setup()
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if os.path.isdir(path) or not os.path.exists(path):
+            return super().send_head()
+
+        file_size = os.path.getsize(path)
+        match = re.match(r'bytes=(\d*)-(\d*)$', self.headers.get('Range', ''))
+        f = open(path, 'rb')
+        if match and (match.group(1) or match.group(2)):
+            if match.group(1):
+                first = int(match.group(1))
+                last = int(match.group(2)) if match.group(2) else file_size - 1
+            else:
+                first = max(file_size - int(match.group(2)), 0)
+                last = file_size - 1
+            last = min(last, file_size - 1)
+            if first > last:
+                f.close()
+                self.send_error(416)
+                return None
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {first}-{last}/{file_size}')
+        else:
+            first, last = 0, file_size - 1
+            self.send_response(200)
+        f.seek(first)
+        self._remaining = last - first + 1
+        self.send_header('Content-Type', self.guess_type(path))
+        self.send_header('Content-Length', str(self._remaining))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        return f
+
+    def copyfile(self, source, outputfile):
+        with self.server.lock:
+            self.server.active += 1
+        try:
+            self._send_body(source, outputfile)
+        finally:
+            with self.server.lock:
+                self.server.active -= 1
+
+    def _send_body(self, source, outputfile):
+        remaining = self._remaining
+        while remaining > 0:
+            chunk = source.read(min(64 * 1024, remaining))
+            if not chunk:
+                break
+            try:
+                outputfile.write(chunk)
+            except (BrokenPipeError, ConnectionResetError):
+                break
+            remaining -= len(chunk)
+            with self.server.lock:
+                self.server.bytes_sent += len(chunk)
+
+
+class RangeHTTPServer:
+    """
+    Serves ``directory`` on localhost in a background thread.
+
+    ``bytes_sent`` is the number of body bytes actually written to clients.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), partial(_RangeRequestHandler, directory=directory))
+        self._server.lock = threading.Lock()
+        self._server.bytes_sent = 0
+        self._server.active = 0
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def bytes_sent(self) -> int:
+        return self._server.bytes_sent
+
+    def reset(self, timeout: float = 5):
+        """
+        Zeroes ``bytes_sent`` once transfers from earlier clients have wound down.
+        """
+        deadline = time.time() + timeout
+        while self._server.active and time.time() < deadline:
+            time.sleep(0.01)
+        with self._server.lock:
+            self._server.bytes_sent = 0
+
+    def url(self, filename: str) -> str:
+        host, port = self._server.server_address
+        return f'http://{host}:{port}/{filename}'
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+
+class LocalExtractor:
+    """
+    Stand-in for yt_dlp.YoutubeDL that resolves every URL to a local fixture
+    and counts the extractions in ``calls``.
+    """
+
+    def __init__(self, stream_url, duration=None):
+        self.stream_url = stream_url
+        self.duration = duration
+        self.calls = []
+
+    def __call__(self, ydl_opts):
+        # One instance per YoutubeDL(...) call, as with the real class
+        session = LocalExtractor(self.stream_url, self.duration)
+        session.calls = self.calls
+        session.outtmpl = ydl_opts['outtmpl']
+        return session
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def extract_info(self, url, download=True):
+        self.calls.append(url)
+        return {'id': 'fixture', 'title': 'source', 'ext': 'mp4', 'url': self.stream_url, 'duration': self.duration}
+
+    def prepare_filename(self, info_dict):
+        return self.outtmpl.replace('%(id)s', info_dict['id']).replace('%(title)s', info_dict['title']).replace('%(ext)s', info_dict['ext'])
@@ -0,0 +1,632 @@
+import unittest
+from unittest.mock import patch
+import hashlib
+import io
+import json
+import os
+import re
+import sys
+import shutil
+import subprocess
+import tempfile
+import time
+import zipfile
+
+# Add project root to sys.path to allow importing app
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import app as app_module
+from cache import MetadataCache, ResultCache, SegmentCache
+from janitor import Janitor
+from singleflight import SingleFlight
+from gif_generator import RenderResult
+from budget import RenderBudget, RenderPlan
+from metrics import stage
+from yt_dlp.utils import DownloadError
+
+
+class TestGenerateRoutes(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.temp_video_folder = os.path.join(self.tmp_dir, 'temp_videos')
+        self.gif_folder = os.path.join(self.tmp_dir, 'generated_gifs')
+        os.makedirs(self.temp_video_folder)
+        os.makedirs(self.gif_folder)
+
+        self.config_patch = patch.dict(app_module.app.config, {
+            'TEMP_VIDEO_FOLDER': self.temp_video_folder,
+            'GENERATED_GIF_FOLDER': self.gif_folder,
+            'TESTING': True,
+        })
+        self.config_patch.start()
+        self.cache_patch = patch.object(app_module, 'result_cache',
+                                        ResultCache(self.gif_folder, extensions=('.webp', '.png', '.mp4', '.webm')))
+        self.cache_patch.start()
+        self.intermediate_patch = patch.object(app_module, 'intermediate_cache',
+                                               ResultCache(os.path.join(self.tmp_dir, 'intermediates'), extension='.mkv'))
+        self.intermediate_patch.start()
+        self.metadata_patch = patch.object(app_module, 'metadata_cache', MetadataCache(os.path.join(self.tmp_dir, 'metadata')))
+        self.metadata_patch.start()
+        self.segment_patch = patch.object(app_module, 'segment_cache', SegmentCache(os.path.join(self.tmp_dir, 'segments')))
+        self.segment_patch.start()
+        self.flight_patch = patch.object(app_module, 'single_flight', SingleFlight(os.path.join(self.tmp_dir, 'inflight')))
+        self.flight_patch.start()
+        # Sweeps only the temporary folders, and only when a test asks it to
+        self.janitor_patch = patch.object(app_module, 'janitor',
+                                          Janitor({'results': app_module.result_cache, 'segments': app_module.segment_cache},
+                                                  self.temp_video_folder, max_job_seconds=3600, interval=3600))
+        self.janitor_patch.start()
+        # Render on the job threads so the patched render_gif is what runs
+        self.pool_patch = patch.object(app_module, 'render_pool', None)
+        self.pool_patch.start()
+        self.client = app_module.app.test_client()
+        self.form = {
+            'youtube_url': 'https://www.youtube.com/watch?v=dQw4w9WgXcQ',
+            'video_start_time': '10',
+            'video_end_time': '13',
+            'meme_text': 'HELLO',
+            'text_start_time': '0.5',
+        }
+
+    def tearDown(self):
+        self.pool_patch.stop()
+        app_module.janitor.stop()
+        self.janitor_patch.stop()
+        self.flight_patch.stop()
+        self.segment_patch.stop()
+        self.metadata_patch.stop()
+        self.intermediate_patch.stop()
+        self.cache_patch.stop()
+        self.config_patch.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def fake_download(self, youtube_url, start_time, end_time, output_dir, **kwargs):
+        path = os.path.join(output_dir, 'segment.mp4')
+        with open(path, 'wb') as f:
+            f.write(b'video')
+        return path
+
+    def fake_render(self, video_path, output_path, **kwargs):
+        with open(output_path, 'wb') as f:
+            f.write(b'GIF89a')
+        return RenderResult(path=output_path, fps=kwargs['fps'], duration=3, encoder=kwargs['encoder'],
+                            encode_seconds=0.1, output_bytes=6)
+
+    def wait_for_job(self, job_id, timeout=5):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            status = self.client.get(f'/jobs/{job_id}').get_json()
+            if status['status'] in ('done', 'failed'):
+                return status
+            time.sleep(0.01)
+        raise AssertionError(f'Job {job_id} did not finish')
+
+    def test_generate_enqueues_and_redirects_to_result(self):
+        with patch('gif_generator.download_video_segment', side_effect=self.fake_download), \
+             patch('gif_generator.render_gif', side_effect=self.fake_render) as mock_render:
+            response = self.client.post('/generate', data=self.form)
+
+            self.assertEqual(response.status_code, 302)
+            job_id = response.headers['Location'].rsplit('/', 1)[-1]
+            status = self.wait_for_job(job_id)
+
+        self.assertEqual(status['status'], 'done')
+        self.assertEqual(status['progress'], 1.0)
+        overlay = mock_render.call_args.kwargs['overlays'][0]
+        self.assertEqual((overlay.text, overlay.start_time), ('HELLO', 0.5))
+        # The downloaded segment is cleaned up once the GIF exists
+        self.assertEqual(os.listdir(self.temp_video_folder), [])
+
+        response = self.client.get(f'/results/{job_id}')
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.headers['Location'], status['result_url'])
+        self.assertEqual(self.client.get(status['result_url']).status_code, 200)
+
+    def test_repeated_request_is_served_from_cache(self):
+        with patch('gif_generator.download_video_segment', side_effect=self.fake_download) as mock_download, \
+             patch('gif_generator.render_gif', side_effect=self.fake_render) as mock_render:
+            first_id = self.client.post('/generate', data=self.form, headers={'Accept': 'application/json'}).get_json()['job_id']
+            first = self.wait_for_job(first_id)
+            # The same clip and caption behind a different URL shape
+            second_form = dict(self.form, youtube_url='https://youtu.be/dQw4w9WgXcQ?t=42')
+            second_id = self.client.post('/generate', data=second_form, headers={'Accept': 'application/json'}).get_json()['job_id']
+            second = self.wait_for_job(second_id)
+
+        self.assertEqual(first['result_url'], second['result_url'])
+        mock_download.assert_called_once()
+        mock_render.assert_called_once()
+        self.assertEqual(app_module.result_cache.stats()['hits'], 1)
+        self.assertEqual(len(os.listdir(self.gif_folder)), 1)
+
+        # Showing and fetching the file is no render reused
+        filename = first['result_url'].rsplit('/', 1)[-1]
+        self.assertEqual(self.client.get(first['result_url']).status_code, 200)
+        self.client.get(self.file_url(filename)).close()
+        self.client.get(f'/download/{filename}').close()
+        stats = app_module.result_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_concurrent_identical_requests_share_one_render(self):
+        def slow_download(*args, **kwargs):
+            time.sleep(0.3)
+            return self.fake_download(*args, **kwargs)
+
+        with patch('gif_generator.download_video_segment', side_effect=slow_download) as mock_download, \
+             patch('gif_generator.render_gif', side_effect=self.fake_render) as mock_render:
+            job_ids = [self.client.post('/generate', data=self.form, headers={'Accept': 'application/json'}).get_json()['job_id']
+                       for _ in range(2)]
+            statuses = [self.wait_for_job(job_id) for job_id in job_ids]
+
+        self.assertEqual(statuses[0]['result_url'], statuses[1]['result_url'])
+        mock_download.assert_called_once()
+        mock_render.assert_called_once()
+        self.assertEqual(app_module.single_flight.coalesced, 1)
+
+    def test_generate_returns_job_id_for_json_clients(self):
+        with patch('gif_generator.download_video_segment', side_effect=self.fake_download), \
+             patch('gif_generator.render_gif', side_effect=self.fake_render):
+            response = self.client.post('/generate', data=self.form, headers={'Accept': 'application/json'})
+            self.assertEqual(response.status_code, 202)
+            body = response.get_json()
+            self.wait_for_job(body['job_id'])
+
+        self.assertEqual(body['status_url'], f"/jobs/{body['job_id']}")
+
+    def test_pending_job_renders_polling_page(self):
+        job_id = app_module.job_queue.store.create({}).id
+
+        response = self.client.get(f'/results/{job_id}')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(f'/jobs/{job_id}'.encode(), response.data)
+
+    def test_failed_job_reports_error(self):
+        with patch('gif_generator.download_video_segment', side_effect=DownloadError('Video unavailable')):
+            job_id = self.client.post('/generate', data=self.form, headers={'Accept': 'application/json'}).get_json()['job_id']
+            status = self.wait_for_job(job_id)
+
+        self.assertEqual(status['status'], 'failed')
+        self.assertIn('Error downloading video: Video unavailable', status['error'])
+        response = self.client.get(f'/results/{job_id}')
+        self.assertEqual(response.headers['Location'], '/')
+
+    def test_invalid_form_is_rejected_without_a_job(self):
+        with patch.object(app_module.job_queue, 'submit') as mock_submit:
+            response = self.client.post('/generate', data=dict(self.form, video_end_time='5'))
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.headers['Location'], '/')
+        mock_submit.assert_not_called()
+
+    def test_end_past_known_duration_is_rejected_without_a_job(self):
+        app_module.metadata_cache.put('dQw4w9WgXcQ', 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/mp4',
+                                      {'duration': 12, 'filename': 'x', 'sources': []})
+        with patch.object(app_module.job_queue, 'submit') as mock_submit:
+            response = self.client.post('/generate', data=dict(self.form, video_end_time='20'), follow_redirects=True)
+
+        mock_submit.assert_not_called()
+        self.assertIn(b'12 seconds long', response.data)
+
+    def test_full_backlog_is_turned_away_with_retry_after(self):
+        with patch.dict(app_module.app.config, {'JOB_BACKLOG': 2}), \
+             patch.object(app_module.job_queue, 'depth', return_value={'queued': 2, 'running': 2}), \
+             patch.object(app_module.job_queue, 'submit') as mock_submit:
+            json_response = self.client.post('/generate', data=self.form, headers={'Accept': 'application/json'})
+            html_response = self.client.post('/generate', data=self.form)
+
+        mock_submit.assert_not_called()
+        self.assertEqual(json_response.status_code, 503)
+        self.assertGreaterEqual(int(json_response.headers['Retry-After']), 1)
+        self.assertIn('busy', json_response.get_json()['error'])
+        self.assertEqual(html_response.status_code, 503)
+        self.assertIn(b'busy', html_response.data)
+
+    def test_limits_render_within_a_budget(self):
+        plan = RenderPlan(fps=8, width=320, height=180, max_colors=128, estimated_bytes=900_000,
+                          estimated_seconds=2.0, trials=2, passes=1, output_bytes=6, seconds=2.5)
+
+        def budgeted_render(video_path, output_path, **kwargs):
+            result = self.fake_render(video_path, output_path, **kwargs)
+            result.plan = plan
+            return result
+
+        form = dict(self.form, max_size_mb='1.5', max_render_seconds='')
+        with patch('gif_generator.download_video_segment', side_effect=self.fake_download), \
+             patch('gif_generator.render_gif', side_effect=budgeted_render) as mock_render:
+            job_id = self.client.post('/generate', data=form, headers={'Accept': 'application/json'}).get_json()['job_id']
+            status = self.wait_for_job(job_id)
+
+        self.assertEqual(mock_render.call_args.kwargs['budget'], RenderBudget(max_bytes=1572864))
+        self.assertEqual((status['plan']['width'], status['plan']['fps'], status['plan']['max_colors']), (320, 8, 128))
+
+    def test_invalid_limit_is_rejected(self):
+        with patch.object(app_module.job_queue, 'submit') as mock_submit:
+            response = self.client.post('/generate', data=dict(self.form, max_size_mb='-2'))
+
+        self.assertEqual(response.headers['Location'], '/')
+        mock_submit.assert_not_called()
+
+    def test_frame_rate_and_size_are_held_to_the_caps(self):
+        with patch('gif_generator.download_video_segment', side_effect=self.fake_download), \
+             patch('gif_generator.render_gif', side_effect=self.fake_render) as mock_render:
+            defaults_id = self.client.post('/generate', data=self.form,
+                                           headers={'Accept': 'application/json'}).get_json()['job_id']
+            self.wait_for_job(defaults_id)
+            defaults = mock_render.call_args.kwargs
+            form = dict(self.form, fps='120', max_width='480', max_height='99999')
+            job_id = self.client.post('/generate', data=form, headers={'Accept': 'application/json'}).get_json()['job_id']
+            self.wait_for_job(job_id)
+            requested = mock_render.call_args.kwargs
+
+        config = app_module.app.config
+        self.assertEqual((defaults['fps'], defaults['max_width'], defaults['max_height']),
+                         (10, config['OUTPUT_MAX_WIDTH'], config['OUTPUT_MAX_HEIGHT']))
+        self.assertEqual((requested['fps'], requested['max_width'], requested['max_height']),
+                         (config['OUTPUT_MAX_FPS'], 480, config['OUTPUT_MAX_HEIGHT']))
+        self.assertEqual(len(os.listdir(self.gif_folder)), 2)
+
+    def test_invalid_frame_rate_or_size_is_rejected(self):
+        with patch.object(app_module.job_queue, 'submit') as mock_submit:
+            for field, value in (('fps', '0'), ('max_width', '320.5'), ('max_height', 'tall')):
+                response = self.client.post('/generate', data=dict(self.form, **{field: value}))
+                self.assertEqual(response.headers['Location'], '/', field)
+            response = self.client.post('/batch', json={'youtube_url': self.form['youtube_url'], 'max_width': -1,
+                                                        'clips': [{'video_start_time': 10, 'video_end_time': 13}]})
+
+        self.assertEqual(response.status_code, 400)
+        mock_submit.assert_not_called()
+
+    def test_output_format_is_rendered_and_shown(self):
+        form = dict(self.form, output_format='mp4')
+        with patch('gif_generator.download_video_segment', side_effect=self.fake_download), \
+             patch('gif_generator.render_gif', side_effect=self.fake_render) as mock_render:
+            job_id = self.client.post('/generate', data=form, headers={'Accept': 'application/json'}).get_json()['job_id']
+            status = self.wait_for_job(job_id)
+
+        self.assertEqual(mock_render.call_args.kwargs['output_format'], 'mp4')
+        self.assertTrue(status['result_url'].endswith('.mp4'))
+        self.assertIn(b'<video', self.client.get(status['result_url']).data)
+
+    def test_limits_are_only_for_gifs(self):
+        with patch.object(app_module.job_queue, 'submit') as mock_submit:
+            response = self.client.post('/generate', data=dict(self.form, output_format='webp', max_size_mb='2'))
+
+        self.assertEqual(response.headers['Location'], '/')
+        mock_submit.assert_not_called()
+
+    def add_rendered(self, key, extension, content):
+        with open(os.path.join(self.gif_folder, key + extension), 'wb') as f:
+            f.write(content)
+
+    def fake_convert(self, key, output_format, cache, intermediate_cache, *args):
+        extension = app_module.get_format(output_format).extension
+        self.add_rendered(key, extension, b'RIFF')
+        return RenderResult(path=cache.path_for(key, extension), fps=10, duration=3, encoder=output_format,
+                            encode_seconds=0.1, output_bytes=4, output_format=output_format)
+
+    def add_intermediate(self, key):
+        with open(app_module.intermediate_cache.path_for(key), 'wb') as f:
+            f.write(b'MKV')
+
+    def test_download_converts_to_the_requested_format(self):
+        self.add_rendered('abc', '.gif', b'GIF89a')
+        self.add_rendered('abc', '.mp4', b'MP4')
+        self.add_intermediate('abc')
+        with patch.object(app_module, 'convert_cached', side_effect=self.fake_convert) as mock_convert:
+            # Converting takes seconds, so it runs as a job rather than in the request
+            queued = self.client.get('/download/abc.gif?format=webp')
+            self.assertEqual(queued.status_code, 303)
+            status = self.wait_for_job(queued.headers['Location'].rsplit('/', 1)[-1])
+            self.assertEqual(status['result_url'], '/results/abc.webp')
+
+            explicit = self.client.get('/download/abc.gif?format=webp')
+            negotiated = self.client.get('/download/abc.gif', headers={'Accept': 'image/webp'})
+            default = self.client.get('/download/abc.gif', headers={'Accept': '*/*'})
+            # Chrome's navigation header: WebP first, but GIF accepted too
+            browser = self.client.get('/download/abc.gif', headers={
+                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,'
+                          'image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7'})
+            mp4 = self.client.get('/download/abc.mp4', headers={'Accept': 'image/webp,*/*;q=0.8'})
+
+        mock_convert.assert_called_once()
+        self.assertEqual((explicit.data, explicit.mimetype), (b'RIFF', 'image/webp'))
+        self.assertEqual(negotiated.data, b'RIFF')
+        self.assertIn('Accept', negotiated.headers['Vary'])
+        self.assertEqual(default.data, b'GIF89a')
+        self.assertEqual((browser.data, browser.mimetype), (b'GIF89a', 'image/gif'))
+        self.assertEqual((mp4.data, mp4.mimetype), (b'MP4', 'video/mp4'))
+        for response in (explicit, negotiated, default, browser, mp4):
+            response.close()
+
+    def test_conversions_are_queued_as_jobs(self):
+        self.add_rendered('abc', '.gif', b'GIF89a')
+        self.add_intermediate('abc')
+        with patch.object(app_module, 'convert_cached', side_effect=self.fake_convert):
+            page = self.client.get('/results/abc.gif?format=webp')
+            self.assertEqual(page.status_code, 303)
+            job_id = page.headers['Location'].rsplit('/', 1)[-1]
+            self.wait_for_job(job_id)
+            api = self.client.get('/download/abc.gif?format=mp4', headers={'Accept': 'application/json'})
+            self.assertEqual(api.status_code, 202)
+            self.assertEqual(self.wait_for_job(api.get_json()['job_id'])['result_url'], '/results/abc.mp4')
+
+        self.assertEqual(self.client.get(f'/results/{job_id}').headers['Location'], '/results/abc.webp')
+        # Made once, then served as it is
+        self.assertEqual(self.client.get('/results/abc.gif?format=webp').headers['Location'], '/results/abc.webp')
+
+    def test_failed_conversion_is_reported_by_the_job(self):
+        self.add_rendered('abc', '.gif', b'GIF89a')
+        self.add_intermediate('abc')
+        with patch.object(app_module, 'convert_cached', return_value=None):
+            response = self.client.get('/download/abc.gif?format=mp4', headers={'Accept': 'application/json'})
+            status = self.wait_for_job(response.get_json()['job_id'])
+
+        self.assertEqual(status['status'], 'failed')
+        self.assertIn('generate it again', status['error'])
+
+    def test_format_without_intermediate_asks_to_generate_again(self):
+        self.add_rendered('abc', '.gif', b'GIF89a')
+
+        response = self.client.get('/download/abc.gif?format=mp4')
+
+        self.assertEqual(response.headers['Location'], '/')
+
+    def file_url(self, filename):
+        """The image URL on the results page of ``filename``."""
+        page = self.client.get(f'/results/{filename}')
+        return re.search(r'src="(/files/[^"]+)"', page.get_data(as_text=True)).group(1)
+
+    def test_rendered_files_are_served_under_immutable_urls(self):
+        content = b'GIF89a' + bytes(range(256)) * 4
+        self.add_rendered('abc', '.gif', content)
+        etag = f'"{hashlib.sha256(content).hexdigest()}"'
+
+        url = self.file_url('abc.gif')
+        response = self.client.get(url)
+
+        self.assertEqual(response.data, content)
+        self.assertEqual(response.headers['ETag'], etag)
+        self.assertEqual(response.headers['Accept-Ranges'], 'bytes')
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        self.assertIn('max-age=31536000', response.headers['Cache-Control'])
+        # The mtime moves with every read (see ResultCache.get), so it is no validator
+        self.assertNotIn('Last-Modified', response.headers)
+        head = self.client.head(url)
+        self.assertEqual((head.status_code, head.data, head.content_length), (200, b'', len(content)))
+        part = self.client.get(url, headers={'Range': 'bytes=0-5'})
+        self.assertEqual((part.status_code, part.data), (206, b'GIF89a'))
+        self.assertEqual(part.headers['Content-Range'], f'bytes 0-5/{len(content)}')
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': '"stale"'}).status_code, 200)
+        for r in (response, part):
+            r.close()
+
+    def test_repeat_fetches_are_answered_with_304(self):
+        self.add_rendered('abc', '.gif', b'GIF89a')
+        not_modified = app_module.FILE_RESPONSES.value(route='files', status=304)
+        first = self.client.get(self.file_url('abc.gif'))
+        first.close()
+
+        for _ in range(20):
+            # Viewing the page again refreshes the entry's mtime, which must not change the URL or the ETag
+            url = self.file_url('abc.gif')
+            response = self.client.get(url, headers={'If-None-Match': first.headers['ETag']})
+            self.assertEqual((response.status_code, response.data), (304, b''))
+            self.assertIn('immutable', response.headers['Cache-Control'])
+
+        self.assertEqual(app_module.FILE_RESPONSES.value(route='files', status=304) - not_modified, 20)
+        # Downloads are revalidated every time, and get a 304 just the same
+        download = self.client.get('/download/abc.gif', headers={'Accept': '*/*'})
+        self.assertEqual(download.headers['ETag'], first.headers['ETag'])
+        self.assertIn('no-cache', download.headers['Cache-Control'])
+        self.assertIn('attachment', download.headers['Content-Disposition'])
+        download.close()
+        repeat = self.client.get('/download/abc.gif', headers={'Accept': '*/*', 'If-None-Match': download.headers['ETag']})
+        self.assertEqual(repeat.status_code, 304)
+
+    def test_urls_of_replaced_files_redirect(self):
+        self.add_rendered('abc', '.gif', b'GIF89a')
+        old_url = self.file_url('abc.gif')
+        replacement = os.path.join(self.tmp_dir, 'replacement.gif')
+        with open(replacement, 'wb') as f:
+            f.write(b'GIF89a, rendered again')
+        app_module.result_cache.put('abc', replacement, '.gif')
+
+        response = self.client.get(old_url)
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.headers['Location'], self.file_url('abc.gif'))
+        self.assertNotEqual(response.headers['Location'], old_url)
+        self.assertEqual(self.client.get('/files/0123456789abcdef/missing.gif').status_code, 404)
+
+    def test_file_transfers_can_be_offloaded_to_a_proxy(self):
+        self.add_rendered('abc', '.gif', b'GIF89a')
+        url = self.file_url('abc.gif')
+
+        with patch.dict(app_module.app.config, {'FILE_OFFLOAD': 'x-accel-redirect'}):
+            accel = self.client.get(url)
+            cached = self.client.get(url, headers={'If-None-Match': accel.headers['ETag']})
+        with patch.dict(app_module.app.config, {'FILE_OFFLOAD': 'x-sendfile'}):
+            sendfile = self.client.get('/download/abc.gif')
+
+        self.assertEqual((accel.status_code, accel.data), (200, b''))
+        self.assertEqual(accel.headers['X-Accel-Redirect'], '/internal/generated_gifs/abc.gif')
+        self.assertNotIn('X-Sendfile', accel.headers)
+        self.assertEqual(accel.mimetype, 'image/gif')
+        self.assertIn('immutable', accel.headers['Cache-Control'])
+        self.assertEqual(cached.status_code, 304)
+        self.assertNotIn('X-Accel-Redirect', cached.headers)
+        self.assertEqual(sendfile.headers['X-Sendfile'], os.path.join(self.gif_folder, 'abc.gif'))
+        self.assertEqual(sendfile.data, b'')
+
+    def test_jobs_are_measured_and_logged_per_stage(self):
+        def timed_download(*args, **kwargs):
+            with stage('download') as timing:
+                path = self.fake_download(*args, **kwargs)
+                timing.bytes = 5
+            return path
+
+        def timed_render(video_path, output_path, **kwargs):
+            with stage('encode') as timing:
+                result = self.fake_render(video_path, output_path, **kwargs)
+                timing.bytes = result.output_bytes
+            return result
+
+        downloaded = app_module.DOWNLOADED_BYTES.value()
+        encodes, _ = app_module.STAGE_SECONDS.value(stage='encode')
+        download_errors = app_module.JOB_ERRORS.value(type='DownloadError')
+        log = io.StringIO()
+        with patch('sys.stdout', log):
+            with patch('gif_generator.download_video_segment', side_effect=timed_download), \
+                 patch('gif_generator.render_gif', side_effect=timed_render):
+                job_id = self.client.post('/generate', data=self.form, headers={'Accept': 'application/json'}).get_json()['job_id']
+                self.wait_for_job(job_id)
+            with patch('gif_generator.download_video_segment', side_effect=DownloadError('Video unavailable')):
+                job_id = self.client.post('/generate', data=dict(self.form, meme_text='OTHER'),
+                                          headers={'Accept': 'application/json'}).get_json()['job_id']
+                self.wait_for_job(job_id)
+
+        self.assertEqual(app_module.DOWNLOADED_BYTES.value(), downloaded + 5)
+        self.assertEqual(app_module.STAGE_SECONDS.value(stage='encode')[0], encodes + 1)
+        self.assertEqual(app_module.JOB_ERRORS.value(type='DownloadError'), download_errors + 1)
+        lines = [json.loads(line) for line in log.getvalue().splitlines() if line.startswith('{')]
+        done, failed = [line for line in lines if line.get('event') == 'generate']
+        self.assertEqual((done['outcome'], done['video_id'], done['bytes']), ('done', 'dQw4w9WgXcQ', 6))
+        self.assertEqual(set(done['stages']), {'download', 'encode'})
+        self.assertEqual(done['stages']['download']['bytes'], 5)
+        self.assertEqual((failed['outcome'], failed['error_type']), ('failed', 'DownloadError'))
+
+        metrics = self.client.get('/metrics')
+        self.assertEqual(metrics.status_code, 200)
+        self.assertTrue(metrics.headers['Content-Type'].startswith('text/plain'))
+        body = metrics.get_data(as_text=True)
+        self.assertIn('gif_stage_seconds_bucket{stage="encode",le="+Inf"}', body)
+        self.assertIn('gif_job_errors_total{type="DownloadError"}', body)
+        self.assertIn('gif_jobs_in_flight{state="running"}', body)
+        self.assertIn('gif_cache_entries{cache="results"}', body)
+        self.assertIn('# TYPE gif_cache_lookups_total counter', body)
+
+    def test_preview_then_confirm(self):
+        with patch('gif_generator.download_video_segment', side_effect=self.fake_download), \
+             patch('gif_generator.render_gif', side_effect=self.fake_render) as mock_render:
+            response = self.client.post('/generate', data=dict(self.form, output_format='webp', preview='Preview'))
+            preview_id = response.headers['Location'].rsplit('/', 1)[-1]
+            self.assertEqual(self.wait_for_job(preview_id)['preview'], True)
+
+            # The preview is shown on its own page, with a form confirming it
+            page = self.client.get(f'/results/{preview_id}')
+            self.assertEqual(page.status_code, 200)
+            self.assertIn(b'Render Full Quality', page.data)
+            self.assertIn(b'name="output_format" value="webp"', page.data)
+            self.assertEqual(mock_render.call_args.kwargs['preview'], app_module.app.config['PREVIEW'])
+            self.assertNotIn('output_format', mock_render.call_args.kwargs)
+            preview_file = app_module.job_queue.get(preview_id).result['filename']
+
+            # ...which keeps it on screen while the full render runs
+            with patch.object(app_module.job_queue, 'submit', return_value='feedface') as mock_submit:
+                response = self.client.post('/generate', data=dict(self.form, output_format='webp',
+                                                                   preview_of=preview_file))
+            self.assertFalse(mock_submit.call_args.args[0]['preview'])
+            self.assertEqual(response.headers['Location'], f'/results/feedface?preview={preview_file}')
+            job_id = app_module.job_queue.store.create({}).id
+            pending = self.client.get(f'/results/{job_id}?preview={preview_file}')
+            self.assertRegex(pending.data, f'src="/files/[0-9a-f]{{16}}/{preview_file}"'.encode())
+            # Only cached renders are shown
+            self.assertNotIn(b'<img', self.client.get(f'/results/{job_id}?preview=missing.gif').data)
+
+    def test_batch_downloads_once_per_range_and_reports_each_clip(self):
+        def fake_trim(source_path, offset, duration, output_path, cut_mode='encode'):
+            shutil.copy(source_path, output_path)
+            return output_path
+
+        def failing_render(video_path, output_path, **kwargs):
+            if kwargs['overlays'][0].text == 'FAIL':
+                raise OSError('corrupt frame')
+            return self.fake_render(video_path, output_path, **kwargs)
+
+        batch = {'youtube_url': self.form['youtube_url'], 'zip': True, 'clips': [
+            {'video_start_time': 10, 'video_end_time': 13, 'meme_text': 'A', 'text_start_time': 0.5},
+            {'video_start_time': 14, 'video_end_time': 16, 'meme_text': 'FAIL'},
+            {'video_start_time': 40, 'video_end_time': 42, 'meme_text': 'C'},
+        ]}
+        with patch('gif_generator.download_video_segment', side_effect=self.fake_download) as mock_download, \
+             patch('gif_generator._trim_segment', side_effect=fake_trim), \
+             patch('gif_generator.render_gif', side_effect=failing_render):
+            response = self.client.post('/batch', json=batch)
+            self.assertEqual(response.status_code, 202)
+            status = self.wait_for_job(response.get_json()['job_id'])
+
+        self.assertEqual(status['status'], 'done')
+        self.assertEqual([call.args[1:3] for call in mock_download.call_args_list], [(10, 16), (40, 42)])
+        first, failed, last = status['clips']
+        self.assertEqual((first['status'], first['text']), ('done', 'A'))
+        self.assertEqual(self.client.get(first['url']).data, b'GIF89a')
+        self.assertEqual(failed['status'], 'failed')
+        self.assertIn('corrupt frame', failed['error'])
+        self.assertEqual(last['status'], 'done')
+        with zipfile.ZipFile(io.BytesIO(self.client.get(status['zip_url']).data)) as archive:
+            self.assertEqual(archive.namelist(), ['clip-01.gif', 'clip-03.gif'])
+        self.assertEqual(os.listdir(self.temp_video_folder), [])
+
+    def test_invalid_batch_is_rejected_without_a_job(self):
+        clip = {'video_start_time': 10, 'video_end_time': 13}
+        with patch.object(app_module.job_queue, 'submit') as mock_submit:
+            not_json = self.client.post('/batch', data=self.form)
+            no_clips = self.client.post('/batch', json={'youtube_url': self.form['youtube_url'], 'clips': []})
+            bad_clip = self.client.post('/batch', json={'youtube_url': self.form['youtube_url'],
+                                                        'clips': [clip, dict(clip, video_end_time=5)]})
+            too_many = self.client.post('/batch', json={'youtube_url': self.form['youtube_url'],
+                                                        'clips': [clip] * (app_module.app.config['BATCH_MAX_CLIPS'] + 1)})
+
+        for response in (not_json, no_clips, bad_clip, too_many):
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(bad_clip.get_json()['clip'], 1)
+        mock_submit.assert_not_called()
+
+    def test_stats_report_queue_depth(self):
+        response = self.client.get('/stats')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.get_json()['jobs']), {'queued', 'running'})
+        self.assertIn('reclaimed_bytes', response.get_json()['janitor'])
+        caches = response.get_json()['caches']
+        self.assertEqual(set(caches), {'results', 'intermediates', 'segments', 'metadata'})
+        self.assertEqual(set(caches['results']), {'hits', 'misses', 'evictions', 'entries', 'bytes'})
+
+    def test_downloads_keep_a_render_from_expiring(self):
+        path = os.path.join(self.gif_folder, 'abc.gif')
+        with open(path, 'wb') as f:
+            f.write(b'GIF89a')
+        os.utime(path, (time.time() - 3600, time.time() - 3600))
+
+        self.assertEqual(self.client.get('/download/abc.gif').status_code, 200)
+
+        self.assertLess(time.time() - os.path.getmtime(path), 60)
+
+    def test_unknown_job(self):
+        self.assertEqual(self.client.get('/jobs/deadbeef').status_code, 404)
+
+class TestLightweightRoutes(unittest.TestCase):
+
+    def test_index_and_health_check_skip_heavy_imports(self):
+        # A fresh interpreter: this one imported everything already
+        code = ("import json, sys; sys.path.insert(0, sys.argv[1]); import app; client = app.app.test_client(); "
+                "statuses = [client.get(path).status_code for path in ('/', '/healthz')]; "
+                "print(json.dumps([statuses, [m for m in ('moviepy.editor', 'yt_dlp') if m in sys.modules]]))")
+        with tempfile.TemporaryDirectory() as work_dir:
+            output = subprocess.run([sys.executable, '-c', code, project_root], cwd=work_dir,
+                                    capture_output=True, text=True, check=True).stdout
+        statuses, heavy_modules = json.loads(output.strip().splitlines()[-1])
+
+        self.assertEqual(statuses, [200, 200])
+        self.assertEqual(heavy_modules, [])
+
+    def test_health_check(self):
+        response = app_module.app.test_client().get('/healthz')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {'status': 'ok', 'pid': os.getpid()})
+
+if __name__ == '__main__':
+    unittest.main(argv=['first-arg-is-ignored'], exit=False)
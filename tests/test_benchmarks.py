@@ -0,0 +1,109 @@
+import unittest
+import os
+import shutil
+import sys
+import tempfile
+
+# Add project root to sys.path to allow importing the benchmarks
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from benchmarks.decode_benchmark import MODES, run_benchmark as run_decode_benchmark
+from benchmarks.gif_delta_benchmark import run_benchmark
+from benchmarks.pipeline_benchmark import STAGES, find_regressions, run_case
+from benchmarks.startup_benchmark import gunicorn_available, run_benchmark as run_startup_benchmark
+from tests.fixtures import ffmpeg_available
+
+
+def _run(wall, cpu):
+    return {'cases': [{'name': 'case', 'stages': {'convert_to_gif': {'wall_seconds': wall, 'cpu_seconds': cpu}}}]}
+
+
+class TestRegressionCheck(unittest.TestCase):
+
+    def test_slowdown_beyond_threshold_is_flagged(self):
+        regressions = find_regressions(_run(2.0, 1.8), _run(2.6, 2.4), threshold=0.2)
+
+        self.assertEqual(len(regressions), 1)
+        self.assertIn('case convert_to_gif', regressions[0])
+        self.assertIn('+30%', regressions[0])
+
+    def test_noise_is_not_flagged(self):
+        # Within the threshold
+        self.assertEqual(find_regressions(_run(2.0, 1.8), _run(2.3, 2.0)), [])
+        # Only the wall clock grew: the machine was busy, the code did no more work
+        self.assertEqual(find_regressions(_run(2.0, 1.8), _run(3.0, 1.8)), [])
+        # Large ratio on a stage too short to measure
+        self.assertEqual(find_regressions(_run(0.01, 0.01), _run(0.03, 0.03)), [])
+
+    def test_cases_missing_from_the_baseline_are_skipped(self):
+        self.assertEqual(find_regressions({'cases': []}, _run(2.0, 1.8)), [])
+
+
+@unittest.skipUnless(ffmpeg_available(), "ffmpeg is required to benchmark")
+class TestPipelineBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_every_stage_is_measured(self):
+        case = run_case(self.tmp_dir, (160, 120), 1, 25)
+
+        self.assertEqual(case['name'], '160x120-1s-25fps')
+        self.assertEqual(tuple(case['stages']), STAGES)
+        for stage, result in case['stages'].items():
+            self.assertGreater(result['wall_seconds'], 0, stage)
+            self.assertGreater(result['cpu_seconds'], 0, stage)
+            self.assertGreater(result['peak_rss_kb'], 0, stage)
+            self.assertGreater(result['output_bytes'], 0, stage)
+        self.assertGreater(case['stages']['download']['bytes_fetched'], 0)
+        self.assertEqual(find_regressions({'cases': [case]}, {'cases': [case]}), [])
+
+class TestGifDeltaBenchmark(unittest.TestCase):
+
+    def test_deltas_are_compared_with_whole_frames(self):
+        results = run_benchmark((80, 60), 1, 10, [8])
+
+        whole, delta = results['runs']
+        self.assertIsNone(whole['delta_threshold'])
+        self.assertEqual(whole['frames_written'], 10)
+        self.assertLess(delta['frames_written'], 10)
+        self.assertLess(delta['size_ratio'], 1)
+        self.assertLess(abs(delta['mean_error'] - whole['mean_error']), 1)
+
+@unittest.skipUnless(ffmpeg_available(), "ffmpeg is required to benchmark")
+class TestDecodeBenchmark(unittest.TestCase):
+
+    def test_every_mode_reads_the_gif_frames(self):
+        results = run_decode_benchmark([(320, 240)], duration=1, fps=20, gif_fps=5, max_width=160)
+
+        case, = results['cases']
+        self.assertEqual(case['output_size'], [160, 120])
+        runs = {run['mode']: run for run in case['runs']}
+        self.assertEqual(tuple(runs), MODES)
+        for mode, run in runs.items():
+            self.assertEqual(run['frames'], 5, mode)
+            self.assertGreater(run['source_frames_per_second'], 0, mode)
+        # Decimated and scaled in ffmpeg: only the GIF's frames at the GIF's size reach Python
+        self.assertEqual(runs['decoder_scaled']['bytes_to_python'], 5 * 160 * 120 * 3)
+        self.assertLess(runs['decoder']['bytes_to_python'], runs['moviepy']['bytes_to_python'])
+
+class TestStartupBenchmark(unittest.TestCase):
+
+    def test_first_requests_are_timed_without_heavy_imports(self):
+        results = run_startup_benchmark(paths=('/healthz',), workers=1)
+
+        runs = {run['mode']: run for run in results['runs']}
+        self.assertEqual(set(runs), {'lazy', 'preloaded', 'server'} if gunicorn_available() else {'lazy', 'preloaded'})
+        self.assertEqual(runs['lazy']['heavy_modules_after_requests'], [])
+        self.assertGreater(runs['lazy']['first_use_seconds'], 0)
+        self.assertEqual(runs['preloaded']['heavy_modules_after_requests'], ['moviepy.editor', 'yt_dlp'])
+        self.assertLess(runs['lazy']['modules_loaded'], runs['preloaded']['modules_loaded'])
+        for run in runs.values():
+            self.assertGreater(run['first_request_seconds']['/healthz'], 0, run['mode'])
+
+if __name__ == '__main__':
+    unittest.main(argv=['first-arg-is-ignored'], exit=False)
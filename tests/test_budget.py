@@ -0,0 +1,142 @@
+import unittest
+import math
+import os
+import sys
+import shutil
+import tempfile
+
+from PIL import Image
+
+# Add project root to sys.path to allow importing budget
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from budget import RenderBudget, ladder, render_within_budget, sample_windows
+from encoders import EncodeStats
+from tests.fixtures import ffmpeg_available, make_video
+
+
+class FakeEncoder:
+    """
+    Stands in for an encoder whose output size is not quite proportional to
+    pixels, the way small frames compress worse, and which advances a fake
+    clock by the time an encode would take.
+    """
+
+    def __init__(self, duration):
+        self.duration = duration
+        self.now = 0.0
+        self.calls = []
+
+    def clock(self):
+        return self.now
+
+    def __call__(self, setting, path, window):
+        self.calls.append((setting, window))
+        seconds = window[1] if window else self.duration
+        pixels = setting.width * setting.height * setting.fps * seconds
+        output_bytes = int(0.05 * pixels * math.log2(setting.max_colors) * (480 / setting.width) ** 0.3)
+        encode_seconds = 0.05 + pixels / 5e6
+        self.now += encode_seconds
+        with open(path, 'wb') as f:
+            f.write(b'\0' * output_bytes)
+        return EncodeStats('fake', encode_seconds, output_bytes)
+
+
+class TestBudget(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.output_path = os.path.join(self.tmp_dir, 'out.gif')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def render(self, budget, duration=10, source_size=(1280, 720)):
+        encoder = FakeEncoder(duration)
+        plan, stats = render_within_budget(encoder, self.output_path, duration, source_size, 12, budget,
+                                           clock=encoder.clock)
+        return plan, stats, encoder
+
+    def test_budget_needs_a_positive_limit(self):
+        with self.assertRaises(ValueError):
+            RenderBudget()
+        with self.assertRaises(ValueError):
+            RenderBudget(max_bytes=0)
+
+    def test_ladder_runs_from_source_quality_down(self):
+        settings = ladder((854, 480), 12)
+        self.assertEqual((settings[0].width, settings[0].height, settings[0].fps, settings[0].max_colors),
+                         (854, 480, 12, 256))
+        self.assertEqual((settings[-1].width, settings[-1].fps, settings[-1].max_colors), (160, 5, 32))
+        self.assertTrue(all(setting.width <= 854 and setting.fps <= 12 for setting in settings))
+
+    def test_sample_windows_spread_over_the_clip(self):
+        self.assertEqual(sample_windows(1.5), [(0.0, 1.5)])
+        windows = sample_windows(30, sample_seconds=3)
+        self.assertEqual(len(windows), 3)
+        self.assertAlmostEqual(sum(length for _, length in windows), 3)
+        self.assertTrue(all(0 <= start and start + length <= 30 for start, length in windows))
+
+    def test_size_budget_is_met_in_at_most_two_passes(self):
+        for max_bytes in (400_000, 1_500_000, 5_000_000):
+            plan, stats, encoder = self.render(RenderBudget(max_bytes=max_bytes))
+
+            self.assertTrue(plan.within_budget)
+            self.assertLessEqual(stats.output_bytes, max_bytes)
+            self.assertEqual(os.path.getsize(self.output_path), stats.output_bytes)
+            self.assertLessEqual(plan.trials, 2)
+            self.assertLessEqual(plan.passes, 2)
+            # Trials only encode the sampled windows
+            full_renders = [setting for setting, window in encoder.calls if window is None]
+            self.assertEqual(len(full_renders), plan.passes)
+            self.assertEqual((full_renders[-1].width, full_renders[-1].fps, full_renders[-1].max_colors),
+                             (plan.width, plan.fps, plan.max_colors))
+            self.assertFalse(os.path.exists(self.output_path + '.trial.gif'))
+
+    def test_larger_budget_buys_more_quality(self):
+        small, _, _ = self.render(RenderBudget(max_bytes=400_000))
+        large, _, _ = self.render(RenderBudget(max_bytes=5_000_000))
+        self.assertLess(small.width * small.height * small.fps, large.width * large.height * large.fps)
+
+    def test_time_budget_counts_the_trials(self):
+        plan, _, encoder = self.render(RenderBudget(max_seconds=3))
+
+        self.assertTrue(plan.within_budget)
+        self.assertEqual(plan.seconds, encoder.now)
+        self.assertLessEqual(plan.seconds, 3)
+
+    def test_impossible_budget_renders_the_cheapest_setting(self):
+        plan, _, _ = self.render(RenderBudget(max_bytes=1000))
+
+        self.assertFalse(plan.within_budget)
+        self.assertEqual((plan.width, plan.fps, plan.max_colors), (160, 5, 32))
+
+    def test_short_clip_keeps_its_trial_render(self):
+        plan, stats, encoder = self.render(RenderBudget(max_bytes=10_000_000), duration=1.5, source_size=(320, 240))
+
+        self.assertEqual(plan.passes, 0)
+        self.assertTrue(all(window == (0.0, 1.5) for _, window in encoder.calls))
+        self.assertEqual(os.path.getsize(self.output_path), stats.output_bytes)
+
+    @unittest.skipUnless(ffmpeg_available(), "ffmpeg is required to render")
+    def test_render_gif_fits_the_budget(self):
+        from gif_generator import TextOverlay, render_gif
+        video_path = make_video(os.path.join(self.tmp_dir, 'clip.mp4'), 4, size=(640, 360), noise=False)
+
+        result = render_gif(video_path, self.output_path, overlays=[TextOverlay('HELLO', font_size=40)], fps=10,
+                            encoder='stream', budget=RenderBudget(max_bytes=250_000))
+
+        self.assertLessEqual(result.output_bytes, 250_000)
+        self.assertEqual(result.fps, result.plan.fps)
+        with Image.open(self.output_path) as gif:
+            self.assertEqual(gif.size, (result.plan.width, result.plan.height))
+        self.assertLess(result.plan.width, 640)
+
+    def test_moviepy_backend_has_no_budget_mode(self):
+        from gif_generator import render_gif
+        with self.assertRaises(ValueError):
+            render_gif(__file__, self.output_path, encoder='moviepy', budget=RenderBudget(max_bytes=1000))
+
+if __name__ == '__main__':
+    unittest.main(argv=['first-arg-is-ignored'], exit=False)
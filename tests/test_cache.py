@@ -0,0 +1,319 @@
+import unittest
+import unittest.mock
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import time
+
+# Add project root to sys.path to allow importing cache
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from cache import CACHE_EVICTIONS, CACHE_LOOKUPS, MetadataCache, ResultCache, SegmentCache, cache_key
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache = ResultCache(self.tmp_dir, max_bytes=250)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def add(self, key, size=100, mtime=None):
+        temp_path = self.cache.temp_path_for(key)
+        with open(temp_path, 'wb') as f:
+            f.write(b'x' * size)
+        path = self.cache.put(key, temp_path)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def test_cache_key_is_order_independent(self):
+        self.assertEqual(cache_key({'a': 1, 'b': [1, 2]}), cache_key({'b': [1, 2], 'a': 1}))
+        self.assertNotEqual(cache_key({'a': 1}), cache_key({'a': 2}))
+
+    def test_hit_and_miss_counters(self):
+        self.assertIsNone(self.cache.get('k1'))
+        path = self.add('k1')
+
+        self.assertEqual(self.cache.get('k1'), path)
+        self.assertEqual(self.cache.path_for('k1'), path)
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertEqual((stats['entries'], stats['bytes']), (1, 100))
+
+    def test_touch_keeps_an_entry_without_counting(self):
+        path = self.add('k1')
+        os.utime(path, (1, 1))
+
+        self.assertTrue(self.cache.touch('k1'))
+        self.assertFalse(self.cache.touch('missing'))
+        self.assertGreater(os.path.getmtime(path), 1)
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (0, 0))
+
+    def test_named_caches_export_their_counts(self):
+        cache = ResultCache(os.path.join(self.tmp_dir, 'named'), max_bytes=150, name='test-results')
+        hits, misses = (CACHE_LOOKUPS.value(cache='test-results', result=result) for result in ('hit', 'miss'))
+        evictions = CACHE_EVICTIONS.value(cache='test-results')
+
+        cache.get('k1')
+        for key in ('k1', 'k2'):
+            path = cache.temp_path_for(key)
+            with open(path, 'wb') as f:
+                f.write(b'x' * 100)
+            cache.put(key, path)
+        cache.get('k2')
+
+        self.assertEqual(CACHE_LOOKUPS.value(cache='test-results', result='hit'), hits + 1)
+        self.assertEqual(CACHE_LOOKUPS.value(cache='test-results', result='miss'), misses + 1)
+        self.assertEqual(CACHE_EVICTIONS.value(cache='test-results'), evictions + 1)
+
+    def test_put_is_atomic_rename(self):
+        temp_path = self.cache.temp_path_for('k1')
+        with open(temp_path, 'wb') as f:
+            f.write(b'data')
+
+        self.cache.put('k1', temp_path)
+
+        self.assertFalse(os.path.exists(temp_path))
+        self.assertEqual(os.listdir(self.tmp_dir), ['k1.gif'])
+
+    def test_least_recently_used_is_evicted(self):
+        now = time.time()
+        self.add('old', mtime=now - 300)
+        self.add('recent', mtime=now - 200)
+        # Reading 'old' makes it the most recently used entry
+        self.cache.get('old')
+
+        self.add('new')
+
+        self.assertIsNotNone(self.cache.get('old'))
+        self.assertIsNotNone(self.cache.get('new'))
+        self.assertIsNone(self.cache.get('recent'))
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_new_entry_survives_even_if_larger_than_quota(self):
+        self.add('small', size=10)
+        path = self.add('huge', size=1000)
+
+        self.assertTrue(os.path.exists(path))
+        self.assertIsNone(self.cache.get('small'))
+
+    def test_scratch_files_are_not_entries(self):
+        with open(self.cache.temp_path_for('pending'), 'wb') as f:
+            f.write(b'x' * 1000)
+
+        self.assertEqual(self.cache.stats()['entries'], 0)
+        self.assertEqual(self.cache.evict(), [])
+
+    def test_formats_of_one_key_share_the_quota(self):
+        cache = ResultCache(self.tmp_dir, max_bytes=250, extensions=('.webp',))
+        for extension in ('.gif', '.webp'):
+            path = cache.temp_path_for('clip', extension)
+            with open(path, 'wb') as f:
+                f.write(b'x' * 100)
+            cache.put('clip', path, extension)
+
+        self.assertTrue(cache.get('clip').endswith('clip.gif'))
+        self.assertTrue(cache.get('clip', '.webp').endswith('clip.webp'))
+        self.assertEqual(cache.stats()['bytes'], 200)
+
+    def test_sweep_expires_idle_entries_and_stale_scratch_files(self):
+        cache = ResultCache(self.tmp_dir, max_bytes=10_000, max_age=3600)
+        self.cache = cache
+        now = time.time()
+        for path in [self.add('idle'), self.add('read')]:
+            os.utime(path, (now - 7200, now - 7200))
+        cache.get('read')
+        stale_scratch = cache.temp_path_for('crashed')
+        live_scratch = cache.temp_path_for('rendering')
+        for path, mtime in ((stale_scratch, now - 600), (live_scratch, now)):
+            with open(path, 'wb') as f:
+                f.write(b'x' * 50)
+            os.utime(path, (mtime, mtime))
+
+        removed = cache.sweep(scratch_max_age=300)
+
+        self.assertEqual(sorted(removed), sorted([(cache.path_for('idle'), 100), (stale_scratch, 50)]))
+        self.assertIsNotNone(cache.get('read'))
+        self.assertTrue(os.path.exists(live_scratch))
+
+class TestSegmentCache(unittest.TestCase):
+
+    fmt = 'bestvideo+bestaudio'
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmp_dir, 'segments')
+        self.cache = SegmentCache(self.cache_dir, max_bytes=1000, max_age=3600)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def add(self, start, end, video_id='abc', size=100):
+        path = os.path.join(self.tmp_dir, f'{video_id}-{start}-{end}.mp4')
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        return self.cache.store(video_id, start, end, self.fmt, path)
+
+    def test_contained_range_is_found(self):
+        self.add(10, 30)
+        self.add(15, 25)
+
+        with self.cache.lookup('abc', 16, 20, self.fmt) as segment:
+            # The smallest segment that covers the range wins
+            self.assertEqual((segment.start, segment.end), (15, 25))
+        with self.cache.lookup('abc', 12, 20, self.fmt) as segment:
+            self.assertEqual((segment.start, segment.end), (10, 30))
+        with self.cache.lookup('abc', 5, 20, self.fmt) as segment:
+            self.assertIsNone(segment)
+        with self.cache.lookup('other', 16, 20, self.fmt) as segment:
+            self.assertIsNone(segment)
+        with self.cache.lookup('abc', 16, 20, 'worstvideo') as segment:
+            self.assertIsNone(segment)
+
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (2, 3))
+
+    def test_store_keeps_source_and_supersedes_contained_entries(self):
+        self.add(12, 14)
+        self.add(20, 22)
+        source = os.path.join(self.tmp_dir, 'wide.mp4')
+        with open(source, 'wb') as f:
+            f.write(b'y' * 100)
+
+        self.cache.store('abc', 10, 21, self.fmt, source)
+
+        self.assertTrue(os.path.exists(source))
+        ranges = sorted((segment.start, segment.end) for segment, _ in self.cache._entries())
+        self.assertEqual(ranges, [(10, 21), (20, 22)])
+
+    def test_copy_overlapping_prefers_largest_overlap(self):
+        self.add(0, 12)
+        self.add(8, 20)
+
+        copy = self.cache.copy_overlapping('abc', 10, 25, self.fmt, self.tmp_dir)
+
+        self.assertEqual((copy.start, copy.end), (8, 20))
+        self.assertEqual(os.path.dirname(copy.path), self.tmp_dir)
+        self.assertIsNone(self.cache.copy_overlapping('abc', 30, 40, self.fmt, self.tmp_dir))
+
+    def test_age_and_quota_eviction(self):
+        stale = self.add(0, 5)
+        old = time.time() - 7200
+        os.utime(stale, (old, old))
+        for start in range(10, 100, 10):
+            self.add(start, start + 5, size=120)
+
+        self.assertFalse(os.path.exists(stale))
+        stats = self.cache.stats()
+        self.assertLessEqual(stats['bytes'], 1000)
+        # The oldest of the fresh entries went first
+        with self.cache.lookup('abc', 10, 15, self.fmt) as segment:
+            self.assertIsNone(segment)
+        with self.cache.lookup('abc', 90, 95, self.fmt) as segment:
+            self.assertIsNotNone(segment)
+
+    def test_entry_is_not_evicted_while_being_read(self):
+        self.add(0, 10)
+        reading = threading.Event()
+        evicted = threading.Event()
+
+        def evict_everything():
+            reading.wait(5)
+            self.cache.max_bytes = 0
+            self.cache.evict()
+            evicted.set()
+
+        evictor = threading.Thread(target=evict_everything)
+        evictor.start()
+        with self.cache.lookup('abc', 2, 4, self.fmt) as segment:
+            reading.set()
+            time.sleep(0.2)
+            self.assertFalse(evicted.is_set())
+            with open(segment.path, 'rb') as f:
+                self.assertEqual(len(f.read()), 100)
+        evictor.join(5)
+
+        self.assertTrue(evicted.is_set())
+        self.assertFalse(os.path.exists(segment.path))
+
+    def test_concurrent_store_and_lookup(self):
+        errors = []
+
+        def worker(n):
+            try:
+                for i in range(20):
+                    self.add(i, i + 1, video_id=f'video{n}', size=10)
+                    with self.cache.lookup(f'video{n}', i, i + 1, self.fmt) as segment:
+                        with open(segment.path, 'rb') as f:
+                            self.assertEqual(f.read(), b'x' * 10)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+
+
+class TestMetadataCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache = MetadataCache(self.tmp_dir, ttl=60)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_entries_are_per_video_and_format(self):
+        self.cache.put('vid', 'mp4', {'duration': 212})
+
+        self.assertEqual(self.cache.get('vid', 'mp4'), {'duration': 212})
+        self.assertIsNone(self.cache.get('vid', 'webm'))
+        self.assertIsNone(self.cache.get('other', 'mp4'))
+        # Another process sharing the directory sees the entry
+        self.assertEqual(MetadataCache(self.tmp_dir).get('vid', 'mp4'), {'duration': 212})
+        self.assertEqual([name for name in os.listdir(self.tmp_dir) if name.endswith('.tmp')], [])
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (1, 2, 1))
+
+    def test_entries_expire_after_ttl_or_expires_at(self):
+        self.cache.put('ttl', 'mp4', {})
+        self.cache.put('urls', 'mp4', {}, expires_at=time.time() + 10)
+        self.cache.put('gone', 'mp4', {}, expires_at=time.time() - 1)
+
+        self.assertIsNone(self.cache.get('gone', 'mp4'))
+        with unittest.mock.patch('cache.time.time', return_value=time.time() + 30):
+            self.assertEqual(self.cache.get('ttl', 'mp4'), {})
+            self.assertIsNone(self.cache.get('urls', 'mp4'))
+        with unittest.mock.patch('cache.time.time', return_value=time.time() + 90):
+            self.assertIsNone(self.cache.get('ttl', 'mp4'))
+        self.assertEqual(os.listdir(self.tmp_dir), [])
+
+    def test_sweep_removes_expired_entries(self):
+        self.cache.put('gone', 'mp4', {}, expires_at=time.time() - 1)
+        self.cache.put('kept', 'mp4', {})
+
+        removed = self.cache.sweep(scratch_max_age=300)
+
+        self.assertEqual(len(removed), 1)
+        self.assertEqual(self.cache.get('kept', 'mp4'), {})
+
+    def test_invalidate(self):
+        self.cache.put('vid', 'mp4', {})
+        self.cache.invalidate('vid', 'mp4')
+        self.cache.invalidate('vid', 'mp4') # Already gone
+
+        self.assertIsNone(self.cache.get('vid', 'mp4'))
+
+if __name__ == '__main__':
+    unittest.main(argv=['first-arg-is-ignored'], exit=False)
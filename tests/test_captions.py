@@ -0,0 +1,53 @@
+import unittest
+import os
+import sys
+
+import numpy as np
+
+# Add project root to sys.path to allow importing captions
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from captions import rasterize_text
+
+
+class TestRasterizeText(unittest.TestCase):
+
+    def setUp(self):
+        rasterize_text.cache_clear()
+
+    def test_text_is_drawn_in_its_color_on_transparency(self):
+        rgba = rasterize_text('HELLO', 'Arial', 32, 'red')
+
+        self.assertEqual(rgba.dtype, np.uint8)
+        self.assertEqual(rgba.shape[2], 4)
+        self.assertGreater(rgba.shape[1], rgba.shape[0]) # Wider than tall
+        ink = rgba[..., 3] == 255
+        self.assertTrue(ink.any())
+        self.assertTrue((rgba[ink][:, :3] == (255, 0, 0)).all())
+        self.assertEqual(rgba[0, 0, 3], 0) # Background is transparent
+        # Cropped to the text: no empty rows above or below it
+        self.assertTrue(rgba[..., 3].any(axis=1)[[0, -1]].all())
+
+    def test_bitmaps_are_cached_by_style(self):
+        first = rasterize_text('HI', 'Arial', 24, 'white')
+        again = rasterize_text('HI', 'Arial', 24, 'white')
+        bigger = rasterize_text('HI', 'Arial', 48, 'white')
+        stroked = rasterize_text('HI', 'Arial', 24, 'white', 'black', 3)
+
+        self.assertIs(first, again)
+        self.assertEqual(rasterize_text.cache_info().hits, 1)
+        self.assertGreater(bigger.shape[0], first.shape[0])
+        self.assertEqual(stroked.shape[:2], (first.shape[0] + 6, first.shape[1] + 6))
+        self.assertTrue((stroked[stroked[..., 3] == 255][:, :3] == 0).all(axis=1).any())
+        # Shared through the cache, so callers cannot draw on it
+        with self.assertRaises(ValueError):
+            first[0, 0] = 0
+
+    def test_multiline_text_is_taller(self):
+        one = rasterize_text('TOP', 'Arial', 24, 'white')
+        two = rasterize_text('TOP\nBOTTOM', 'Arial', 24, 'white')
+        self.assertGreater(two.shape[0], one.shape[0] * 1.5)
+
+if __name__ == '__main__':
+    unittest.main(argv=['first-arg-is-ignored'], exit=False)
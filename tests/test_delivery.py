@@ -0,0 +1,57 @@
+import unittest
+from unittest.mock import patch
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+
+# Add project root to sys.path to allow importing delivery
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from delivery import ContentDigests
+
+
+class TestContentDigests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'abc.gif')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, path, content):
+        with open(path, 'wb') as f:
+            f.write(content)
+
+    def test_each_version_is_read_once(self):
+        self.write(self.path, b'GIF89a')
+        digests = ContentDigests(chunk_size=4)
+
+        first = digests.get(self.path)
+        os.utime(self.path, (1, 1)) # As ResultCache.get does on every read
+        with patch('delivery.open', side_effect=AssertionError('read again')):
+            self.assertEqual(digests.get(self.path), first)
+        self.assertEqual(first, hashlib.sha256(b'GIF89a').hexdigest())
+
+        # Replaced by a rename, as ResultCache.put does
+        replacement = os.path.join(self.tmp_dir, 'new.tmp')
+        self.write(replacement, b'GIF89b')
+        os.replace(replacement, self.path)
+        self.assertEqual(digests.get(self.path), hashlib.sha256(b'GIF89b').hexdigest())
+
+    def test_only_the_most_recent_files_are_remembered(self):
+        digests = ContentDigests(max_entries=2)
+        for name in 'abc':
+            path = os.path.join(self.tmp_dir, name)
+            self.write(path, name.encode())
+            digests.get(path)
+
+        self.assertEqual(len(digests._digests), 2)
+        with self.assertRaises(FileNotFoundError):
+            digests.get(os.path.join(self.tmp_dir, 'missing.gif'))
+
+if __name__ == '__main__':
+    unittest.main(argv=['first-arg-is-ignored'], exit=False)
@@ -0,0 +1,126 @@
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+# Add project root to sys.path to allow importing encoders
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from benchmarks.gif_delta_benchmark import StillBackgroundClip
+from encoders import encode_ffmpeg, encode_moviepy, encode_stream, get_encoder
+from moviepy.editor import VideoClip
+from tests.fixtures import ffmpeg_available
+
+
+def _two_tone_frame(t):
+    """A red ramp for the first second, then a blue ramp."""
+    frame = np.zeros((60, 80, 3), dtype=np.uint8)
+    frame[..., 0 if t < 1 else 2] = np.linspace(0, 255, 80)[None, :]
+    return frame
+
+
+def _mean_error(gif_path, fps):
+    gif = Image.open(gif_path)
+    errors = []
+    for i in range(gif.n_frames):
+        gif.seek(i)
+        decoded = np.asarray(gif.convert('RGB'), dtype=float)
+        errors.append(np.abs(decoded - _two_tone_frame(i / fps)).mean())
+    return sum(errors) / len(errors), gif.n_frames
+
+
+@unittest.skipUnless(ffmpeg_available(), "ffmpeg is required for encoder tests")
+class TestEncoders(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.clip = VideoClip(_two_tone_frame, duration=2)
+
+    def tearDown(self):
+        self.clip.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_ffmpeg_encoder_reports_stats(self):
+        gif_path = os.path.join(self.tmp_dir, 'global.gif')
+
+        stats = encode_ffmpeg(self.clip, gif_path, 10)
+
+        self.assertEqual(stats.encoder, 'ffmpeg')
+        self.assertEqual(stats.output_bytes, os.path.getsize(gif_path))
+        self.assertGreater(stats.seconds, 0)
+        self.assertEqual(Image.open(gif_path).n_frames, 20)
+
+    def test_segment_palettes_follow_content(self):
+        global_path = os.path.join(self.tmp_dir, 'global.gif')
+        segment_path = os.path.join(self.tmp_dir, 'segment.gif')
+
+        encode_ffmpeg(self.clip, global_path, 10, palette='global', dither='none', max_colors=8)
+        encode_ffmpeg(self.clip, segment_path, 10, palette='segment', palette_segment=1.0, dither='none', max_colors=8)
+
+        global_error, global_frames = _mean_error(global_path, 10)
+        segment_error, segment_frames = _mean_error(segment_path, 10)
+        self.assertEqual(segment_frames, global_frames)
+        # Eight colours shared by both halves vs eight per half
+        self.assertLess(segment_error, global_error / 2)
+
+    def test_stream_encoder_windows_palettes(self):
+        gif_path = os.path.join(self.tmp_dir, 'stream.gif')
+
+        stats = encode_stream(self.clip, gif_path, 10, max_colors=8, dither='none', palette_window=10)
+
+        self.assertEqual(stats.encoder, 'stream')
+        self.assertEqual(stats.output_bytes, os.path.getsize(gif_path))
+        error, frames = _mean_error(gif_path, 10)
+        self.assertEqual(frames, 20)
+        # Each one-second window gets its own eight colours, like segment palettes
+        self.assertLess(error, 10)
+        self.assertEqual(Image.open(gif_path).info['duration'], 100)
+
+    def test_stream_encoder_stores_only_changes(self):
+        clip = StillBackgroundClip((120, 90), 2)
+        whole_path = os.path.join(self.tmp_dir, 'whole.gif')
+        delta_path = os.path.join(self.tmp_dir, 'delta.gif')
+
+        whole = encode_stream(clip, whole_path, 10)
+        delta = encode_stream(clip, delta_path, 10, delta_threshold=8)
+
+        # The box rests for the second half, which becomes one long frame
+        gif = Image.open(delta_path)
+        self.assertEqual(gif.n_frames, 11)
+        self.assertLess(delta.output_bytes, whole.output_bytes / 4)
+        durations = []
+        for i, source in enumerate(clip.iter_frames(10)):
+            if i < gif.n_frames:
+                gif.seek(i)
+                decoded = np.asarray(gif.convert('RGB'), dtype=float)
+                durations.append(gif.info['duration'])
+            self.assertLess(np.abs(decoded - source).mean(), 8)
+        self.assertEqual(sum(durations), 2000)
+
+    def test_backends_compare_on_same_input(self):
+        moviepy_stats = encode_moviepy(self.clip, os.path.join(self.tmp_dir, 'moviepy.gif'), 10)
+        ffmpeg_stats = encode_ffmpeg(self.clip, os.path.join(self.tmp_dir, 'ffmpeg.gif'), 10)
+
+        self.assertEqual(moviepy_stats.encoder, 'moviepy')
+        self.assertGreater(moviepy_stats.output_bytes, 0)
+        self.assertGreater(ffmpeg_stats.output_bytes, 0)
+
+    def test_invalid_options(self):
+        with self.assertRaises(ValueError):
+            encode_ffmpeg(self.clip, os.path.join(self.tmp_dir, 'bad.gif'), 10, dither='halftone')
+        with self.assertRaises(ValueError):
+            encode_ffmpeg(self.clip, os.path.join(self.tmp_dir, 'bad.gif'), 10, palette='per-scene')
+        with self.assertRaises(ValueError):
+            encode_stream(self.clip, os.path.join(self.tmp_dir, 'bad.gif'), 10, dither='bayer')
+        with self.assertRaises(ValueError):
+            encode_stream(self.clip, os.path.join(self.tmp_dir, 'bad.gif'), 10, delta_threshold=255)
+        with self.assertRaises(ValueError):
+            get_encoder('gifski')
+
+if __name__ == '__main__':
+    unittest.main(argv=['first-arg-is-ignored'], exit=False)
@@ -0,0 +1,87 @@
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+# Add project root to sys.path to allow importing formats
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from encoders import FfmpegPipe
+from formats import INTERMEDIATE, OUTPUT_FORMATS, TeeStream, get_format, transcode, write_frames
+from frames import FrameStream, decode_frames, probe_video
+from tests.fixtures import ffmpeg_available, make_video
+
+
+@unittest.skipUnless(ffmpeg_available(), "ffmpeg is required for output format tests")
+class TestOutputFormats(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.video_path = make_video(os.path.join(cls.tmp_dir, 'clip.mp4'), 2, size=(160, 120), noise=False)
+        cls.info = probe_video(cls.video_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            get_format('bmp')
+
+    def test_animated_images_loop_with_every_frame(self):
+        for name in ('webp', 'apng'):
+            output_format = get_format(name)
+            path = os.path.join(self.tmp_dir, f'out{output_format.extension}')
+
+            stats = write_frames(FrameStream(self.video_path, self.info), path, 5, output_format)
+
+            self.assertEqual(stats.output_bytes, os.path.getsize(path))
+            with Image.open(path) as image:
+                self.assertEqual((image.size, image.n_frames), ((160, 120), 10), name)
+                self.assertEqual(image.info.get('loop'), 0, name)
+
+    def test_video_loops_are_silent_and_padded_to_even_sizes(self):
+        for name in ('mp4', 'webm'):
+            path = os.path.join(self.tmp_dir, f'out{get_format(name).extension}')
+
+            # An odd size, which 4:2:0 video cannot hold
+            write_frames(FrameStream(self.video_path, self.info, size=(81, 61)), path, 5, get_format(name))
+
+            info = probe_video(path)
+            self.assertEqual((info.width, info.height), (82, 62), name)
+            self.assertAlmostEqual(info.duration, 2, delta=0.3)
+
+    def test_intermediate_is_lossless_and_converts_without_the_source(self):
+        intermediate_path = os.path.join(self.tmp_dir, 'frames.mkv')
+        stream = FrameStream(self.video_path, self.info, size=(80, 60))
+
+        with FfmpegPipe(intermediate_path, stream.size, 5, list(INTERMEDIATE.output_args)) as pipe:
+            frames = [frame.copy() for frame in TeeStream(stream, pipe).iter_frames(fps=5)]
+        kept = list(decode_frames(intermediate_path, 5, (80, 60)))
+
+        self.assertEqual(len(kept), len(frames))
+        for original, copy in zip(frames, kept):
+            np.testing.assert_array_equal(original, copy)
+
+        webp_path = os.path.join(self.tmp_dir, 'converted.webp')
+        stats = transcode(intermediate_path, webp_path, OUTPUT_FORMATS['webp'])
+        self.assertEqual(stats.encoder, 'webp')
+        with Image.open(webp_path) as image:
+            self.assertEqual((image.size, image.n_frames), ((80, 60), 10))
+
+    def test_failed_pipe_leaves_no_partial_file(self):
+        path = os.path.join(self.tmp_dir, 'partial.mp4')
+        with self.assertRaises(RuntimeError):
+            with FfmpegPipe(path, (16, 16), 5, list(get_format('mp4').output_args)) as pipe:
+                pipe.write(np.zeros((16, 16, 3), dtype=np.uint8))
+                raise RuntimeError('render failed')
+        self.assertFalse(os.path.exists(path))
+
+if __name__ == '__main__':
+    unittest.main(argv=['first-arg-is-ignored'], exit=False)
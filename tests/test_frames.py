@@ -0,0 +1,238 @@
+import unittest
+import json
+import os
+import subprocess
+import sys
+import shutil
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+# Add project root to sys.path to allow importing frames
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from frames import (FrameStream, OverlayLayer, composite_batches, composite_frames, decode_batches, decode_frames,
+                    probe_video, resolve_position)
+from gifwriter import FrameDelta, GifWriter, frame_delays
+from tests.fixtures import ffmpeg_available, make_video
+
+# Renders a clip in a fresh interpreter and reports its peak memory
+_PEAK_RSS_SCRIPT = '''
+import json, resource, sys
+sys.path.insert(0, sys.argv[1])
+from gif_generator import render_gif
+result = render_gif(sys.argv[2], sys.argv[3], fps=10, encoder=sys.argv[4])
+print(json.dumps({"python_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  "subprocess_kb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+                  "bytes": result.output_bytes}))
+'''
+
+
+class TestOverlayStage(unittest.TestCase):
+
+    def test_resolve_position_matches_moviepy(self):
+        frame, layer = (200, 100), (50, 20)
+        self.assertEqual(resolve_position(('center', 'bottom'), frame, layer), (75, 80))
+        self.assertEqual(resolve_position('center', frame, layer), (75, 40))
+        self.assertEqual(resolve_position(('right', 'top'), frame, layer), (150, 0))
+        self.assertEqual(resolve_position((10, 15), frame, layer), (10, 15))
+
+    def test_layers_are_blended_only_while_on_screen(self):
+        rgba = np.zeros((2, 4, 4), dtype=np.uint8)
+        rgba[..., 0] = 255
+        rgba[:, :2, 3] = 255 # Opaque left half, transparent right half
+        layer = OverlayLayer(rgba, ('center', 'bottom'), start=0.1, end=0.3)
+        frames = [np.zeros((6, 8, 3), dtype=np.uint8) for _ in range(4)]
+
+        out = list(composite_frames(iter(frames), [layer], fps=10))
+
+        for i in (0, 3):
+            self.assertEqual(out[i].max(), 0)
+        for i in (1, 2):
+            self.assertTrue((out[i][4:6, 2:4, 0] == 255).all())
+            self.assertEqual(out[i][4:6, 4:6].max(), 0)
+            self.assertEqual(out[i][:4].max(), 0)
+
+    def test_batch_blend_matches_alpha_compositing(self):
+        rgba = np.zeros((4, 4, 4), dtype=np.uint8)
+        rgba[..., :3] = 200
+        rgba[..., 3] = [0, 64, 128, 255]
+        layer = OverlayLayer(rgba, (2, 1), start=0.2, end=0.5)
+        batches = [np.full((4, 6, 8, 3), 40, dtype=np.uint8), np.full((4, 6, 8, 3), 40, dtype=np.uint8)]
+
+        out = np.concatenate(list(composite_batches(iter(batches), [layer], fps=10)))
+
+        alpha = rgba[0, :, 3] / 255
+        expected = np.round(200 * alpha + 40 * (1 - alpha))
+        for index in range(8):
+            row = out[index, 2, 2:6, 0]
+            if 2 <= index < 5: # 0.2s <= t < 0.5s, across the batch boundary
+                np.testing.assert_allclose(row, expected, atol=1)
+            else:
+                self.assertTrue((row == 40).all())
+        # Nothing outside the layer is touched
+        self.assertTrue((out[:, :, :2] == 40).all())
+
+    def test_layer_larger_than_frame_is_clipped(self):
+        layer = OverlayLayer(np.full((10, 20, 4), 255, dtype=np.uint8), ('center', 'bottom'), 0, 1)
+        frame, = composite_frames(iter([np.zeros((4, 8, 3), dtype=np.uint8)]), [layer], fps=10)
+        self.assertEqual(frame.min(), 255)
+
+
+class TestGifWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_frames_are_written_incrementally(self):
+        path = os.path.join(self.tmp_dir, 'out.gif')
+        colors = [(255, 0, 0), (0, 255, 0), (0, 0, 255)]
+
+        with GifWriter(path) as writer:
+            for color, delay in zip(colors, frame_delays(12)):
+                frame = Image.new('RGB', (16, 8), color).quantize(colors=4)
+                writer.add_frame(frame, delay)
+            self.assertEqual(writer.frames, 3)
+
+        gif = Image.open(path)
+        self.assertEqual((gif.size, gif.n_frames, gif.info['loop']), ((16, 8), 3, 0))
+        for i, color in enumerate(colors):
+            gif.seek(i)
+            self.assertEqual(gif.convert('RGB').getpixel((3, 3)), color)
+            self.assertEqual(gif.info['duration'], [80, 90, 80][i])
+
+    def test_partial_frames_draw_over_the_canvas(self):
+        path = os.path.join(self.tmp_dir, 'partial.gif')
+
+        with GifWriter(path) as writer:
+            writer.add_frame(Image.new('RGB', (16, 8), (255, 0, 0)).quantize(colors=2), 10)
+            # A 4x4 patch at (8, 2) whose left half is transparent
+            patch = Image.new('P', (4, 4), 0)
+            patch.putpalette([0, 0, 255, 0, 0, 0])
+            patch.paste(1, (0, 0, 2, 4))
+            writer.add_frame(patch, 10, offset=(8, 2), transparency=1)
+            writer.extend_last(20)
+            self.assertEqual(writer.frames, 2)
+
+        gif = Image.open(path)
+        self.assertEqual((gif.size, gif.n_frames), ((16, 8), 2))
+        gif.seek(1)
+        frame = gif.convert('RGB')
+        self.assertEqual(frame.getpixel((1, 1)), (255, 0, 0))
+        self.assertEqual(frame.getpixel((9, 3)), (255, 0, 0))
+        self.assertEqual(frame.getpixel((11, 3)), (0, 0, 255))
+        self.assertEqual(gif.info['duration'], 300)
+
+    def test_nothing_to_extend(self):
+        with GifWriter(os.path.join(self.tmp_dir, 'empty.gif')) as writer:
+            with self.assertRaises(ValueError):
+                writer.extend_last(10)
+
+    def test_frame_delta_finds_changed_box(self):
+        delta = FrameDelta(threshold=8)
+        frame = np.full((10, 20, 3), 100, dtype=np.uint8)
+
+        self.assertEqual(delta.update(frame), ((0, 0, 20, 10), None))
+        # Changes within the threshold do not count
+        self.assertIsNone(delta.update(frame + 5))
+        moved = frame.copy()
+        moved[2:4, 5:8] = 200
+        moved[3, 5] = 100
+        box, unchanged = delta.update(moved)
+        self.assertEqual(box, (5, 2, 8, 4))
+        self.assertEqual(unchanged.tolist(), [[False, False, False], [True, False, False]])
+        self.assertIsNone(delta.update(moved))
+
+    def test_frame_delta_catches_slow_drift(self):
+        delta = FrameDelta(threshold=8)
+        frame = np.full((4, 4, 3), 100, dtype=np.uint8)
+        delta.update(frame)
+
+        # Each step is within the threshold, but they add up
+        changes = [delta.update(frame + step) for step in (4, 8, 12)]
+        self.assertEqual(changes[:2], [None, None])
+        self.assertEqual(changes[2], ((0, 0, 4, 4), None))
+
+    def test_frame_delays_do_not_drift(self):
+        delays = frame_delays(12)
+        self.assertEqual(sum(next(delays) for _ in range(120)), 1000)
+
+
+@unittest.skipUnless(ffmpeg_available(), "ffmpeg is required for decoder tests")
+class TestStreamingPipeline(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.video_path = make_video(os.path.join(cls.tmp_dir, 'clip.mp4'), 2, size=(160, 120))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def test_decoder_resamples_and_scales(self):
+        info = probe_video(self.video_path)
+        self.assertEqual((info.width, info.height), (160, 120))
+        self.assertAlmostEqual(info.duration, 2, delta=0.1)
+
+        frames = list(decode_frames(self.video_path, 5, (80, 60)))
+
+        self.assertEqual(len(frames), 10)
+        self.assertEqual(frames[0].shape, (60, 80, 3))
+        self.assertTrue(frames[0].flags.writeable)
+
+    def test_decoder_batches_frames(self):
+        batches = list(decode_batches(self.video_path, 5, (80, 60), batch_size=4))
+        self.assertEqual([len(batch) for batch in batches], [4, 4, 2])
+
+    def test_closing_early_stops_the_decoder(self):
+        frames = decode_frames(self.video_path, 25, (160, 120))
+        next(frames)
+        frames.close() # Must not hang or raise
+
+    def test_stream_is_replayable(self):
+        stream = FrameStream(self.video_path, probe_video(self.video_path))
+        first = [frame.mean() for frame in stream.iter_frames(fps=5)]
+        second = [frame.mean() for frame in stream.iter_frames(fps=5)]
+        self.assertEqual(first, second)
+        self.assertEqual(stream.size, (160, 120))
+
+    def test_stream_window_keeps_layer_times_absolute(self):
+        layer = OverlayLayer(np.full((4, 4, 4), 255, dtype=np.uint8), (0, 0), start=1.2, end=1.4)
+        stream = FrameStream(self.video_path, probe_video(self.video_path), size=(80, 60), layers=[layer],
+                             start=1.0, duration=0.5)
+
+        frames = list(stream.iter_frames(fps=10))
+
+        self.assertEqual(stream.duration, 0.5)
+        self.assertEqual(len(frames), 5)
+        self.assertEqual([bool((frame[:4, :4] == 255).all()) for frame in frames], [False, False, True, True, False])
+
+    def _peak_rss(self, video_path, encoder):
+        output = subprocess.run(
+            [sys.executable, '-c', _PEAK_RSS_SCRIPT, project_root, video_path,
+             os.path.join(self.tmp_dir, f'{encoder}.gif'), encoder],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        return json.loads(output.strip().splitlines()[-1])
+
+    def test_peak_memory_does_not_grow_with_duration(self):
+        short_path = make_video(os.path.join(self.tmp_dir, 'short.mp4'), 3, size=(640, 360), keyframe_interval=250)
+        long_path = make_video(os.path.join(self.tmp_dir, 'long.mp4'), 30, size=(640, 360), keyframe_interval=250)
+
+        short = self._peak_rss(short_path, 'stream')
+        long = self._peak_rss(long_path, 'stream')
+
+        # Ten times the frames; a frame is 675 KiB, so buffering them would
+        # add well over 100 MiB
+        self.assertGreater(long['bytes'], short['bytes'] * 5)
+        self.assertLess(long['python_kb'] - short['python_kb'], 20 * 1024)
+        self.assertLess(long['subprocess_kb'] - short['subprocess_kb'], 20 * 1024)
+
+if __name__ == '__main__':
+    unittest.main(argv=['first-arg-is-ignored'], exit=False)
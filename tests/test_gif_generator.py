@@ -1,19 +1,34 @@
 import unittest
 from unittest.mock import patch, MagicMock, mock_open
 import os
+import shutil
+import subprocess
 import sys
+import tempfile
+import threading
+
+import numpy as np
+from PIL import Image
 
 # Add project root to sys.path to allow importing gif_generator
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.insert(0, project_root)
 
-from gif_generator import download_video_segment, convert_to_gif, add_text_overlay
+from gif_generator import (download_video_segment, convert_to_gif, add_text_overlay, render_gif, create_gif,
+                           create_gifs, merge_ranges, normalize_video_id, render_cache_key, Clip, PreviewSettings,
+                           RenderResult, TextOverlay, TimeRangeError, VIDEO_FORMAT, _fit_size)
+from cache import MetadataCache, ResultCache, SegmentCache
+from encoders import ENCODER_VERSION
+from frames import probe_video
+from metrics import tracing
+from renderpool import RenderPool
 from yt_dlp.utils import DownloadError # For testing exception handling
+from tests.fixtures import FFMPEG_BINARY, LocalExtractor, RangeHTTPServer, ffmpeg_available, make_video
 # from moviepy.editor import VideoClip # Base for mocking moviepy clips, not strictly needed if using MagicMock with spec
 # For spec, we can use the actual classes if they are imported or use strings
 # For simplicity, MagicMock without spec or with spec=True can also work well.
 # Let's use spec with the actual classes for better type checking in mocks.
-from moviepy.editor import VideoFileClip as MoviePyVideoFileClip, TextClip as MoviePyTextClip, CompositeVideoClip as MoviePyCompositeVideoClip
+from moviepy.editor import VideoFileClip as MoviePyVideoFileClip
 
 
 class TestGifGenerator(unittest.TestCase):
@@ -41,59 +56,113 @@ class TestGifGenerator(unittest.TestCase):
             for f in os.listdir(self.test_gif_output_dir): os.remove(os.path.join(self.test_gif_output_dir, f))
             os.rmdir(self.test_gif_output_dir)
 
-    @patch('gif_generator.os.path.exists', return_value=True) # Assume downloaded file exists for find logic
-    @patch('gif_generator.os.listdir')
+    @patch('gif_generator.subprocess.run')
     @patch('gif_generator.yt_dlp.YoutubeDL')
     @patch('gif_generator.os.makedirs') # Keep this to assert it's called for output_dir
-    def test_download_video_segment_success(self, mock_os_makedirs_main, mock_youtube_dl, mock_os_listdir, mock_os_path_exists):
+    def test_download_video_segment_success(self, mock_os_makedirs_main, mock_youtube_dl, mock_subprocess_run):
         mock_ydl_instance = MagicMock()
         mock_youtube_dl.return_value.__enter__.return_value = mock_ydl_instance
-        
+
+        def fake_ffmpeg(cmd, **kwargs):
+            with open(cmd[-1], 'wb') as f:
+                f.write(b'segment')
+            return MagicMock(returncode=0, stderr='')
+        mock_subprocess_run.side_effect = fake_ffmpeg
+
         youtube_url = 'fake_url'
         start_time = 10
         end_time = 20
-        
-        # Simulate extract_info returning a dictionary that ydl.prepare_filename would use
-        # The critical part is that after download, the file is found by os.listdir
-        # and matches the naming pattern.
+
+        # Merged bestvideo+bestaudio formats expose one URL per stream
         mock_info_dict = {
             'id': 'test_id',
             'title': 'test_title',
-            'ext': 'mp4', # Original extension
-            # 'requested_downloads': [{'filepath': expected_filepath}] # Not used by current code
+            'ext': 'webm',
+            'requested_formats': [
+                {'url': 'https://example.com/video', 'http_headers': {'User-Agent': 'test-agent'}},
+                {'url': 'https://example.com/audio'},
+            ],
         }
         mock_ydl_instance.extract_info.return_value = mock_info_dict
-        
-        # This is what prepare_filename would roughly produce before post-processing changes ext to mp4
-        # The code looks for files starting with this base and ending in .mp4
-        # Example: 'test_temp_output_videos/test_id_test_title.mp4'
-        expected_base_filename_part = f"{mock_info_dict['id']}_{mock_info_dict['title']}"
-        expected_processed_filename = f"{expected_base_filename_part}.mp4" # After post-processing
-        expected_filepath = os.path.join(self.test_output_dir, expected_processed_filename)
-
-        # Mock os.listdir to return the processed file name
-        mock_os_listdir.return_value = [expected_processed_filename]
-        # Mock ydl.prepare_filename to assist the file search logic
-        mock_ydl_instance.prepare_filename.return_value = os.path.join(self.test_output_dir, f"{expected_base_filename_part}.{mock_info_dict['ext']}")
-
+        mock_ydl_instance.prepare_filename.side_effect = \
+            lambda info: mock_youtube_dl.call_args[0][0]['outtmpl'].replace('%(id)s_%(title)s.%(ext)s', 'test_id_test_title.webm')
 
         result_path = download_video_segment(youtube_url, start_time, end_time, output_dir=self.test_output_dir)
 
         mock_os_makedirs_main.assert_called_with(self.test_output_dir, exist_ok=True)
-        mock_youtube_dl.assert_called_once() 
-        
+        mock_youtube_dl.assert_called_once()
+
         args, kwargs = mock_youtube_dl.call_args
         ydl_opts = args[0]
-        self.assertIn('postprocessor_args', ydl_opts)
-        # Check for specific postprocessor arguments
-        self.assertTrue(any(arg == str(start_time) for sublist in ydl_opts['postprocessor_args'] for arg in sublist if isinstance(sublist, list) and sublist[0] == '-ss'))
-        self.assertTrue(any(arg == str(end_time) for sublist in ydl_opts['postprocessor_args'] for arg in sublist if isinstance(sublist, list) and sublist[0] == '-to'))
-        self.assertIn(f'{self.test_output_dir}/%(id)s_%(title)s.%(ext)s', ydl_opts['outtmpl'])
-
-        mock_ydl_instance.extract_info.assert_called_once_with(youtube_url, download=True)
-        mock_os_listdir.assert_called_with(self.test_output_dir) # Verify it lists the correct directory
-        self.assertEqual(result_path, expected_filepath)
+        # yt-dlp names the file inside this call's own scratch directory
+        work_dir = os.path.dirname(ydl_opts['outtmpl'])
+        self.assertEqual(os.path.dirname(work_dir), self.test_output_dir)
+        self.assertTrue(ydl_opts['outtmpl'].endswith('/%(id)s_%(title)s.%(ext)s'))
+        # Nothing is downloaded or post-processed by yt-dlp itself
+        self.assertNotIn('postprocessors', ydl_opts)
+        mock_ydl_instance.extract_info.assert_called_once_with(youtube_url, download=False)
+
+        cmd = mock_subprocess_run.call_args[0][0]
+        # Both streams are seeked to the start time as input options
+        self.assertEqual(cmd.count('-ss'), 2)
+        self.assertEqual(cmd[cmd.index('-i') - 1], str(start_time))
+        self.assertIn('https://example.com/video', cmd)
+        self.assertIn('https://example.com/audio', cmd)
+        self.assertIn('User-Agent: test-agent\r\n', cmd)
+        self.assertEqual(cmd[cmd.index('-t') + 1], str(end_time - start_time))
+        self.assertEqual(cmd[-1], os.path.join(work_dir, 'test_id_test_title.mp4'))
+
+        # The finished file is renamed out of the scratch directory, which is removed
+        self.assertEqual(os.path.dirname(result_path), self.test_output_dir)
+        self.assertRegex(os.path.basename(result_path), r'^test_id_test_title\.[0-9a-f]{12}\.mp4$')
+        self.assertEqual(os.listdir(self.test_output_dir), [os.path.basename(result_path)])
+
+    @patch('gif_generator.limit_edit_list')
+    @patch('gif_generator.subprocess.run')
+    @patch('gif_generator.yt_dlp.YoutubeDL')
+    def test_copy_cut_fetches_only_the_video_stream(self, mock_youtube_dl, mock_subprocess_run, mock_limit):
+        mock_ydl_instance = MagicMock()
+        mock_youtube_dl.return_value.__enter__.return_value = mock_ydl_instance
+        mock_ydl_instance.extract_info.return_value = {
+            'id': 'test_id', 'title': 'test_title', 'ext': 'mp4',
+            'requested_formats': [{'url': 'https://example.com/video'}, {'url': 'https://example.com/audio'}],
+        }
+        mock_ydl_instance.prepare_filename.return_value = os.path.join(self.test_output_dir, 'test_id_test_title.mp4')
+
+        def fake_ffmpeg(cmd, **kwargs):
+            with open(cmd[-1], 'wb') as f:
+                f.write(b'segment')
+            return MagicMock(returncode=0, stderr='')
+        mock_subprocess_run.side_effect = fake_ffmpeg
+
+        download_video_segment('fake_url', 10, 12.5, output_dir=self.test_output_dir, cut_mode='copy')
+
+        cmd = mock_subprocess_run.call_args[0][0]
+        self.assertEqual(cmd.count('-i'), 1)
+        self.assertNotIn('https://example.com/audio', cmd)
+        self.assertEqual(cmd[cmd.index('-c:v') + 1], 'copy')
+        self.assertIn('-an', cmd)
+        self.assertNotIn('-avoid_negative_ts', cmd)
+        # The end of the cut is made exact on the file ffmpeg wrote
+        self.assertEqual(mock_limit.call_args[0], (cmd[-1], 2.5))
+
+    def test_unknown_cut_mode(self):
+        with self.assertRaises(ValueError):
+            download_video_segment('fake_url', 0, 10, output_dir=self.test_output_dir, cut_mode='remux')
+
+    @patch('gif_generator.subprocess.run')
+    @patch('gif_generator.yt_dlp.YoutubeDL')
+    def test_download_video_segment_ffmpeg_failure(self, mock_youtube_dl, mock_subprocess_run):
+        mock_ydl_instance = MagicMock()
+        mock_youtube_dl.return_value.__enter__.return_value = mock_ydl_instance
+        mock_ydl_instance.extract_info.return_value = {'id': 'test_id', 'url': 'https://example.com/video.mp4'}
+        mock_ydl_instance.prepare_filename.return_value = os.path.join(self.test_output_dir, "test_id.mp4")
+        mock_subprocess_run.return_value = MagicMock(returncode=1, stderr='Server returned 403 Forbidden')
 
+        with self.assertRaises(DownloadError):
+            download_video_segment('fake_url', 0, 10, output_dir=self.test_output_dir)
+        # The scratch directory is cleaned up on failure too
+        self.assertEqual(os.listdir(self.test_output_dir), [])
 
     @patch('gif_generator.yt_dlp.YoutubeDL')
     @patch('gif_generator.os.makedirs')
@@ -137,28 +206,29 @@ class TestGifGenerator(unittest.TestCase):
         mock_clip_instance.close.assert_called_once() # Ensure clip is closed
         self.assertEqual(result_path, gif_path)
 
+    def caption_filter(self, mock_clip):
+        """The frame filter render_gif installed on ``mock_clip`` with fl()."""
+        mock_clip.fl.assert_called_once()
+        caption = mock_clip.fl.call_args[0][0]
+        frame = np.zeros((40, 80, 3), dtype=np.uint8)
+        frame.flags.writeable = False # Like frames straight from the decoder
+        return lambda t: caption(lambda _: frame, t)
+
     @patch('gif_generator.os.path.exists', return_value=True)
-    @patch('gif_generator.CompositeVideoClip') # Target CompositeVideoClip where it's used
-    @patch('gif_generator.TextClip')      # Target TextClip where it's used
+    @patch('gif_generator.rasterize_text')   # Target rasterize_text where it's used
     @patch('gif_generator.VideoFileClip') # Target VideoFileClip where it's used
     @patch('gif_generator.os.makedirs')
-    def test_add_text_overlay_success(self, mock_os_makedirs_overlay, mock_video_file_clip_constructor, 
-                                    mock_text_clip_constructor, mock_composite_video_clip_constructor, mock_path_exists_overlay):
+    def test_add_text_overlay_success(self, mock_os_makedirs_overlay, mock_video_file_clip_constructor,
+                                    mock_rasterize_text, mock_path_exists_overlay):
         
         mock_input_gif_clip = MagicMock(spec=MoviePyVideoFileClip)
         mock_input_gif_clip.duration = 10.0
         mock_input_gif_clip.fps = 10
         mock_video_file_clip_constructor.return_value = mock_input_gif_clip # Corrected: not a context manager
 
-        mock_text_clip_instance = MagicMock(spec=MoviePyTextClip)
-        # Simulate chaining of set_ methods by returning the mock_text_clip_instance itself
-        mock_text_clip_instance.set_position.return_value = mock_text_clip_instance
-        mock_text_clip_instance.set_start.return_value = mock_text_clip_instance
-        mock_text_clip_instance.set_duration.return_value = mock_text_clip_instance
-        mock_text_clip_constructor.return_value = mock_text_clip_instance
-
-        mock_final_composite_clip = MagicMock(spec=MoviePyCompositeVideoClip)
-        mock_composite_video_clip_constructor.return_value = mock_final_composite_clip
+        # A solid white 20x10 caption
+        mock_rasterize_text.return_value = np.full((10, 20, 4), 255, dtype=np.uint8)
+        mock_final_clip = mock_input_gif_clip.fl.return_value
         
         input_gif_path = os.path.join(self.test_gif_output_dir, "input.gif")
         output_gif_path = os.path.join(self.test_gif_output_dir, "output_with_text.gif")
@@ -180,58 +250,611 @@ class TestGifGenerator(unittest.TestCase):
         mock_os_makedirs_overlay.assert_any_call(os.path.dirname(output_gif_path), exist_ok=True)
 
         mock_video_file_clip_constructor.assert_called_with(input_gif_path)
-        mock_text_clip_constructor.assert_called_with(text, fontsize=font_size, color=font_color, font=font)
-        
-        mock_text_clip_instance.set_position.assert_called_with(position)
-        mock_text_clip_instance.set_start.assert_called_with(text_start_time)
-        mock_text_clip_instance.set_duration.assert_called_with(duration_on_screen)
-        
-        mock_composite_video_clip_constructor.assert_called_with([mock_input_gif_clip, mock_text_clip_instance])
-        mock_final_composite_clip.write_gif.assert_called_with(output_gif_path, fps=mock_input_gif_clip.fps)
+        mock_rasterize_text.assert_called_once_with(text, font, font_size, font_color, None, 0)
+
+        # Drawn at the top centre from 1s until 6s
+        caption = self.caption_filter(mock_input_gif_clip)
+        self.assertEqual(caption(0.9).max(), 0)
+        frame = caption(1.0)
+        self.assertTrue((frame[0:10, 30:50] == 255).all())
+        self.assertEqual(frame[10:].max(), 0)
+        self.assertEqual(caption(5.9).max(), 255)
+        self.assertEqual(caption(6.0).max(), 0)
+
+        mock_final_clip.write_gif.assert_called_with(output_gif_path, fps=mock_input_gif_clip.fps)
         
         # Assert all clips are closed
         mock_input_gif_clip.close.assert_called_once()
-        mock_text_clip_instance.close.assert_called_once() # TextClip also needs close if it holds resources
-        mock_final_composite_clip.close.assert_called_once()
+        mock_final_clip.close.assert_called_once()
 
         self.assertEqual(result, output_gif_path)
 
     @patch('gif_generator.os.path.exists', return_value=True)
-    @patch('gif_generator.CompositeVideoClip')
-    @patch('gif_generator.TextClip')
+    @patch('gif_generator.rasterize_text')
     @patch('gif_generator.VideoFileClip')
     @patch('gif_generator.os.makedirs')
     def test_add_text_overlay_text_until_end(self, mock_os_makedirs_overlay_end, mock_video_file_clip_constructor_end, 
-                                           mock_text_clip_constructor_end, mock_composite_video_clip_constructor_end, mock_path_exists_overlay_end):
+                                           mock_rasterize_text_end, mock_path_exists_overlay_end):
         mock_input_gif_clip = MagicMock(spec=MoviePyVideoFileClip)
         mock_input_gif_clip.duration = 8.0
         mock_input_gif_clip.fps = 12
         mock_video_file_clip_constructor_end.return_value = mock_input_gif_clip
-
-        mock_text_clip_instance = MagicMock(spec=MoviePyTextClip)
-        mock_text_clip_instance.set_position.return_value = mock_text_clip_instance
-        mock_text_clip_instance.set_start.return_value = mock_text_clip_instance
-        mock_text_clip_instance.set_duration.return_value = mock_text_clip_instance
-        mock_text_clip_constructor_end.return_value = mock_text_clip_instance
-        
-        mock_final_composite_clip = MagicMock(spec=MoviePyCompositeVideoClip)
-        mock_composite_video_clip_constructor_end.return_value = mock_final_composite_clip
+        mock_rasterize_text_end.return_value = np.full((10, 20, 4), 255, dtype=np.uint8)
+        mock_final_clip = mock_input_gif_clip.fl.return_value
 
         input_gif_path = os.path.join(self.test_gif_output_dir, "input_end.gif")
         output_gif_path = os.path.join(self.test_gif_output_dir, "output_text_end.gif")
         text = "UNTIL END"
         text_start_time = 2.0
-        
-        expected_text_duration = mock_input_gif_clip.duration - text_start_time
 
         # mock_path_exists_overlay_end.return_value = True # Handled by decorator
 
         result = add_text_overlay(input_gif_path, output_gif_path, text, text_start_time, duration_on_screen=-1)
 
-        mock_text_clip_instance.set_duration.assert_called_with(expected_text_duration)
-        mock_final_composite_clip.write_gif.assert_called_with(output_gif_path, fps=mock_input_gif_clip.fps)
+        # On screen from the start time until the last frame
+        caption = self.caption_filter(mock_input_gif_clip)
+        self.assertEqual(caption(1.9).max(), 0)
+        self.assertEqual(caption(2.0).max(), 255)
+        self.assertEqual(caption(7.99).max(), 255)
+        mock_final_clip.write_gif.assert_called_with(output_gif_path, fps=mock_input_gif_clip.fps)
         self.assertEqual(result, output_gif_path)
 
+    @patch('gif_generator.os.path.exists', return_value=True)
+    @patch('gif_generator.rasterize_text')
+    @patch('gif_generator.VideoFileClip')
+    @patch('gif_generator.os.makedirs')
+    def test_render_gif_single_pass(self, mock_os_makedirs_render, mock_video_file_clip_constructor,
+                                    mock_rasterize_text, mock_path_exists_render):
+        mock_source_clip = MagicMock(spec=MoviePyVideoFileClip)
+        mock_source_clip.duration = 6.0
+        mock_source_clip.fps = 30
+        mock_video_file_clip_constructor.return_value = mock_source_clip
+        mock_rasterize_text.return_value = np.full((10, 20, 4), 255, dtype=np.uint8)
+        mock_final_clip = mock_source_clip.fl.return_value
+
+        video_path = os.path.join(self.test_output_dir, "source.mp4")
+        output_gif_path = os.path.join(self.test_gif_output_dir, "rendered.gif")
+        overlays = [TextOverlay("TOP", start_time=0, position=('center', 'top')),
+                    TextOverlay("TOO LATE", start_time=7.0)] # Starts after the clip ends, so it is dropped
+
+        result = render_gif(video_path, output_gif_path, overlays=overlays, fps=10)
+
+        # The source is decoded once and nothing but the final GIF is written
+        mock_video_file_clip_constructor.assert_called_once_with(video_path)
+        mock_rasterize_text.assert_called_once_with("TOP", 'Arial', 24, 'white', None, 0)
+        self.assertEqual(self.caption_filter(mock_source_clip)(5.9).max(), 255)
+        mock_final_clip.write_gif.assert_called_once_with(output_gif_path, fps=10)
+        mock_source_clip.write_gif.assert_not_called()
+
+        mock_source_clip.close.assert_called_once()
+        mock_final_clip.close.assert_called_once()
+
+        self.assertEqual(result.path, output_gif_path)
+        self.assertEqual(result.fps, 10)
+
+
+class TestRenderCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache = ResultCache(self.tmp_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_normalize_video_id(self):
+        for url in ['https://www.youtube.com/watch?v=dQw4w9WgXcQ',
+                    'https://youtube.com/watch?feature=share&v=dQw4w9WgXcQ&t=10s',
+                    'https://youtu.be/dQw4w9WgXcQ?si=abc',
+                    'https://www.youtube.com/shorts/dQw4w9WgXcQ',
+                    'https://www.youtube.com/embed/dQw4w9WgXcQ']:
+            self.assertEqual(normalize_video_id(url), 'dQw4w9WgXcQ')
+        self.assertEqual(normalize_video_id(' https://example.com/clip.mp4 '), 'https://example.com/clip.mp4')
+
+    def test_merge_ranges(self):
+        self.assertEqual(merge_ranges([(40, 42), (5, 7), (6, 9), (12, 13)], gap=5), [(5, 13), (40, 42)])
+        self.assertEqual(merge_ranges([(0, 2), (7, 8)], gap=5), [(0, 2), (7, 8)])
+        self.assertEqual(merge_ranges([]), [])
+
+    def test_render_cache_key(self):
+        key = render_cache_key('https://youtu.be/dQw4w9WgXcQ', 10, 13, [TextOverlay('HI', 1.0)])
+
+        self.assertEqual(key, render_cache_key('https://www.youtube.com/watch?v=dQw4w9WgXcQ', 10.0, 13, [TextOverlay('HI', 1.0)]))
+        self.assertNotEqual(key, render_cache_key('https://youtu.be/dQw4w9WgXcQ', 10, 13, [TextOverlay('HI', 1.5)]))
+        self.assertNotEqual(key, render_cache_key('https://youtu.be/dQw4w9WgXcQ', 10, 13, [TextOverlay('HI', 1.0, font_size=30)]))
+        self.assertNotEqual(key, render_cache_key('https://youtu.be/dQw4w9WgXcQ', 10, 13, [TextOverlay('HI', 1.0)], encoder='ffmpeg'))
+        with patch('gif_generator.ENCODER_VERSION', ENCODER_VERSION + 1):
+            self.assertNotEqual(key, render_cache_key('https://youtu.be/dQw4w9WgXcQ', 10, 13, [TextOverlay('HI', 1.0)]))
+        self.assertNotEqual(key, render_cache_key('https://youtu.be/dQw4w9WgXcQ', 10, 13, [TextOverlay('HI', 1.0)],
+                                                  max_width=480))
+
+    def test_fit_size(self):
+        self.assertEqual(_fit_size(1920, 1080, 480), (480, 270))
+        self.assertEqual(_fit_size(1920, 1080, 480, 200), (356, 200))
+        self.assertEqual(_fit_size(1080, 1920, max_height=640), (360, 640))
+        # Never scaled up
+        self.assertEqual(_fit_size(320, 240, 640, 480), (320, 240))
+        self.assertEqual(_fit_size(320, 240), (320, 240))
+
+    @patch('gif_generator.render_gif')
+    @patch('gif_generator.download_video_segment')
+    def test_create_gif_cache_hit_does_no_work(self, mock_download, mock_render):
+        def fake_download(youtube_url, start_time, end_time, output_dir, **kwargs):
+            path = os.path.join(output_dir, 'segment.mp4')
+            open(path, 'wb').close()
+            return path
+
+        def fake_render(video_path, output_path, **kwargs):
+            with open(output_path, 'wb') as f:
+                f.write(b'GIF89a')
+            return RenderResult(path=output_path, fps=10, duration=3, encoder='moviepy', encode_seconds=0.1, output_bytes=6)
+
+        mock_download.side_effect = fake_download
+        mock_render.side_effect = fake_render
+        overlays = [TextOverlay('HI', 1.0)]
+
+        first = create_gif('https://youtu.be/dQw4w9WgXcQ', 10, 13, self.tmp_dir, overlays, temp_dir=self.tmp_dir, cache=self.cache)
+        second = create_gif('https://youtu.be/dQw4w9WgXcQ', 10, 13, self.tmp_dir, overlays, temp_dir=self.tmp_dir, cache=self.cache)
+
+        self.assertFalse(first.cached)
+        self.assertTrue(second.cached)
+        self.assertEqual(first.path, second.path)
+        self.assertEqual(second.output_bytes, 6)
+        mock_download.assert_called_once()
+        mock_render.assert_called_once()
+        # Only the cached GIF is left behind: no segment, no scratch file
+        self.assertEqual(os.listdir(self.tmp_dir), [os.path.basename(first.path)])
+
+    @patch('gif_generator.render_gif', side_effect=OSError('encoder crashed'))
+    @patch('gif_generator.download_video_segment')
+    def test_create_gif_failure_is_not_cached(self, mock_download, mock_render):
+        segment_path = os.path.join(self.tmp_dir, 'segment.mp4')
+        mock_download.side_effect = lambda *args, **kwargs: open(segment_path, 'wb').close() or segment_path
+
+        with self.assertRaises(OSError):
+            create_gif('https://youtu.be/dQw4w9WgXcQ', 10, 13, self.tmp_dir, temp_dir=self.tmp_dir, cache=self.cache)
+
+        self.assertEqual(os.listdir(self.tmp_dir), [])
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+
+@unittest.skipUnless(ffmpeg_available(), "ffmpeg is required for streaming render tests")
+class TestStreamingRender(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.video_path = make_video(os.path.join(self.tmp_dir, 'clip.mp4'), 2, size=(160, 120), noise=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    @patch('gif_generator.rasterize_text')
+    def test_caption_is_rasterized_once_and_blended_per_frame(self, mock_rasterize_text):
+        # A solid 40x10 magenta caption
+        mock_rasterize_text.return_value = np.tile(np.array([255, 0, 255, 255], dtype=np.uint8), (10, 40, 1))
+        output_path = os.path.join(self.tmp_dir, 'captioned.gif')
+
+        result = render_gif(self.video_path, output_path, overlays=[TextOverlay('HI', start_time=1.0)],
+                            fps=5, encoder='stream')
+
+        mock_rasterize_text.assert_called_once_with('HI', 'Arial', 24, 'white', None, 0)
+        self.assertEqual((result.encoder, result.fps), ('stream', 5))
+        gif = Image.open(output_path)
+        self.assertEqual(gif.n_frames, 10)
+        for index, captioned in ((0, False), (4, False), (5, True), (9, True)):
+            gif.seek(index)
+            # Bottom centre, where ('center', 'bottom') puts the caption
+            pixel = gif.convert('RGB').getpixel((80, 115))
+            self.assertEqual(pixel[0] > 200 and pixel[1] < 60 and pixel[2] > 200, captioned, (index, pixel))
+
+    def test_size_limits_scale_frames_in_the_decoder(self):
+        output_path = os.path.join(self.tmp_dir, 'small.gif')
+
+        result = render_gif(self.video_path, output_path, overlays=[TextOverlay('HI', start_time=1.0)], fps=5,
+                            encoder='stream', max_width=80)
+
+        self.assertEqual(result.fps, 5)
+        with Image.open(output_path) as gif:
+            self.assertEqual((gif.size, gif.n_frames), ((80, 60), 10))
+        # The moviepy backend scales in its reader
+        convert_to_gif(self.video_path, output_path, fps=5, max_width=400, max_height=30)
+        with Image.open(output_path) as gif:
+            self.assertEqual(gif.size, (40, 30))
+
+    def test_render_stages_are_traced_across_the_render_pool(self):
+        output_path = os.path.join(self.tmp_dir, 'traced.gif')
+        pool = RenderPool(max_workers=1, start_method='fork')
+
+        with tracing() as trace:
+            with patch('gif_generator.download_video_segment', return_value=self.video_path):
+                result = create_gif('https://youtu.be/dQw4w9WgXcQ', 0, 2, self.tmp_dir,
+                                    overlays=[TextOverlay('HI', start_time=1.0)], fps=5, encoder='stream',
+                                    render_pool=pool)
+
+        self.assertEqual(set(trace.stages), {'captions', 'composite', 'encode'})
+        self.assertEqual(trace.stages['encode']['bytes'], result.output_bytes)
+        # One blend per batch of frames that has the caption on screen
+        self.assertGreaterEqual(trace.stages['composite']['calls'], 1)
+        self.assertLess(trace.stages['composite']['seconds'], trace.stages['encode']['seconds'])
+
+    def test_preview_is_small_short_and_coarse(self):
+        output_path = os.path.join(self.tmp_dir, 'preview.gif')
+        preview = PreviewSettings(width=80, fps=10, max_frames=8, max_colors=16)
+
+        # The moviepy backend cannot scale, so previews go through the stream encoder
+        result = render_gif(self.video_path, output_path, overlays=[TextOverlay('HI', start_time=1.0)], fps=10,
+                            encoder='moviepy', preview=preview)
+
+        self.assertEqual((result.encoder, result.fps), ('stream', 4))
+        with Image.open(output_path) as gif:
+            self.assertEqual((gif.size, gif.n_frames), ((80, 60), 8))
+            self.assertLessEqual(len(gif.getpalette()) // 3, 16)
+        with self.assertRaises(ValueError):
+            render_gif(self.video_path, output_path, output_format='webp', preview=preview)
+
+    def test_other_formats_are_converted_from_the_intermediate(self):
+        gif_cache = ResultCache(os.path.join(self.tmp_dir, 'gifs'), extensions=('.webp', '.mp4'))
+        intermediate_cache = ResultCache(os.path.join(self.tmp_dir, 'intermediates'), extension='.mkv')
+        temp_dir = os.path.join(self.tmp_dir, 'temp')
+
+        def local_download(youtube_url, start_time, end_time, output_dir, **kwargs):
+            os.makedirs(output_dir, exist_ok=True)
+            return shutil.copy(self.video_path, os.path.join(output_dir, 'segment.mp4'))
+
+        overlays = [TextOverlay('HI', 0.5)]
+        with patch('gif_generator.download_video_segment', side_effect=local_download) as mock_download:
+            gif = create_gif('https://youtu.be/dQw4w9WgXcQ', 0, 2, gif_cache.directory, overlays, fps=5,
+                             encoder='stream', temp_dir=temp_dir, cache=gif_cache, intermediate_cache=intermediate_cache)
+            with patch('gif_generator.FrameStream', side_effect=AssertionError('source decoded again')):
+                webp = create_gif('https://youtu.be/dQw4w9WgXcQ', 0, 2, gif_cache.directory, overlays, fps=5,
+                                  encoder='stream', temp_dir=temp_dir, cache=gif_cache,
+                                  intermediate_cache=intermediate_cache, output_format='webp')
+
+        mock_download.assert_called_once()
+        self.assertEqual(os.path.splitext(gif.path)[0], os.path.splitext(webp.path)[0])
+        self.assertEqual(webp.output_format, 'webp')
+        with Image.open(webp.path) as image:
+            self.assertEqual((image.size, image.n_frames), ((160, 120), 10))
+        self.assertEqual(intermediate_cache.stats()['entries'], 1)
+        self.assertEqual(os.listdir(temp_dir), [])
+
+
+@unittest.skipUnless(ffmpeg_available(), "ffmpeg is required for range download tests")
+class TestRangeDownload(unittest.TestCase):
+
+    source_duration = 60
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.source_path = make_video(os.path.join(cls.tmp_dir, 'serve', 'source.mp4'), cls.source_duration)
+        cls.source_size = os.path.getsize(cls.source_path)
+        cls.server = RangeHTTPServer(os.path.dirname(cls.source_path)).__enter__()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.__exit__(None, None, None)
+        shutil.rmtree(cls.tmp_dir)
+
+    def _download(self, start_time, end_time):
+        output_dir = tempfile.mkdtemp(dir=self.tmp_dir)
+        self.server.reset()
+        with patch('gif_generator.yt_dlp.YoutubeDL', LocalExtractor(self.server.url('source.mp4'))):
+            path = download_video_segment('https://www.youtube.com/watch?v=fixture', start_time, end_time, output_dir=output_dir)
+        return path, self.server.bytes_sent
+
+    def test_downloads_only_requested_range(self):
+        path, bytes_read = self._download(30, 32)
+
+        clip = MoviePyVideoFileClip(path)
+        try:
+            self.assertAlmostEqual(clip.duration, 2, delta=0.2)
+        finally:
+            clip.close()
+        self.assertLess(bytes_read, self.source_size * 0.15)
+
+    def test_bytes_read_scale_with_clip_length(self):
+        _, short_bytes = self._download(20, 22)
+        _, long_bytes = self._download(20, 30)
+
+        # The fixture has a near-constant bitrate, so 8 more seconds should cost
+        # roughly 8 seconds' worth of bytes (allowing for socket buffering noise),
+        # while both downloads stay far below the source size
+        bytes_per_second = self.source_size / self.source_duration
+        self.assertGreater(long_bytes - short_bytes, 8 * bytes_per_second * 0.5)
+        self.assertLess(long_bytes, self.source_size * 0.4)
+
+    def test_parallel_downloads_get_their_own_files(self):
+        output_dir = tempfile.mkdtemp(dir=self.tmp_dir)
+        # Same video for every job, so yt-dlp picks the same file name each time
+        ranges = [(5 + i * 3, 6 + i * 4) for i in range(6)]
+        paths = [None] * len(ranges)
+        errors = []
+
+        def download(i):
+            try:
+                paths[i] = download_video_segment('https://www.youtube.com/watch?v=fixture', *ranges[i], output_dir=output_dir)
+            except Exception as e:
+                errors.append(e)
+
+        with patch('gif_generator.yt_dlp.YoutubeDL', LocalExtractor(self.server.url('source.mp4'))):
+            threads = [threading.Thread(target=download, args=(i,)) for i in range(len(ranges))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(set(paths)), len(ranges))
+        for path, (start_time, end_time) in zip(paths, ranges):
+            self.assertTrue(os.path.basename(path).startswith('fixture_source.'))
+            self.assertAlmostEqual(self._duration(path), end_time - start_time, delta=0.2)
+        # Only the finished files are left; every scratch directory is gone
+        self.assertEqual(sorted(os.listdir(output_dir)), sorted(os.path.basename(path) for path in paths))
+
+    def _duration(self, path):
+        clip = MoviePyVideoFileClip(path)
+        try:
+            return clip.duration
+        finally:
+            clip.close()
+
+    def test_segment_cache_serves_contained_and_overlapping_ranges(self):
+        output_dir = tempfile.mkdtemp(dir=self.tmp_dir)
+        segment_cache = SegmentCache(os.path.join(self.tmp_dir, 'segments'))
+        url = 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+
+        def download(start_time, end_time):
+            self.server.reset()
+            with patch('gif_generator.yt_dlp.YoutubeDL', LocalExtractor(self.server.url('source.mp4'))):
+                path = download_video_segment(url, start_time, end_time, output_dir=output_dir, segment_cache=segment_cache)
+            return path, self.server.bytes_sent
+
+        first_path, first_bytes = download(10, 16)
+        # A caption-only change asks for the same range again: no network at all
+        again_path, again_bytes = download(10, 16)
+        # A range inside the cached one is trimmed out of it
+        inner_path, inner_bytes = download(11, 13)
+        # A range sticking out of the cached one only fetches the missing 2 seconds
+        outer_path, outer_bytes = download(14, 18)
+
+        self.assertGreater(first_bytes, 0)
+        self.assertEqual(again_bytes, 0)
+        self.assertEqual(inner_bytes, 0)
+        self.assertGreater(outer_bytes, 0)
+        self.assertLess(outer_bytes, first_bytes)
+        self.assertEqual(len({first_path, again_path, inner_path, outer_path}), 4)
+        self.assertAlmostEqual(self._duration(again_path), 6, delta=0.2)
+        self.assertAlmostEqual(self._duration(inner_path), 2, delta=0.2)
+        self.assertAlmostEqual(self._duration(outer_path), 4, delta=0.2)
+
+        # The merged 10-18s segment replaced the 10-16s one
+        ranges = [(segment.start, segment.end) for segment, _ in segment_cache._entries()]
+        self.assertEqual(ranges, [(10, 18)])
+
+    def test_download_stages_are_traced(self):
+        output_dir = tempfile.mkdtemp(dir=self.tmp_dir)
+        with tracing() as trace:
+            with patch('gif_generator.yt_dlp.YoutubeDL', LocalExtractor(self.server.url('source.mp4'))):
+                path = download_video_segment('https://youtu.be/dQw4w9WgXcQ', 5, 7, output_dir=output_dir)
+
+        self.assertEqual(set(trace.stages), {'extract', 'download'})
+        self.assertEqual(trace.stages['download']['bytes'], os.path.getsize(path))
+
+    def test_metadata_cache_skips_extraction(self):
+        output_dir = tempfile.mkdtemp(dir=self.tmp_dir)
+        metadata_cache = MetadataCache(os.path.join(self.tmp_dir, 'metadata-hits'))
+        extractor = LocalExtractor(self.server.url('source.mp4'), duration=self.source_duration)
+
+        with patch('gif_generator.yt_dlp.YoutubeDL', extractor):
+            paths = [download_video_segment('https://youtu.be/dQw4w9WgXcQ', start, start + 1, output_dir=output_dir,
+                                            metadata_cache=metadata_cache) for start in (5, 10, 20)]
+
+        self.assertEqual(len(extractor.calls), 1)
+        self.assertEqual(len(set(paths)), 3)
+        self.assertTrue(all(os.path.basename(path).startswith('fixture_source.') for path in paths))
+        self.assertEqual(metadata_cache.get('dQw4w9WgXcQ', VIDEO_FORMAT)['duration'], self.source_duration)
+
+    def test_range_past_the_end_is_rejected_before_downloading(self):
+        output_dir = tempfile.mkdtemp(dir=self.tmp_dir)
+        metadata_cache = MetadataCache(os.path.join(self.tmp_dir, 'metadata-range'))
+        extractor = LocalExtractor(self.server.url('source.mp4'), duration=self.source_duration)
+        self.server.reset()
+
+        with patch('gif_generator.yt_dlp.YoutubeDL', extractor):
+            # The first request has to resolve the video to learn its duration
+            with self.assertRaises(TimeRangeError):
+                download_video_segment('https://youtu.be/dQw4w9WgXcQ', 55, 70, output_dir=output_dir,
+                                       metadata_cache=metadata_cache)
+            # Later ones are turned away from the cache alone
+            with self.assertRaises(TimeRangeError):
+                download_video_segment('https://youtu.be/dQw4w9WgXcQ', 61, 65, output_dir=output_dir,
+                                       metadata_cache=metadata_cache)
+
+        self.assertEqual(len(extractor.calls), 1)
+        self.assertEqual(self.server.bytes_sent, 0)
+        self.assertEqual(os.listdir(output_dir), [])
+
+    def test_batch_downloads_each_range_once_and_isolates_failures(self):
+        work_dir = tempfile.mkdtemp(dir=self.tmp_dir)
+        temp_dir = os.path.join(work_dir, 'temp')
+        cache = ResultCache(os.path.join(work_dir, 'gifs'))
+        metadata_cache = MetadataCache(os.path.join(work_dir, 'metadata'))
+        extractor = LocalExtractor(self.server.url('source.mp4'), duration=self.source_duration)
+        clips = [Clip(5, 7, [TextOverlay('A')]), Clip(8, 10), Clip(40, 42, [TextOverlay('C')]), Clip(70, 72)]
+
+        def batch():
+            with tracing() as trace, patch('gif_generator.yt_dlp.YoutubeDL', extractor):
+                results = create_gifs('https://youtu.be/dQw4w9WgXcQ', clips, os.path.join(work_dir, 'gifs'), fps=5,
+                                      encoder='stream', temp_dir=temp_dir, cache=cache,
+                                      metadata_cache=metadata_cache, max_parallel=2)
+            return results, trace
+
+        results, trace = batch()
+
+        # 5-7 and 8-10 share a download; 70-72 is past the end and fails alone
+        self.assertEqual(trace.stages['download']['calls'], 2)
+        self.assertEqual(len(extractor.calls), 1)
+        self.assertIsInstance(results[3], TimeRangeError)
+        for result, clip in zip(results[:3], clips):
+            self.assertFalse(result.cached)
+            self.assertEqual(result.path, cache.get(render_cache_key('https://youtu.be/dQw4w9WgXcQ', clip.start_time,
+                                                                     clip.end_time, clip.overlays, 5, 'stream')))
+            with Image.open(result.path) as image:
+                self.assertEqual(image.n_frames, 10)
+        self.assertEqual(os.listdir(temp_dir), [])
+
+        results, trace = batch()
+
+        self.assertTrue(all(result.cached for result in results[:3]))
+        self.assertNotIn('download', trace.stages)
+
+    def test_confirmed_preview_reuses_the_downloaded_segment(self):
+        work_dir = tempfile.mkdtemp(dir=self.tmp_dir)
+        cache = ResultCache(os.path.join(work_dir, 'gifs'))
+        segment_cache = SegmentCache(os.path.join(work_dir, 'segments'))
+        overlays = [TextOverlay('HI', start_time=0.5)]
+
+        def render(**options):
+            self.server.reset()
+            with tracing() as trace, patch('gif_generator.yt_dlp.YoutubeDL', LocalExtractor(self.server.url('source.mp4'))):
+                result = create_gif('https://youtu.be/dQw4w9WgXcQ', 20, 23, cache.directory, overlays, fps=10,
+                                    encoder='stream', temp_dir=os.path.join(work_dir, 'temp'), cache=cache,
+                                    segment_cache=segment_cache, **options)
+            return result, trace, self.server.bytes_sent
+
+        preview, _, preview_bytes = render(preview=PreviewSettings())
+        full, trace, full_bytes = render()
+
+        self.assertGreater(preview_bytes, 0)
+        self.assertEqual(full_bytes, 0)
+        # The segment is the exact range, so it is not even cut again
+        self.assertEqual(set(trace.stages) & {'extract', 'download', 'trim'}, set())
+        self.assertNotEqual(preview.path, full.path)
+        with Image.open(preview.path) as small, Image.open(full.path) as large:
+            self.assertLess(small.width, large.width)
+            self.assertEqual(large.n_frames, 30)
+
+    def test_stale_stream_urls_are_resolved_again(self):
+        output_dir = tempfile.mkdtemp(dir=self.tmp_dir)
+        metadata_cache = MetadataCache(os.path.join(self.tmp_dir, 'metadata-stale'))
+        metadata_cache.put('dQw4w9WgXcQ', VIDEO_FORMAT, {'id': 'fixture', 'title': 'source', 'duration': None,
+                                                         'filename': 'fixture_source',
+                                                         'sources': [[self.server.url('expired.mp4'), {}]]})
+        extractor = LocalExtractor(self.server.url('source.mp4'))
+
+        with patch('gif_generator.yt_dlp.YoutubeDL', extractor):
+            path = download_video_segment('https://youtu.be/dQw4w9WgXcQ', 5, 7, output_dir=output_dir,
+                                          metadata_cache=metadata_cache)
+
+        self.assertEqual(len(extractor.calls), 1)
+        self.assertAlmostEqual(self._duration(path), 2, delta=0.2)
+        self.assertEqual(metadata_cache.get('dQw4w9WgXcQ', VIDEO_FORMAT)['sources'][0][0], self.server.url('source.mp4'))
+
+def _decode(path, start=None, duration=None):
+    """Every frame of ``path``, or of a window of it, as ffmpeg decodes it."""
+    cmd = [FFMPEG_BINARY, '-loglevel', 'error']
+    if start is not None:
+        cmd += ['-ss', str(start), '-t', str(duration)]
+    cmd += ['-i', path, '-an', '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-']
+    data = subprocess.run(cmd, capture_output=True, check=True).stdout
+    return np.frombuffer(data, dtype=np.uint8).reshape(-1, 120, 160, 3)
+
+
+@unittest.skipUnless(ffmpeg_available(), "ffmpeg is required for cut mode tests")
+class TestCutModes(unittest.TestCase):
+
+    fps = 25
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        # A keyframe every second, with B-frames (and so frames shown out of decoding order)
+        cls.source_path = make_video(os.path.join(cls.tmp_dir, 'serve', 'source.mp4'), 12, size=(160, 120),
+                                     fps=cls.fps, keyframe_interval=cls.fps, bframes=3, audio=True)
+        cls.server = RangeHTTPServer(os.path.dirname(cls.source_path)).__enter__()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.__exit__(None, None, None)
+        shutil.rmtree(cls.tmp_dir)
+
+    def _download(self, start_time, end_time, cut_mode, segment_cache=None):
+        output_dir = tempfile.mkdtemp(dir=self.tmp_dir)
+        self.server.reset()
+        with patch('gif_generator.yt_dlp.YoutubeDL', LocalExtractor(self.server.url('source.mp4'))):
+            path = download_video_segment('https://youtu.be/dQw4w9WgXcQ', start_time, end_time, output_dir=output_dir,
+                                          segment_cache=segment_cache, cut_mode=cut_mode)
+        return path, self.server.bytes_sent
+
+    def assertExactCut(self, path, start_time, end_time, bit_exact=True):
+        expected = _decode(self.source_path, start_time, end_time - start_time)
+        frames = _decode(path)
+        self.assertEqual(len(expected), round((end_time - start_time) * self.fps))
+        self.assertEqual(len(frames), len(expected), (start_time, end_time))
+        if bit_exact:
+            np.testing.assert_array_equal(frames, expected)
+        else:
+            # Re-encoding blurs the noise, but each frame is still closer to its own source frame than to the next
+            aligned = np.abs(frames[:-1].astype(int) - expected[:-1]).mean()
+            shifted = np.abs(frames[:-1].astype(int) - expected[1:]).mean()
+            self.assertLess(aligned, shifted / 2)
+
+    def test_copied_cuts_are_frame_exact(self):
+        # On keyframes, between them, within one group of pictures and across several
+        for start_time, end_time in ((2, 4), (2.36, 4.2), (5.52, 5.96), (7.04, 10.88)):
+            path, _ = self._download(start_time, end_time, 'copy')
+
+            # Nothing was re-encoded, so the frames are the source's, bit for bit
+            self.assertExactCut(path, start_time, end_time)
+            self.assertAlmostEqual(probe_video(path).duration, end_time - start_time, delta=0.01)
+
+    def test_copied_cuts_have_no_audio(self):
+        path, _ = self._download(3, 5, 'copy')
+
+        result = subprocess.run([FFMPEG_BINARY, '-i', path], capture_output=True, text=True)
+        self.assertIn('Video:', result.stderr)
+        self.assertNotIn('Audio:', result.stderr)
+
+    def test_cached_copies_are_trimmed_and_joined_exactly(self):
+        segment_cache = SegmentCache(os.path.join(self.tmp_dir, 'segments'))
+
+        first_path, _ = self._download(2.2, 6.4, 'copy', segment_cache)
+        inner_path, inner_bytes = self._download(3.48, 5, 'copy', segment_cache)
+        joined_path, joined_bytes = self._download(5.6, 8.12, 'copy', segment_cache)
+
+        self.assertExactCut(first_path, 2.2, 6.4)
+        self.assertEqual(inner_bytes, 0)
+        self.assertExactCut(inner_path, 3.48, 5)
+        # Pieces of separate copies can only meet through a decoder, so joins are encoded
+        self.assertGreater(joined_bytes, 0)
+        self.assertExactCut(joined_path, 5.6, 8.12, bit_exact=False)
+        self.assertEqual([(segment.start, segment.end) for segment, _ in segment_cache._entries()], [(2.2, 8.12)])
+
+    def test_batch_clips_are_cut_by_copying(self):
+        work_dir = tempfile.mkdtemp(dir=self.tmp_dir)
+        clips = [Clip(1.24, 2.0), Clip(2.52, 3.8)]
+
+        with tracing() as trace, patch('gif_generator.yt_dlp.YoutubeDL', LocalExtractor(self.server.url('source.mp4'))):
+            results = create_gifs('https://youtu.be/dQw4w9WgXcQ', clips, work_dir, fps=self.fps, encoder='stream',
+                                  temp_dir=os.path.join(work_dir, 'temp'), cut_mode='copy')
+
+        self.assertEqual(trace.stages['download']['calls'], 1)
+        for result, clip in zip(results, clips):
+            with Image.open(result.path) as image:
+                self.assertEqual(image.n_frames, round((clip.end_time - clip.start_time) * self.fps))
+
+class TestLazyImports(unittest.TestCase):
+
+    def test_heavy_modules_resolve_on_first_use(self):
+        import gif_generator
+
+        gif_generator.preload_heavy_modules()
+        self.assertIs(gif_generator.VideoFileClip, MoviePyVideoFileClip)
+        self.assertIs(gif_generator.DownloadError, DownloadError)
+        with self.assertRaises(AttributeError):
+            gif_generator.not_a_module
+
 if __name__ == '__main__':
     # This allows running the tests directly from this file
     unittest.main(argv=['first-arg-is-ignored'], exit=False)
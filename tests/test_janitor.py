@@ -0,0 +1,101 @@
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+import time
+
+# Add project root to sys.path to allow importing janitor
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from cache import MetadataCache, ResultCache, SegmentCache
+from janitor import Janitor, sweep_temp_dir
+
+
+def _write(path, size, age=0):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+class TestJanitor(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.temp_videos = os.path.join(self.tmp_dir, 'temp_videos')
+        self.results = ResultCache(os.path.join(self.tmp_dir, 'gifs'), max_bytes=250, max_age=3600)
+        self.segments = SegmentCache(os.path.join(self.temp_videos, 'segments'))
+        self.metadata = MetadataCache(os.path.join(self.temp_videos, 'metadata'))
+        self.reports = []
+        self.janitor = Janitor({'results': self.results, 'segments': self.segments, 'metadata': self.metadata},
+                               self.temp_videos, max_job_seconds=600, interval=0.05, on_sweep=self.reports.append)
+
+    def tearDown(self):
+        self.janitor.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_temp_sweep_only_takes_what_no_job_can_still_use(self):
+        crashed = _write(os.path.join(self.temp_videos, 'job-aaaa', 'partial.mp4'), 100, age=4000)
+        os.utime(os.path.dirname(crashed), (time.time() - 4000,) * 2)
+        running = os.path.join(self.temp_videos, 'job-bbbb')
+        # An old directory with a file still being written to
+        _write(os.path.join(running, 'partial.mp4'), 100)
+        os.utime(running, (time.time() - 4000,) * 2)
+        orphan = _write(os.path.join(self.temp_videos, 'vid_title.0123.mp4'), 300, age=4000)
+        fresh = _write(os.path.join(self.temp_videos, 'vid_title.4567.mp4'), 300)
+        jobs_db = _write(os.path.join(self.temp_videos, 'jobs.sqlite'), 10, age=4000)
+        cached = _write(os.path.join(self.segments.directory, 'x_0_1000.mp4'), 10, age=4000)
+
+        removed = dict(sweep_temp_dir(self.temp_videos, 600))
+
+        self.assertEqual(removed, {os.path.dirname(crashed): 100, orphan: 300})
+        for path in (running, fresh, jobs_db, cached):
+            self.assertTrue(os.path.exists(path), path)
+
+    def test_sweep_reports_what_it_reclaimed_per_area(self):
+        now = time.time()
+        for key, age in (('a', 100), ('b', 50), ('c', 0)):
+            _write(self.results.path_for(key), 100, age=age)
+        _write(self.results.temp_path_for('crashed'), 40, age=4000)
+        _write(os.path.join(self.temp_videos, 'job-cccc', 'source.mp4'), 70, age=4000)
+        os.utime(os.path.join(self.temp_videos, 'job-cccc'), (now - 4000, now - 4000))
+        self.metadata.put('vid', 'mp4', {}, expires_at=now - 1)
+
+        report = self.janitor.sweep()
+
+        # Over quota by one entry, plus the scratch file of a crashed render
+        self.assertEqual(report.areas['results'], {'files': 2, 'bytes': 140})
+        self.assertFalse(os.path.exists(self.results.path_for('a')))
+        self.assertEqual(report.areas['temp'], {'files': 1, 'bytes': 70})
+        self.assertEqual(report.areas['metadata']['files'], 1)
+        self.assertEqual(report.areas['segments'], {'files': 0, 'bytes': 0})
+        self.assertEqual(report.files, 4)
+        self.assertEqual(self.reports, [report])
+        self.assertEqual(self.janitor.stats()['reclaimed_bytes'], report.bytes)
+        # Nothing left to do the second time
+        self.assertEqual(self.janitor.sweep().files, 0)
+
+    def test_removed_file_can_still_be_served(self):
+        path = _write(self.results.path_for('old'), 100, age=7200)
+        with open(path, 'rb') as response_body:
+            self.janitor.sweep()
+            self.assertFalse(os.path.exists(path))
+            self.assertEqual(len(response_body.read()), 100)
+
+    def test_sweeps_run_in_the_background(self):
+        self.janitor.start()
+        self.janitor.start() # Already running in this process: no second thread
+
+        deadline = time.time() + 5
+        while self.janitor.stats()['sweeps'] < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        self.janitor.stop()
+
+        self.assertGreaterEqual(self.janitor.stats()['sweeps'], 2)
+
+if __name__ == '__main__':
+    unittest.main(argv=['first-arg-is-ignored'], exit=False)
@@ -0,0 +1,224 @@
+import unittest
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+# Add project root to sys.path to allow importing jobs
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from jobs import JobQueue, MemoryJobStore, SQLiteJobStore, ABANDONED, QUEUED, RUNNING, DONE, FAILED
+
+
+def wait_for(queue, job_id, statuses=(DONE, FAILED), timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = queue.get(job_id)
+        if job.status in statuses:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"Job {job_id} did not reach {statuses}")
+
+
+class JobQueueTests:
+    """Behaviour shared by every store; subclasses provide make_store."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.queues = []
+
+    def tearDown(self):
+        for queue in self.queues:
+            queue.shutdown()
+        shutil.rmtree(self.tmp_dir)
+
+    def make_queue(self, handler, **kwargs):
+        queue = JobQueue(handler, store=self.make_store(), poll_interval=0.05, **kwargs)
+        self.queues.append(queue)
+        return queue
+
+    def test_job_runs_to_completion(self):
+        def handler(params, report_progress):
+            report_progress(0.5)
+            return {'filename': f"{params['name']}.gif"}
+
+        queue = self.make_queue(handler)
+        job_id = queue.submit({'name': 'clip'})
+
+        job = wait_for(queue, job_id)
+        self.assertEqual(job.status, DONE)
+        self.assertEqual(job.progress, 1.0)
+        self.assertEqual(job.result, {'filename': 'clip.gif'})
+        self.assertEqual(job.params, {'name': 'clip'})
+
+    def test_failure_is_recorded(self):
+        def handler(params, report_progress):
+            raise FileNotFoundError('segment missing')
+
+        queue = self.make_queue(handler)
+        job = wait_for(queue, queue.submit({}))
+
+        self.assertEqual(job.status, FAILED)
+        self.assertEqual(job.error, 'segment missing')
+        self.assertEqual(job.error_type, 'FileNotFoundError')
+        self.assertIsNone(job.result)
+
+    def test_progress_and_worker_bound(self):
+        release = threading.Event()
+        running = []
+
+        def handler(params, report_progress):
+            running.append(params['n'])
+            report_progress(0.25)
+            release.wait(5)
+            return {}
+
+        queue = self.make_queue(handler, max_workers=2)
+        job_ids = [queue.submit({'n': n}) for n in range(4)]
+
+        first = wait_for(queue, job_ids[0], statuses=(RUNNING,))
+        wait_for(queue, job_ids[1], statuses=(RUNNING,))
+        time.sleep(0.2)
+        # Only two workers, so the other jobs wait their turn
+        self.assertEqual(queue.get(job_ids[2]).status, QUEUED)
+        self.assertEqual(len(running), 2)
+        self.assertIn(queue.get(first.id).progress, (0.0, 0.25))
+        self.assertEqual(queue.depth(), {'queued': 2, 'running': 2})
+
+        release.set()
+        for job_id in job_ids:
+            self.assertEqual(wait_for(queue, job_id).status, DONE)
+
+    def test_unknown_job(self):
+        queue = self.make_queue(lambda params, report_progress: {})
+        self.assertIsNone(queue.get('does-not-exist'))
+
+    def test_expired_leases_are_requeued_then_failed(self):
+        store = self.make_store()
+        job = store.create({})
+        # Claimed by a worker that died without renewing its lease
+        store.claim()
+        self.assertEqual(store.recover(lease=60, max_attempts=2), 0)
+        self.assertEqual(store.recover(lease=-1, max_attempts=2), 1)
+        requeued = store.get(job.id)
+        self.assertEqual((requeued.status, requeued.attempts), (QUEUED, 1))
+
+        self.assertEqual(store.claim().attempts, 2)
+        store.recover(lease=-1, max_attempts=2)
+        failed = store.get(job.id)
+        self.assertEqual((failed.status, failed.error_type), (FAILED, ABANDONED))
+        self.assertIsNone(store.claim())
+
+    def test_running_jobs_renew_their_lease(self):
+        release = threading.Event()
+        queue = self.make_queue(lambda params, report_progress: release.wait(5) and {}, lease=0.3)
+        job_id = queue.submit({})
+        claimed = wait_for(queue, job_id, statuses=(RUNNING,))
+
+        time.sleep(0.5)
+        # Renewed, so never taken for abandoned
+        self.assertGreater(queue.get(job_id).updated_at, claimed.updated_at)
+        self.assertEqual(queue.store.recover(lease=0.3, max_attempts=1), 0)
+        release.set()
+        self.assertEqual(wait_for(queue, job_id).status, DONE)
+
+    def test_shutdown_releases_jobs_it_gives_up_on(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        queue = self.make_queue(lambda params, report_progress: release.wait(5) and {'filename': 'late.gif'})
+        job_id = queue.submit({})
+        wait_for(queue, job_id, statuses=(RUNNING,))
+
+        self.assertEqual(queue.shutdown(timeout=0.1), 1)
+        job = queue.store.get(job_id)
+        # Queued for the next process, and the interrupted claim does not count
+        self.assertEqual((job.status, job.attempts), (QUEUED, 0))
+        self.assertEqual(queue.store.claim().id, job_id)
+
+        release.set()
+        time.sleep(0.2)
+        # The released run finished, but no longer owned the job
+        self.assertEqual(queue.store.get(job_id).status, RUNNING)
+
+    def test_shutdown_waits_for_jobs_that_finish_in_time(self):
+        queue = self.make_queue(lambda params, report_progress: time.sleep(0.2) or {})
+        job_id = queue.submit({})
+        wait_for(queue, job_id, statuses=(RUNNING,))
+
+        self.assertEqual(queue.shutdown(timeout=5), 0)
+        self.assertEqual(queue.store.get(job_id).status, DONE)
+
+    def test_finished_jobs_are_pruned(self):
+        queue = self.make_queue(lambda params, report_progress: {})
+        job_id = queue.submit({})
+        wait_for(queue, job_id)
+        running = queue.store.create({})
+        queue.store.claim()
+
+        self.assertEqual(queue.store.prune(max_age=3600), 0)
+        self.assertEqual(queue.store.prune(max_age=-1), 1)
+        self.assertIsNone(queue.get(job_id))
+        self.assertEqual(queue.get(running.id).status, RUNNING)
+
+
+class TestMemoryJobQueue(JobQueueTests, unittest.TestCase):
+
+    def make_store(self):
+        return MemoryJobStore()
+
+
+class TestSQLiteJobQueue(JobQueueTests, unittest.TestCase):
+
+    def make_store(self):
+        return SQLiteJobStore(os.path.join(self.tmp_dir, 'jobs.sqlite3'))
+
+    def test_stores_share_jobs_and_claim_once(self):
+        # Two stores on one file stand in for two app processes
+        path = os.path.join(self.tmp_dir, 'shared.sqlite3')
+        store_a = SQLiteJobStore(path)
+        store_b = SQLiteJobStore(path)
+
+        job = store_a.create({'youtube_url': 'https://youtu.be/abc'})
+        claimed = store_b.claim()
+
+        self.assertEqual(claimed.id, job.id)
+        self.assertEqual(claimed.status, RUNNING)
+        self.assertIsNone(store_a.claim())
+
+        store_b.update(job.id, status=DONE, progress=1.0, result={'filename': 'abc.gif'})
+        self.assertEqual(store_a.get(job.id).result, {'filename': 'abc.gif'})
+
+    def test_job_submitted_in_one_process_runs_in_another(self):
+        path = os.path.join(self.tmp_dir, 'shared.sqlite3')
+        submitter = SQLiteJobStore(path)
+        worker = JobQueue(lambda params, report_progress: {'ran': True}, store=SQLiteJobStore(path), poll_interval=0.05)
+        self.queues.append(worker)
+        worker.start()
+
+        job = submitter.create({})
+
+        deadline = time.time() + 5
+        while submitter.get(job.id).status != DONE and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(submitter.get(job.id).result, {'ran': True})
+
+    def test_databases_without_attempts_are_upgraded(self):
+        path = os.path.join(self.tmp_dir, 'old.sqlite3')
+        with sqlite3.connect(path) as conn:
+            conn.execute('CREATE TABLE jobs (id TEXT PRIMARY KEY, params TEXT NOT NULL, status TEXT NOT NULL,'
+                         ' progress REAL NOT NULL, result TEXT, error TEXT, error_type TEXT,'
+                         ' created_at REAL NOT NULL, updated_at REAL NOT NULL)')
+            conn.execute("INSERT INTO jobs VALUES ('old', '{}', 'running', 0, NULL, NULL, NULL, 0, 0)")
+        conn.close()
+
+        store = SQLiteJobStore(path)
+        self.assertEqual(store.get('old').attempts, 0)
+        self.assertEqual(store.recover(lease=60, max_attempts=2), 1)
+        self.assertEqual(store.claim().id, 'old')
+
+if __name__ == '__main__':
+    unittest.main(argv=['first-arg-is-ignored'], exit=False)
@@ -0,0 +1,190 @@
+import unittest
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# Add project root to sys.path to allow importing metrics
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from metrics import Counter, Gauge, Histogram, Registry, call_traced, current_trace, stage, tracing
+
+
+def _shared_metrics(registry):
+    return (Counter('errors_total', 'Failed jobs', ['type'], registry=registry),
+            Gauge('jobs', 'Jobs by state', ['state'], registry=registry),
+            Histogram('stage_seconds', 'Stage time', ['stage'], buckets=(0.5, 1), registry=registry))
+
+def _work_in_another_worker(registry, errors, jobs, latency):
+    errors.inc(2, type='DownloadError')
+    jobs.set(10, state='queued')
+    latency.observe(0.7, stage='encode')
+    registry.flush()
+
+# A worker process exiting normally: nothing flushes it explicitly
+_EXITING_WORKER = '''
+import sys
+sys.path.insert(0, sys.argv[1])
+from metrics import Counter, Registry
+registry = Registry()
+registry.share(sys.argv[2], flush_interval=60)
+Counter('errors_total', 'Failed jobs', ['type'], registry=registry).inc(5, type='other')
+'''
+
+def _traced_work():
+    with stage('encode') as timing:
+        timing.bytes = 42
+    return 'done'
+
+
+class TestStageTrace(unittest.TestCase):
+
+    def test_stages_are_summed_into_the_current_trace(self):
+        with tracing() as trace:
+            for _ in range(3):
+                with stage('composite'):
+                    pass
+            with stage('download') as timing:
+                timing.bytes = 1000
+            self.assertIs(current_trace(), trace)
+
+        self.assertIsNone(current_trace())
+        self.assertEqual(trace.stages['composite']['calls'], 3)
+        self.assertEqual(trace.stages['download']['bytes'], 1000)
+        self.assertGreaterEqual(trace.stages['download']['seconds'], 0)
+
+    def test_failing_stage_is_still_timed(self):
+        with tracing() as trace:
+            with self.assertRaises(RuntimeError):
+                with stage('extract'):
+                    raise RuntimeError('unavailable')
+        self.assertEqual(trace.stages['extract']['calls'], 1)
+
+    def test_untraced_stages_are_dropped(self):
+        with stage('encode'):
+            pass
+        self.assertIsNone(current_trace())
+
+    def test_traces_are_per_thread(self):
+        other = []
+        with tracing() as trace:
+            thread = threading.Thread(target=lambda: other.append(current_trace()))
+            thread.start()
+            thread.join()
+        self.assertEqual(other, [None])
+        self.assertEqual(trace.stages, {})
+
+    def test_call_traced_hands_stages_back_for_merging(self):
+        result, stages = call_traced(_traced_work)
+
+        with tracing() as trace:
+            trace.merge(stages)
+            trace.merge(stages)
+        self.assertEqual(result, 'done')
+        self.assertEqual((trace.stages['encode']['calls'], trace.stages['encode']['bytes']), (2, 84))
+
+
+class TestPrometheusFormat(unittest.TestCase):
+
+    def test_exposition(self):
+        registry = Registry()
+        errors = Counter('errors_total', 'Failed jobs', ['type'], registry=registry)
+        jobs = Gauge('jobs', 'Jobs by state', ['state'], registry=registry)
+        latency = Histogram('stage_seconds', 'Stage time', ['stage'], buckets=(0.5, 1), registry=registry)
+
+        errors.inc(type='DownloadError')
+        errors.inc(2, type='other')
+        jobs.set(3, state='queued')
+        latency.observe(0.2, stage='encode')
+        latency.observe(0.7, stage='encode')
+        latency.observe(5, stage='encode')
+
+        lines = registry.render().splitlines()
+        self.assertIn('# TYPE errors_total counter', lines)
+        self.assertIn('errors_total{type="DownloadError"} 1', lines)
+        self.assertIn('errors_total{type="other"} 2', lines)
+        self.assertIn('jobs{state="queued"} 3', lines)
+        self.assertIn('# TYPE stage_seconds histogram', lines)
+        self.assertIn('stage_seconds_bucket{stage="encode",le="0.5"} 1', lines)
+        self.assertIn('stage_seconds_bucket{stage="encode",le="1"} 2', lines)
+        self.assertIn('stage_seconds_bucket{stage="encode",le="+Inf"} 3', lines)
+        self.assertIn('stage_seconds_sum{stage="encode"} 5.9', lines)
+        self.assertIn('stage_seconds_count{stage="encode"} 3', lines)
+        self.assertEqual(latency.value(stage='encode'), (3, 5.9))
+
+    def test_misuse_is_rejected(self):
+        registry = Registry()
+        counter = Counter('total', 'Total', ['type'], registry=registry)
+        with self.assertRaises(ValueError):
+            counter.inc(-1, type='x')
+        with self.assertRaises(ValueError):
+            counter.inc(stage='x')
+        with self.assertRaises(ValueError):
+            Counter('total', 'Again', registry=registry)
+
+    def test_label_values_are_escaped(self):
+        registry = Registry()
+        Counter('total', 'Total', ['type'], registry=registry).inc(type='a"b\\c')
+        self.assertIn('total{type="a\\"b\\\\c"} 1', registry.render())
+
+
+class TestSharedRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.registry = Registry()
+        self.registry.share(self.tmp_dir, flush_interval=0.05)
+        self.errors, self.jobs, self.latency = _shared_metrics(self.registry)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def run_in_worker(self, target, *args):
+        worker = multiprocessing.get_context('fork').Process(target=target, args=args)
+        worker.start()
+        worker.join(10)
+        self.assertEqual(worker.exitcode, 0)
+
+    def test_counters_and_histograms_are_summed_across_processes(self):
+        self.errors.inc(type='DownloadError')
+        self.jobs.set(3, state='queued')
+        self.latency.observe(0.2, stage='encode')
+        self.run_in_worker(_work_in_another_worker, self.registry, self.errors, self.jobs, self.latency)
+
+        lines = self.registry.render().splitlines()
+        self.assertIn('errors_total{type="DownloadError"} 3', lines)
+        self.assertIn('stage_seconds_bucket{stage="encode",le="0.5"} 1', lines)
+        self.assertIn('stage_seconds_bucket{stage="encode",le="1"} 2', lines)
+        self.assertIn('stage_seconds_count{stage="encode"} 2', lines)
+        # Gauges are set from shared state before a scrape, so never summed
+        self.assertIn('jobs{state="queued"} 3', lines)
+        # value() stays this process's own
+        self.assertEqual(self.errors.value(type='DownloadError'), 1)
+
+    def test_processes_that_are_gone_still_count(self):
+        subprocess.run([sys.executable, '-c', _EXITING_WORKER, project_root, self.tmp_dir], check=True)
+        self.run_in_worker(_work_in_another_worker, self.registry, self.errors, self.jobs, self.latency)
+
+        lines = self.registry.render().splitlines()
+        self.assertIn('errors_total{type="other"} 5', lines)
+        self.assertIn('errors_total{type="DownloadError"} 2', lines)
+
+    def test_changes_are_written_in_the_background(self):
+        self.errors.inc(type='DownloadError')
+        other = Registry()
+        other.share(self.tmp_dir)
+        other_errors = _shared_metrics(other)[0]
+
+        deadline = time.time() + 5
+        while 'errors_total{type="DownloadError"} 1' not in other.render().splitlines():
+            self.assertLess(time.time(), deadline, 'the change was never written')
+            time.sleep(0.02)
+        self.assertEqual(other_errors.value(type='DownloadError'), 0)
+
+if __name__ == '__main__':
+    unittest.main(argv=['first-arg-is-ignored'], exit=False)
@@ -0,0 +1,52 @@
+import unittest
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+# Add project root to sys.path to allow importing mp4edit
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from frames import probe_video
+from mp4edit import limit_edit_list
+from tests.fixtures import FFMPEG_BINARY, ffmpeg_available, make_video
+
+
+@unittest.skipUnless(ffmpeg_available(), "ffmpeg is required for MP4 edit list tests")
+class TestLimitEditList(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _count_frames(self, path):
+        result = subprocess.run([FFMPEG_BINARY, '-i', path, '-f', 'framecrc', '-'], capture_output=True, text=True,
+                                check=True)
+        return sum(1 for line in result.stdout.splitlines() if line and not line.startswith('#'))
+
+    def test_shortens_the_edit_in_place(self):
+        path = make_video(os.path.join(self.tmp_dir, 'clip.mp4'), 2, size=(64, 48), bframes=2)
+        size = os.path.getsize(path)
+
+        self.assertTrue(limit_edit_list(path, 1.2))
+
+        self.assertEqual(os.path.getsize(path), size)
+        self.assertAlmostEqual(probe_video(path).duration, 1.2, delta=0.01)
+        self.assertEqual(self._count_frames(path), 30)
+        # Never lengthens an edit
+        self.assertFalse(limit_edit_list(path, 5))
+
+    def test_rejects_files_that_are_not_mp4(self):
+        path = os.path.join(self.tmp_dir, 'clip.mp4')
+        with open(path, 'wb') as f:
+            f.write(b'\x00\x00\x00\x08free')
+
+        with self.assertRaises(ValueError):
+            limit_edit_list(path, 1)
+
+if __name__ == '__main__':
+    unittest.main(argv=['first-arg-is-ignored'], exit=False)
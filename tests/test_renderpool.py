@@ -0,0 +1,131 @@
+import unittest
+import os
+import sys
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+# Add project root to sys.path to allow importing renderpool
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from renderpool import RenderCrashed, RenderPool, RenderTimeout
+from tests.fixtures import ffmpeg_available, make_video
+
+
+def _whoami(value):
+    return os.getpid(), value * 2
+
+def _fail(message):
+    raise ValueError(message)
+
+def _crash():
+    os._exit(3)
+
+def _hang_with_child(pid_path):
+    # Stands in for an encode stuck in ffmpeg
+    child = subprocess.Popen(['sleep', '60'])
+    with open(pid_path, 'w') as f:
+        f.write(str(child.pid))
+    child.wait()
+
+def _sleep(seconds, marker_dir):
+    marker = os.path.join(marker_dir, str(os.getpid()))
+    open(marker, 'w').close()
+    try:
+        time.sleep(seconds)
+        return len(os.listdir(marker_dir))
+    finally:
+        os.remove(marker)
+
+def _imported(module):
+    return module in sys.modules
+
+def _process_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    # A killed child of an exited process may linger as a zombie until reaped
+    with open(f'/proc/{pid}/stat') as f:
+        return f.read().split(')')[-1].split()[0] != 'Z'
+
+
+class TestRenderPool(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.pool = RenderPool(max_workers=2, timeout=30)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_runs_in_a_child_process(self):
+        pid, value = self.pool.run(_whoami, 21)
+
+        self.assertNotEqual(pid, os.getpid())
+        self.assertEqual(value, 42)
+        self.assertEqual(self.pool.stats()['completed'], 1)
+
+    def test_children_start_with_the_heavy_modules_imported(self):
+        # Imported by the forkserver, not by the render
+        self.assertTrue(self.pool.run(_imported, 'moviepy.editor'))
+
+    def test_exception_is_raised_in_the_caller(self):
+        with self.assertRaisesRegex(ValueError, 'bad frame'):
+            self.pool.run(_fail, 'bad frame')
+        self.assertEqual(self.pool.stats()['failed'], 1)
+
+    def test_crashed_child_is_reported(self):
+        with self.assertRaisesRegex(RenderCrashed, 'code 3'):
+            self.pool.run(_crash)
+
+    def test_timeout_kills_the_render_and_its_subprocesses(self):
+        pid_path = os.path.join(self.tmp_dir, 'pid')
+
+        started = time.monotonic()
+        with self.assertRaises(RenderTimeout):
+            self.pool.run(_hang_with_child, pid_path, timeout=1)
+
+        self.assertLess(time.monotonic() - started, 10)
+        with open(pid_path) as f:
+            grandchild = int(f.read())
+        deadline = time.monotonic() + 5
+        while _process_exists(grandchild) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertFalse(_process_exists(grandchild))
+        self.assertEqual(self.pool.stats()['timed_out'], 1)
+        # The pool keeps working after a kill
+        self.assertEqual(self.pool.run(_whoami, 1)[1], 2)
+
+    def test_concurrency_is_bounded_by_max_workers(self):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.pool.run(_sleep, 0.5, self.tmp_dir)))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.3)
+        stats = self.pool.stats()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(results), 5)
+        self.assertLessEqual(max(results), 2)
+        self.assertEqual(stats['busy'] + stats['waiting'], 5)
+        self.assertLessEqual(stats['utilization'], 1.0)
+
+    @unittest.skipUnless(ffmpeg_available(), "ffmpeg is required to render")
+    def test_render_gif_in_the_pool(self):
+        from gif_generator import render_gif
+        video_path = make_video(os.path.join(self.tmp_dir, 'clip.mp4'), 1, size=(64, 48))
+        output_path = os.path.join(self.tmp_dir, 'clip.gif')
+
+        result = self.pool.run(render_gif, video_path, output_path, fps=5, encoder='ffmpeg')
+
+        self.assertEqual(result.path, output_path)
+        self.assertEqual(result.output_bytes, os.path.getsize(output_path))
+
+if __name__ == '__main__':
+    unittest.main(argv=['first-arg-is-ignored'], exit=False)
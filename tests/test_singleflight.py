@@ -0,0 +1,214 @@
+import unittest
+from unittest.mock import patch
+import fcntl
+import multiprocessing
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import time
+
+# Add project root to sys.path to allow importing singleflight
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from singleflight import RemoteError, SingleFlight
+
+
+def _slow_render(counter_path, fail):
+    with open(counter_path, 'a') as f:
+        f.write('x')
+    time.sleep(1)
+    if fail:
+        raise FileNotFoundError('source vanished')
+    return {'filename': 'shared.gif'}
+
+def _process_caller(lock_dir, counter_path, fail, results):
+    flight = SingleFlight(lock_dir=lock_dir)
+    try:
+        results.put(('ok', flight.do('key', lambda: _slow_render(counter_path, fail))))
+    except RemoteError as e:
+        results.put(('remote', e.error_type, str(e)))
+    except Exception as e:
+        results.put(('local', type(e).__name__, str(e)))
+
+
+class SingleFlightTests:
+    """Behaviour shared by the in-process and cross-process modes."""
+
+    def make_flight(self) -> SingleFlight:
+        raise NotImplementedError
+
+    def run_concurrently(self, flight, key, fn, callers=8):
+        started = threading.Barrier(callers)
+        outcomes = [None] * callers
+
+        def call(i):
+            started.wait()
+            try:
+                outcomes[i] = ('ok', flight.do(key, fn))
+            except Exception as e:
+                outcomes[i] = ('error', e)
+
+        threads = [threading.Thread(target=call, args=(i,)) for i in range(callers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return outcomes
+
+    def test_identical_calls_run_once(self):
+        flight = self.make_flight()
+        calls = []
+
+        def render():
+            calls.append(1)
+            time.sleep(0.3)
+            return {'filename': 'a.gif'}
+
+        outcomes = self.run_concurrently(flight, 'key', render)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(outcomes, [('ok', {'filename': 'a.gif'})] * 8)
+        self.assertEqual((flight.executions, flight.coalesced), (1, 7))
+
+    def test_failure_reaches_every_waiter_and_is_not_cached(self):
+        flight = self.make_flight()
+        calls = []
+
+        def render():
+            calls.append(1)
+            time.sleep(0.3)
+            raise ValueError('bad clip')
+
+        outcomes = self.run_concurrently(flight, 'key', render)
+
+        self.assertEqual(len(calls), 1)
+        for kind, error in outcomes:
+            self.assertEqual(kind, 'error')
+            self.assertIsInstance(error, ValueError)
+        # The next caller after the failure runs the work again
+        self.assertEqual(flight.do('key', lambda: 'retried'), 'retried')
+        self.assertEqual(flight.executions, 2)
+
+    def test_different_keys_run_independently(self):
+        flight = self.make_flight()
+        both_running = threading.Barrier(2, timeout=5)
+
+        def render(name):
+            both_running.wait()
+            return name
+
+        outcomes = [None, None]
+        threads = [threading.Thread(target=lambda i=i: outcomes.__setitem__(i, flight.do(f'key{i}', lambda: render(i))))
+                   for i in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(outcomes, [0, 1])
+        self.assertEqual(flight.executions, 2)
+
+class TestInProcessSingleFlight(SingleFlightTests, unittest.TestCase):
+
+    def make_flight(self):
+        return SingleFlight()
+
+class TestCrossProcessSingleFlight(SingleFlightTests, unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.counter_path = os.path.join(self.tmp_dir, 'executions')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def make_flight(self):
+        return SingleFlight(lock_dir=self.tmp_dir)
+
+    def run_processes(self, fail, count=4):
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        processes = [context.Process(target=_process_caller, args=(self.tmp_dir, self.counter_path, fail, results))
+                     for _ in range(count)]
+        for process in processes:
+            process.start()
+        outcomes = [results.get(timeout=10) for _ in processes]
+        for process in processes:
+            process.join()
+        with open(self.counter_path) as f:
+            executions = len(f.read())
+        return outcomes, executions
+
+    def test_processes_share_one_execution(self):
+        outcomes, executions = self.run_processes(fail=False)
+
+        self.assertEqual(executions, 1)
+        self.assertEqual(outcomes, [('ok', {'filename': 'shared.gif'})] * 4)
+
+    def test_failure_is_relayed_to_other_processes(self):
+        outcomes, executions = self.run_processes(fail=True)
+
+        self.assertEqual(executions, 1)
+        self.assertIn(('local', 'FileNotFoundError', 'source vanished'), outcomes)
+        self.assertEqual(outcomes.count(('remote', 'FileNotFoundError', 'source vanished')), 3)
+        # Nothing is remembered: the next process runs the work again
+        outcomes, executions = self.run_processes(fail=False, count=1)
+        self.assertEqual((outcomes, executions), ([('ok', {'filename': 'shared.gif'})], 2))
+
+    def test_idle_lock_files_are_swept(self):
+        flight = SingleFlight(lock_dir=self.tmp_dir, outcome_ttl=60)
+        old, busy = (os.path.join(self.tmp_dir, name) for name in ('old.lock', 'busy.lock'))
+        for path in (old, busy):
+            open(path, 'a').close()
+            os.utime(path, (time.time() - 120, time.time() - 120))
+
+        with open(busy) as held:
+            fcntl.flock(held, fcntl.LOCK_EX)
+            self.assertEqual(flight.do('key', lambda: 1), 1)
+
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(busy))
+        # Too young to go
+        self.assertTrue(os.path.exists(os.path.join(self.tmp_dir, 'key.lock')))
+
+    def test_lock_file_swept_before_locking_is_not_used(self):
+        flight = SingleFlight(lock_dir=self.tmp_dir)
+        lock_path = os.path.join(self.tmp_dir, 'key.lock')
+        real_flock = fcntl.flock
+        swept = []
+
+        def flock(lock_file, operation):
+            if operation == fcntl.LOCK_EX | fcntl.LOCK_NB and not swept:
+                # Removed by another process's sweep after this one opened it
+                swept.append(os.stat(lock_path).st_ino)
+                os.remove(lock_path)
+            return real_flock(lock_file, operation)
+
+        with patch('singleflight.fcntl.flock', side_effect=flock):
+            self.assertEqual(flight.do('key', lambda: 'ran'), 'ran')
+
+        self.assertEqual(flight.executions, 1)
+        self.assertTrue(os.path.exists(lock_path))
+
+    def test_outcome_written_just_after_the_lock_attempt_is_used(self):
+        flight = SingleFlight(lock_dir=self.tmp_dir)
+        real_flock = fcntl.flock
+        attempts = []
+
+        def flock(lock_file, operation):
+            if operation == fcntl.LOCK_EX | fcntl.LOCK_NB and not attempts:
+                attempts.append(operation)
+                # The leader finishes between this attempt and the wait for it
+                flight._write_outcome(os.path.join(self.tmp_dir, 'key.json'), {'ok': True, 'value': 'shared'})
+                raise BlockingIOError()
+            return real_flock(lock_file, operation)
+
+        with patch('singleflight.fcntl.flock', side_effect=flock):
+            self.assertEqual(flight.do('key', lambda: 'ran again'), 'shared')
+        self.assertEqual(flight.executions, 0)
+
+if __name__ == '__main__':
+    unittest.main(argv=['first-arg-is-ignored'], exit=False)